@@ -0,0 +1,517 @@
+"""Benchmarks for CustomShell, driven through the shell's real entry points.
+
+    python benchmarks.py run [--quick] [--only NAME ...] [-o results.json]
+    python benchmarks.py compare baseline.json [current.json] [--threshold 0.10]
+    python benchmarks.py builtins [-n 10000]
+
+'run' prints a summary and writes JSON; 'compare' re-runs the suite (or reads a
+second results file) and exits with status 1 if any metric regressed by more
+than the threshold against the baseline.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from contextlib import contextmanager
+
+import core_shell
+import command_exec
+import usability_features
+import completion_index
+from ui import set_decorations, get_colored_prompt, prompt_cwd_changed
+from piping_redirection import handle_pipe
+
+
+@contextmanager
+def silenced():
+    """Send fd 1 (and sys.stdout) to /dev/null so output cost is constant and nothing floods the terminal."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    old_stdout = sys.stdout
+    sys.stdout = open(1, 'w', closefd=False)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stdout = old_stdout
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def metric(value, unit, better='lower'):
+    return {'value': value, 'unit': unit, 'better': better}
+
+
+def timings(function, repeat):
+    """Run function repeat times; returns the individual durations in seconds."""
+    results = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        results.append(time.perf_counter() - started)
+    return results
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(len(ordered) * p / 100) - 1))]
+
+
+def time_script(lines):
+    """Run lines through the batch executor; returns elapsed seconds."""
+    with silenced():
+        started = time.perf_counter()
+        core_shell.run_script(lines)
+        return time.perf_counter() - started
+
+
+# --- Benchmarks ---
+# Each takes quick (bool) and returns {metric name: metric(...)}.
+
+def bench_launch(quick):
+    """Latency of run_command for a trivial external program, per spawn backend."""
+    true_path = shutil.which('true') or '/bin/true'
+    repeat = 100 if quick else 500
+    results = {}
+    previous = command_exec.spawn_backend
+    set_decorations(False)
+    try:
+        for backend in command_exec.SPAWN_BACKENDS:
+            if not command_exec.set_spawn_backend(backend):
+                continue
+            runs = timings(lambda: command_exec.run_command(true_path, []), repeat)
+            results[f'{backend}_median_us'] = metric(statistics.median(runs) * 1e6, 'us')
+            results[f'{backend}_p95_us'] = metric(percentile(runs, 95) * 1e6, 'us')
+    finally:
+        command_exec.set_spawn_backend(previous)
+    return results
+
+
+def bench_pipe(quick):
+    """Bytes per second through handle_pipe chains of cat stages."""
+    size = (32 if quick else 256) << 20
+    results = {}
+    set_decorations(False)
+    for cats in (1, 3):
+        chain = [['head', '-c', str(size), '/dev/zero']] + [['cat']] * cats + [['wc', '-c']]
+        with silenced():
+            runs = timings(lambda: handle_pipe(chain), 3)
+        results[f'{len(chain)}_stages_mb_s'] = metric(size / min(runs) / 1e6, 'MB/s', 'higher')
+    return results
+
+
+def bench_prompt(quick):
+    """Time to render the interactive prompt, steady state and right after a cd."""
+    repeat = 1000 if quick else 5000
+    get_colored_prompt()  # Let the VCS lookup populate its cache
+    time.sleep(0.05)
+    warm = timings(get_colored_prompt, repeat)
+
+    def after_cd():
+        prompt_cwd_changed()
+        get_colored_prompt()
+    changed = timings(after_cd, repeat // 10)
+    return {
+        'render_median_us': metric(statistics.median(warm) * 1e6, 'us'),
+        'render_p99_us': metric(percentile(warm, 99) * 1e6, 'us'),
+        'after_cd_median_us': metric(statistics.median(changed) * 1e6, 'us'),
+    }
+
+
+def bench_completion(quick):
+    """Path completion in a large directory (cold scan and warm lookup) and command completion."""
+    count = 10000 if quick else 100000
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='customshell-bench-')
+    try:
+        for i in range(count):
+            open(os.path.join(workdir, f'file_{i:06d}.txt'), 'w').close()
+        prefix = os.path.join(workdir, 'file_0123')
+
+        def cold():
+            # A new mtime forces a rescan, like a directory that just changed
+            st = os.stat(workdir)
+            os.utime(workdir, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+            completion_index.complete_path(prefix)
+        cold_runs = timings(cold, 3)
+        warm_runs = timings(lambda: completion_index.complete_path(prefix), 200)
+        command_runs = timings(lambda: completion_index.complete_command('py'), 200)
+        results[f'path_cold_{count}_ms'] = metric(min(cold_runs) * 1e3, 'ms')
+        results[f'path_warm_{count}_us'] = metric(statistics.median(warm_runs) * 1e6, 'us')
+        results['command_warm_us'] = metric(statistics.median(command_runs) * 1e6, 'us')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+@contextmanager
+def _history_file(lines):
+    """Point usability_features at a scratch history log holding `lines` entries."""
+    saved = (usability_features.HISTORY_FILE, usability_features.HISTORY_LENGTH,
+             usability_features._history_inode, usability_features._history_offset,
+             usability_features._history_appends)
+    workdir = tempfile.mkdtemp(prefix='customshell-bench-')
+    path = os.path.join(workdir, 'history')
+    with open(path, 'w') as f:
+        f.writelines(f"echo history entry {i}\n" for i in range(lines))
+    st = os.stat(path)
+    usability_features.HISTORY_FILE = path
+    usability_features.HISTORY_LENGTH = lines  # Compaction keeps the log at this size
+    usability_features._history_inode, usability_features._history_offset = st.st_ino, st.st_size
+    usability_features._history_appends = 0
+    try:
+        yield path
+    finally:
+        (usability_features.HISTORY_FILE, usability_features.HISTORY_LENGTH,
+         usability_features._history_inode, usability_features._history_offset,
+         usability_features._history_appends) = saved
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_history(quick):
+    """save_history cost with 10k and 100k-line logs (periodic compaction included)."""
+    appends = 256 if quick else 1024
+    results = {}
+    for lines in (10000, 100000):
+        with _history_file(lines):
+            runs = timings(lambda: usability_features.save_history('echo benchmark'), appends)
+        label = f'{lines // 1000}k'
+        results[f'save_{label}_mean_us'] = metric(statistics.mean(runs) * 1e6, 'us')
+        results[f'save_{label}_p99_us'] = metric(percentile(runs, 99) * 1e6, 'us')
+    return results
+
+
+def bench_startup(quick):
+    """Wall time to start main.py and exit: batch (-c true), interactive (-i, EOF at once), bare python."""
+    repeat = 20 if quick else 100
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    commands = {
+        'batch': [sys.executable, main_py, '-c', 'true'],
+        'interactive': [sys.executable, main_py, '-i'],
+        'interpreter': [sys.executable, '-c', 'pass'],
+    }
+    results = {}
+    for name, argv in commands.items():
+        runs = timings(lambda: subprocess.run(argv, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                              stderr=subprocess.DEVNULL), repeat)
+        results[f'{name}_median_ms'] = metric(statistics.median(runs) * 1e3, 'ms')
+    return results
+
+
+def bench_builtins(count):
+    """count alternating echo/test invocations, with the in-process builtins and without."""
+    lines = ['echo benchmark line' if i % 2 else 'test -d .' for i in range(count)]
+    results = {}
+    for mode in ('builtin', 'external'):
+        if mode == 'external':
+            core_shell.disabled_builtins.update(('echo', 'test'))
+        try:
+            elapsed = time_script(lines)
+        finally:
+            core_shell.disabled_builtins.difference_update(('echo', 'test'))
+        results[mode] = {'commands': count, 'seconds': elapsed, 'per_command_us': elapsed / count * 1e6}
+    results['speedup'] = results['external']['seconds'] / results['builtin']['seconds']
+    return results
+
+
+def bench_script(quick):
+    """Batch-mode throughput of fast-path builtins versus the same commands exec'd."""
+    results = bench_builtins(1000 if quick else 10000)
+    return {
+        'builtin_per_command_us': metric(results['builtin']['per_command_us'], 'us'),
+        'external_per_command_us': metric(results['external']['per_command_us'], 'us'),
+    }
+
+
+def bench_zerocopy(quick):
+    """MB/s of the splice/sendfile builtins (cat file > out, tee, pv) against the external programs."""
+    size = (64 if quick else 512) << 20
+    workdir = tempfile.mkdtemp(prefix='customshell-bench-')
+    source = os.path.join(workdir, 'source')
+    with open(source, 'wb') as f:
+        block = os.urandom(1 << 20)
+        for _ in range(size >> 20):
+            f.write(block)
+    scripts = {
+        'cat_file': [f"cat {source} > {workdir}/copy"],
+        'tee': [f"cat {source} | tee {workdir}/copy | wc -c"],
+        'pv': [f"cat {source} | pv -q | wc -c"],
+    }
+    builtins = ('cat', 'tee', 'pv')
+    results = {}
+    set_decorations(False)
+    try:
+        for name, lines in scripts.items():
+            for mode in ('builtin', 'external'):
+                if mode == 'external':
+                    if name == 'pv' and not shutil.which('pv'):
+                        continue
+                    core_shell.disabled_builtins.update(builtins)
+                try:
+                    runs = [time_script(lines) for _ in range(3)]
+                finally:
+                    core_shell.disabled_builtins.difference_update(builtins)
+                results[f'{name}_{mode}_mb_s'] = metric(size / min(runs) / 1e6, 'MB/s', 'higher')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def _memory_kb(pid, fields=('Private_Clean:', 'Private_Dirty:')):
+    """Sum of smaps_rollup fields; by default the memory only this process uses (not shared copy-on-write)."""
+    total = 0
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            if line.startswith(fields):
+                total += int(line.split()[1])
+    return total
+
+
+def bench_daemon(quick):
+    """Standalone shell versus a daemon session: batch startup, a GUI-style job launch, spare memory."""
+    import shell_client
+    from functools import partial
+    repeat = 20 if quick else 100
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    workdir = tempfile.mkdtemp(prefix='customshell-bench-')
+    path = os.path.join(workdir, 'daemon.sock')
+    env = dict(os.environ, CUSTOMSHELL_SOCKET=path)
+    daemon = subprocess.Popen([sys.executable, main_py, '--daemon'], env=env,
+                              stdin=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results = {}
+    try:
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.05)
+        for name, argv in (('standalone', [sys.executable, main_py, '-c', 'true']),
+                           ('attached', [sys.executable, main_py, '--attach', '-c', 'true'])):
+            runs = timings(lambda: subprocess.run(argv, env=env, stdin=subprocess.DEVNULL,
+                                                  stdout=subprocess.DEVNULL), repeat)
+            results[f'batch_{name}_median_ms'] = metric(statistics.median(runs) * 1e3, 'ms')
+
+        # A forked shell per job (what the GUI did before it stopped forking) or a daemon session
+        set_decorations(False)
+        request = {'mode': 'line', 'line': 'true', 'cwd': os.getcwd(), 'env': dict(os.environ)}
+        devnull = os.open(os.devnull, os.O_RDWR)
+
+        def local():
+            actions = [(command_exec.SPAWN_DUP2, devnull, fd) for fd in (0, 1, 2)]
+            with command_exec.job_lock:
+                pid = command_exec.spawn_function(partial(core_shell.execute_line, 'true', {}), actions)
+                job = command_exec.add_job([pid], None, 'true', True)
+            command_exec.wait_for_job(job)
+
+        def attached():
+            sock, _ = shell_client.start(request, (devnull, devnull, devnull), path)
+            shell_client.finish(sock)
+        try:
+            for name, function in (('fork', local), ('daemon', attached)):
+                runs = timings(function, repeat)
+                results[f'job_{name}_median_ms'] = metric(statistics.median(runs) * 1e3, 'ms')
+        finally:
+            os.close(devnull)
+
+        time.sleep(0.2)  # Let the daemon refill its spares
+        with open(f'/proc/{daemon.pid}/task/{daemon.pid}/children') as f:
+            spares = []
+            for pid in f.read().split():
+                try:
+                    spares.append(_memory_kb(pid))
+                except OSError:
+                    pass  # A finished session not reaped yet
+        if spares:
+            results['spare_private_kb'] = metric(min(spares), 'KB')
+        results['daemon_rss_kb'] = metric(_memory_kb(daemon.pid, ('Rss:',)), 'KB')
+    finally:
+        daemon.terminate()
+        daemon.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def bench_gui_jobs(quick):
+    """Submit-to-finished latency of a GUI job, started by 'main.py -c' and by the GUI's helper daemon."""
+    import threading
+    from output_pump import OutputPump
+    from gui_jobs import Session, JobScheduler, HelperDaemon
+    repeat = 10 if quick else 50
+    pump = OutputPump(lambda text: None)
+    finished = threading.Event()
+    helper = HelperDaemon()
+    results = {}
+    try:
+        daemon = helper.wait_ready()
+        for name, path in (('exec', None), ('daemon', daemon)):
+            scheduler = JobScheduler(Session(), {}, pump, lambda job: job.active or finished.set(),
+                                     workers=1, use_pty=False, daemon=path)
+
+            def job():
+                finished.clear()
+                scheduler.submit('true')
+                finished.wait()
+            job()  # Warm up (the daemon's first session loads what a spare shares)
+            runs = timings(job, repeat)
+            results[f'{name}_median_ms'] = metric(statistics.median(runs) * 1e3, 'ms')
+            results[f'{name}_p90_ms'] = metric(percentile(runs, 90) * 1e3, 'ms')
+    finally:
+        helper.stop()
+        pump.close()
+    return results
+
+
+def bench_expansion(quick):
+    """Parameter expansion in the shell versus 'sh -c', $(...) latency, and $(...) capture throughput."""
+    count = 200 if quick else 1000
+    text = 'echo $HOME ${UNSET_VAR:-default} "${PWD##*/}"'
+    size = 8 << 20
+    workdir = tempfile.mkdtemp(prefix='customshell-bench-')
+    source = os.path.join(workdir, 'source')
+    with open(source, 'wb') as f:
+        f.write(b'x' * size)
+    results = {}
+    set_decorations(False)
+    try:
+        for name, line in (('expand', text), ('sh_c', f"sh -c '{text}'"), ('subst', 'x=$(echo hi)')):
+            elapsed = time_script([line] * count)
+            results[f'{name}_per_command_us'] = metric(elapsed / count * 1e6, 'us')
+        runs = [time_script([f'x=$(cat {source})']) for _ in range(3 if quick else 10)]
+        results['capture_mb_s'] = metric(size / min(runs) / 1e6, 'MB/s', 'higher')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+BENCHMARKS = {
+    'launch': bench_launch,
+    'pipe': bench_pipe,
+    'prompt': bench_prompt,
+    'completion': bench_completion,
+    'history': bench_history,
+    'script': bench_script,
+    'startup': bench_startup,
+    'zerocopy': bench_zerocopy,
+    'daemon': bench_daemon,
+    'gui_jobs': bench_gui_jobs,
+    'expansion': bench_expansion,
+}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suite(names=None, quick=False):
+    """Run the selected benchmarks; returns the JSON-ready results document."""
+    results = {}
+    for name in names or BENCHMARKS:
+        print(f"running {name}...", file=sys.stderr)
+        results[name] = BENCHMARKS[name](quick)
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'quick': quick,
+        },
+        'results': results,
+    }
+
+
+def print_results(document):
+    for bench, metrics in document['results'].items():
+        for name, m in metrics.items():
+            print(f"{bench:11} {name:28} {m['value']:12.2f} {m['unit']}")
+
+
+def compare(baseline, current, threshold):
+    """Print a metric-by-metric comparison; returns the list of regressed metric names."""
+    regressions = []
+    print(f"{'metric':40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for bench, metrics in current['results'].items():
+        for name, m in metrics.items():
+            base = baseline['results'].get(bench, {}).get(name)
+            if base is None or not base['value']:
+                continue
+            change = (m['value'] - base['value']) / base['value']
+            worse = change > threshold if m['better'] == 'lower' else change < -threshold
+            better = change < -threshold if m['better'] == 'lower' else change > threshold
+            flag = 'REGRESSION' if worse else 'improved' if better else ''
+            label = f"{bench}.{name}"
+            print(f"{label:40} {base['value']:12.2f} {m['value']:12.2f} {change:+8.1%} {flag}")
+            if worse:
+                regressions.append(label)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CustomShell benchmarks.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help="run the benchmark suite and write JSON results")
+    run.add_argument('--quick', action='store_true', help="smaller inputs, fewer repetitions")
+    run.add_argument('--only', nargs='+', choices=list(BENCHMARKS), metavar='NAME')
+    run.add_argument('-o', '--output', help="results file (default: print JSON to stdout)")
+
+    cmp = sub.add_parser('compare', help="compare results against a saved baseline")
+    cmp.add_argument('baseline')
+    cmp.add_argument('current', nargs='?', help="results file (default: run the suite now)")
+    cmp.add_argument('--threshold', type=float, default=0.10, help="allowed relative slowdown (default 0.10)")
+    cmp.add_argument('--quick', action='store_true')
+
+    builtins = sub.add_parser('builtins', help="echo/test with and without the in-process fast path")
+    builtins.add_argument('-n', '--count', type=int, default=10000)
+    options = parser.parse_args(argv)
+
+    if options.command == 'builtins':
+        results = bench_builtins(options.count)
+        for mode in ('builtin', 'external'):
+            r = results[mode]
+            print(f"{mode:9} {r['commands']:7} commands  {r['seconds']:8.3f} s  {r['per_command_us']:9.1f} us/command")
+        print(f"speedup   {results['speedup']:.1f}x")
+        return 0
+
+    if options.command == 'run':
+        document = run_suite(options.only, options.quick)
+        text = json.dumps(document, indent=2)
+        if options.output:
+            with open(options.output, 'w') as f:
+                f.write(text + '\n')
+            print_results(document)
+        else:
+            print(text)
+        return 0
+
+    with open(options.baseline) as f:
+        baseline = json.load(f)
+    if options.current:
+        with open(options.current) as f:
+            current = json.load(f)
+    else:
+        names = [name for name in baseline['results'] if name in BENCHMARKS]
+        current = run_suite(names, options.quick or baseline['meta'].get('quick', False))
+    regressions = compare(baseline, current, options.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    print("No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
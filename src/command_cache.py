@@ -0,0 +1,349 @@
+import os
+import sys
+import time
+import fcntl
+import threading
+
+from command_exec import resolve_command
+from fast_builtins import _write_bytes
+from ui import print_error, print_info, set_decorations
+from zero_copy import tee, copy_fd
+
+# The 'cache' prefix builtin: run a deterministic command once and replay its
+# stdout, stderr and exit status while nothing it depends on has changed.
+#
+#   cache [-i FILE]... [-e VAR]... [-r] [--] command [args...]
+#   cache -s | -c
+#
+# The key covers argv, the resolved program, the cwd, the -e variables and the
+# mtime/size/inode of each -i input (a directory's own entry, so adding or
+# removing names in it counts, edits deeper down do not). Entries live in
+# CACHE_DIR as <key>.out, <key>.err and <key>.meta, the .meta written last so
+# a half-stored entry is never replayed. When the store grows past
+# CACHE_MAX_BYTES the least recently used entries go first.
+
+CACHE_DIR = os.path.expanduser(os.environ.get('CUSTOMSHELL_CACHE_DIR', '~/.customshell_cache'))
+try:
+    CACHE_MAX_BYTES = int(os.environ.get('CUSTOMSHELL_CACHE_SIZE', 256 << 20))
+except ValueError:
+    CACHE_MAX_BYTES = 256 << 20
+KEY_VERSION = 1             # Bump when the key or entry format changes
+CAPTURE_GRACE = 0.5         # Seconds to wait for background processes to let go of the capture pipes
+USAGE = "cache [-i FILE]... [-e VAR]... [-r] [--] command [args...] | cache -s | cache -c"
+STAT_FIELDS = ('hits', 'misses', 'stores', 'evictions', 'bytes_replayed', 'seconds_saved')
+
+
+def _path(name):
+    return os.path.join(CACHE_DIR, name)
+
+
+class _Locked:
+    """Exclusive flock on the store, held while entries are added, evicted or counted."""
+
+    def __enter__(self):
+        os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+        self.fd = os.open(_path('lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        os.close(self.fd)  # Also releases the lock
+
+
+def fingerprint(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (path, None)
+    return (path, st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def cache_key(argv, inputs=(), env_names=()):
+    import hashlib
+    parts = (KEY_VERSION, argv, resolve_command(argv[0], remember=False), os.getcwd(),
+             [(name, os.environ.get(name)) for name in sorted(env_names)],
+             [fingerprint(path) for path in inputs])
+    return hashlib.sha256(repr(parts).encode('utf-8', 'surrogateescape')).hexdigest()
+
+
+# --- Statistics ---
+# Kept in CACHE_DIR/stats as 'name value' lines, shared by every shell using the store
+
+def read_stats():
+    stats = dict.fromkeys(STAT_FIELDS, 0)
+    try:
+        with open(_path('stats')) as f:
+            for line in f:
+                name, _, value = line.partition(' ')
+                if name in stats:
+                    stats[name] = float(value) if name == 'seconds_saved' else int(value)
+    except (OSError, ValueError):
+        pass
+    return stats
+
+
+def _count(**changes):
+    """Add changes to the shared counters; call with the store locked."""
+    stats = read_stats()
+    for name, value in changes.items():
+        stats[name] += value
+    tmp = _path(f'stats.tmp-{os.getpid()}')
+    with open(tmp, 'w') as f:
+        f.writelines(f"{name} {stats[name]}\n" for name in STAT_FIELDS)
+    os.replace(tmp, _path('stats'))
+
+
+def _entries():
+    """(last used, size, key) for every complete entry, plus the total size of the store."""
+    sizes, used = {}, {}
+    for entry in os.scandir(CACHE_DIR):
+        key, dot, kind = entry.name.partition('.')
+        if not dot or kind not in ('out', 'err', 'meta'):
+            continue
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        sizes[key] = sizes.get(key, 0) + st.st_size
+        if kind == 'meta':
+            used[key] = st.st_mtime
+    entries = [(used.get(key, 0), size, key) for key, size in sizes.items()]
+    return entries, sum(sizes.values())
+
+
+def _remove(key):
+    for kind in ('meta', 'out', 'err'):
+        try:
+            os.unlink(_path(f'{key}.{kind}'))
+        except FileNotFoundError:
+            pass
+
+
+def evict(limit=None):
+    """Drop least recently used entries until the store fits in limit bytes; returns how many went."""
+    limit = CACHE_MAX_BYTES if limit is None else limit
+    entries, total = _entries()
+    entries.sort()
+    evicted = 0
+    for _, size, key in entries:
+        if total <= limit:
+            break
+        _remove(key)
+        total -= size
+        evicted += 1
+    return evicted
+
+
+# --- Running and replaying ---
+
+def lookup(key):
+    """Replay a stored entry to stdout/stderr.
+
+    Returns (status, seconds the original run took, bytes replayed), or None on a miss.
+    """
+    try:
+        with open(_path(f'{key}.meta')) as f:
+            status, elapsed = f.read().split()
+        # Both output files must be there; a concurrent eviction may have taken them
+        fds = [os.open(_path(f'{key}.{kind}'), os.O_RDONLY) for kind in ('out', 'err')]
+    except (OSError, ValueError):
+        return None
+    os.utime(_path(f'{key}.meta'))  # Most recently used
+    replayed = 0
+    try:
+        for source, stream in zip(fds, (sys.stdout, sys.stderr)):
+            out = _stream_fd(stream)
+            if out is None:
+                data = os.read(source, os.fstat(source).st_size)
+                _write_bytes(data, stream)
+                replayed += len(data)
+            else:
+                replayed += copy_fd(source, out)
+    finally:
+        for fd in fds:
+            os.close(fd)
+    return int(status), float(elapsed), replayed
+
+
+def _stream_fd(stream):
+    try:
+        fd = stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+    stream.flush()
+    return fd
+
+
+def _tee_and_close(read_fd, targets):
+    """Copy a capture pipe until EOF, then close it and its targets (they belong to this thread)."""
+    try:
+        tee(read_fd, targets)
+    finally:
+        for fd in [read_fd] + targets:
+            os.close(fd)
+
+
+def run_captured(run, out_path, err_path):
+    """Call run() with fds 1 and 2 going through pipes that are copied both to the
+    original outputs (live) and to out_path/err_path.
+
+    Returns (run()'s status, complete). complete is False when something the command
+    left running in the background still holds the pipes CAPTURE_GRACE seconds after
+    it returned: the shell goes on, the copying goes on in the background until that
+    process exits, and the capture is incomplete, so it must not be stored.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # Above the fds a redirection inside run() is likely to target ('3>file')
+    saved = {fd: fcntl.fcntl(fd, fcntl.F_DUPFD_CLOEXEC, 10) for fd in (1, 2)}
+    threads = []
+    old_streams = sys.stdout, sys.stderr
+    decorate = set_decorations(False)  # Status lines would be cached as output
+    try:
+        for fd, path in ((1, out_path), (2, err_path)):
+            file_fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+            read_fd, write_fd = os.pipe()
+            os.dup2(write_fd, fd)
+            os.close(write_fd)
+            # The thread gets its own copy of the original output to write to and close
+            target = fcntl.fcntl(saved[fd], fcntl.F_DUPFD_CLOEXEC, 10)
+            thread = threading.Thread(target=_tee_and_close, args=(read_fd, [file_fd, target]),
+                                      name=f'cache-tee-{fd}', daemon=True)
+            thread.start()
+            threads.append(thread)
+        sys.stdout = open(1, 'w', closefd=False)
+        sys.stderr = open(2, 'w', closefd=False)
+        status = run()
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except OSError:
+                pass
+        sys.stdout, sys.stderr = old_streams
+        set_decorations(decorate)
+        # Putting the real fds back closes the pipes' last write ends: the copies see EOF
+        # (unless a background process of the command still has them)
+        for fd, copy in saved.items():
+            os.dup2(copy, fd)
+            os.close(copy)
+        deadline = time.monotonic() + CAPTURE_GRACE
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+    return status, not any(thread.is_alive() for thread in threads)
+
+
+def store(key, status, elapsed, out_tmp, err_tmp):
+    """Move a finished run's captured output into the store and evict down to the size cap."""
+    size = os.path.getsize(out_tmp) + os.path.getsize(err_tmp)
+    if size > CACHE_MAX_BYTES:
+        return False
+    with _Locked():
+        os.replace(out_tmp, _path(f'{key}.out'))
+        os.replace(err_tmp, _path(f'{key}.err'))
+        meta_tmp = _path(f'{key}.meta.tmp-{os.getpid()}')
+        with open(meta_tmp, 'w') as f:
+            f.write(f"{status} {elapsed:.6f}\n")
+        os.replace(meta_tmp, _path(f'{key}.meta'))
+        _count(stores=1, evictions=evict())
+    return True
+
+
+def print_stats():
+    stats = read_stats()
+    lookups = stats['hits'] + stats['misses']
+    rate = stats['hits'] / lookups * 100 if lookups else 0.0
+    entries, total = _entries() if os.path.isdir(CACHE_DIR) else ([], 0)
+    print(f"lookups    {lookups}")
+    print(f"hits       {stats['hits']} ({rate:.1f}%)")
+    print(f"misses     {stats['misses']}")
+    print(f"stored     {stats['stores']} (evicted {stats['evictions']})")
+    print(f"entries    {len(entries)}, {total / (1 << 20):.1f} MiB of {CACHE_MAX_BYTES / (1 << 20):.0f} MiB")
+    print(f"replayed   {stats['bytes_replayed'] / (1 << 20):.1f} MiB")
+    print(f"time saved {stats['seconds_saved']:.2f}s")
+
+
+def clear():
+    if not os.path.isdir(CACHE_DIR):
+        return
+    with _Locked():
+        for _, _, key in _entries()[0]:
+            _remove(key)
+        try:
+            os.unlink(_path('stats'))
+        except FileNotFoundError:
+            pass
+
+
+def parse_options(args):
+    """Returns (inputs, env_names, refresh, argv); raises ValueError with a message."""
+    inputs, env_names, refresh = [], [], False
+    i = 0
+    while i < len(args) and args[i].startswith('-'):
+        option = args[i]
+        i += 1
+        if option == '--':
+            break
+        if option == '-r':
+            refresh = True
+        elif option in ('-i', '-e'):
+            if i >= len(args):
+                raise ValueError(f"{option}: option requires an argument")
+            (inputs if option == '-i' else env_names).append(args[i])
+            i += 1
+        else:
+            raise ValueError(f"{option}: invalid option")
+    if i >= len(args):
+        raise ValueError("no command given")
+    return inputs, env_names, refresh, args[i:]
+
+
+def run_cached(args, run):
+    """Entry point for the builtin; run(argv) executes the command in the shell and returns its status."""
+    if args in (['-s'], ['-c']):
+        if args == ['-s']:
+            print_stats()
+        else:
+            clear()
+            print_info("Command cache cleared.")
+        return 0
+    try:
+        inputs, env_names, refresh, argv = parse_options(args)
+    except ValueError as e:
+        print_error(f"cache: {e}")
+        print_error(f"usage: {USAGE}")
+        return 2
+    if _stream_fd(sys.stdout) is None:
+        # Nothing to capture from (the GUI's own output object): just run it
+        return run(argv)
+
+    key = cache_key(argv, inputs, env_names)
+    if not refresh:
+        started = time.monotonic()
+        hit = lookup(key)
+        if hit is not None:
+            status, elapsed, replayed = hit
+            with _Locked():
+                _count(hits=1, bytes_replayed=replayed,
+                       seconds_saved=max(0.0, elapsed - (time.monotonic() - started)))
+            return status
+
+    os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+    tmp = _path(f'{key}.tmp-{os.getpid()}')
+    out_tmp, err_tmp = tmp + '-out', tmp + '-err'
+    try:
+        started = time.monotonic()
+        status, complete = run_captured(lambda: run(argv), out_tmp, err_tmp)
+        elapsed = time.monotonic() - started
+        # Stopped or killed runs (and commands that were never found) are not worth replaying
+        if status < 126 and complete:
+            store(key, status, elapsed, out_tmp, err_tmp)
+        with _Locked():
+            _count(misses=1)
+        return status
+    finally:
+        for path in (out_tmp, err_tmp):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
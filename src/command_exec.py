@@ -1,64 +1,734 @@
 import os
-from ui import print_error, print_success, print_info
+import sys
+import time
+import fcntl
+import signal
+import termios
+import threading
+from ui import print_error, print_success, print_info, print_failure, set_decorations
+import resource_stats
 
 # --- Global Job Management ---
-jobs = []
+# Job id -> job dict:
+#   {'id', 'pgid', 'pids', 'procs': {pid: waitpid status or None while alive},
+#    'stopped': {pid: stop signal}, 'command', 'state': 'Running' | 'Stopped' | 'Done',
+#    'foreground', 'reported' (last state shown to the user), 'tmodes',
+#    'names' (argv[0] of each stage), 'started' (monotonic), 'rusage': {pid: struct_rusage},
+#    'usage' (totals, set once the job is Done)}
+jobs = {}
 
-def run_command(command, args, background=False):
-    """Run external command with fork/execvp and job control, returning the exit status."""
-    full_args = [command] + args
-    
+# Guards the job table; notified whenever the reaper records a state change
+job_lock = threading.Condition()
+_pid_jobs = {}           # pid -> job id, only for processes not yet reaped
+_job_order = []          # job ids, most recently stopped/backgrounded last (%+)
+_spawn_generation = 0    # bumped on every launch so an idle reaper knows to retry
+_reaper = None
+_trackers = []           # Active UsageTrackers ('time'); each sees every child reaped
+
+# --- Shell Options (set -o / set +o) ---
+shell_options = {'pipefail': False, 'noclobber': False, 'dotglob': False, 'globstar': True}
+
+# Job control: every job in its own process group. Off for batch runs, where children
+# stay in the shell's group like in a non-interactive sh.
+job_control = False
+# Controlling terminal fd when the shell hands the terminal to foreground jobs, else None
+shell_terminal = None
+shell_pgid = os.getpgrp()
+shell_tmodes = None
+
+# --- Command Hash Table ---
+# Maps a command name to {'path': absolute path, 'hits': launch count, 'dir': PATH index}
+command_hash = {}
+HASH_CHECK_INTERVAL = 1.0  # Seconds between PATH directory mtime checks
+
+_hash_path = None        # PATH value the table was built against
+_hash_dir_mtimes = []    # mtime of every PATH directory, in PATH order
+_hash_checked_at = 0.0
+
+
+def path_dirs():
+    """Return the directories of $PATH in search order."""
+    return [d or '.' for d in os.environ.get('PATH', os.defpath).split(os.pathsep)]
+
+
+def _dir_mtime(directory):
     try:
-        pid = os.fork()
-        if pid == 0:
-            # Child process: Exec the command
-            os.execvp(command, full_args)
-            # This part is only reached if execvp fails
-            os._exit(1)
-            
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _validate_hash():
+    """Drop hashed entries made stale by a PATH change or a PATH directory change."""
+    global _hash_path, _hash_dir_mtimes, _hash_checked_at
+    current_path = os.environ.get('PATH', os.defpath)
+    if current_path != _hash_path:
+        # Different search order: nothing in the table can be trusted
+        command_hash.clear()
+        _hash_path = current_path
+        _hash_dir_mtimes = [_dir_mtime(d) for d in path_dirs()]
+        _hash_checked_at = time.monotonic()
+        return
+
+    now = time.monotonic()
+    if now - _hash_checked_at < HASH_CHECK_INTERVAL:
+        return
+    _hash_checked_at = now
+
+    mtimes = [_dir_mtime(d) for d in path_dirs()]
+    changed = [i for i, (old, new) in enumerate(zip(_hash_dir_mtimes, mtimes)) if old != new]
+    _hash_dir_mtimes = mtimes
+    if changed:
+        # A change in directory i can shadow or remove anything found at index >= i
+        first = changed[0]
+        for name in [n for n, e in command_hash.items() if e['dir'] >= first]:
+            del command_hash[name]
+
+
+def find_in_path(command):
+    """Search $PATH for an executable, returning (path, dir index) or (None, None)."""
+    for i, directory in enumerate(path_dirs()):
+        candidate = os.path.join(directory, command)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate, i
+    return None, None
+
+
+def resolve_command(command, remember=True):
+    """Resolve a command name to an executable path, using the hash table when possible."""
+    if '/' in command:
+        # Explicit paths are never hashed (same as bash)
+        return command
+
+    _validate_hash()
+    entry = command_hash.get(command)
+    if entry:
+        if remember:
+            entry['hits'] += 1
+        return entry['path']
+
+    path, index = find_in_path(command)
+    if path and remember:
+        command_hash[command] = {'path': path, 'hits': 1, 'dir': index}
+    return path
+
+
+def clear_hash():
+    """Forget every remembered command location (hash -r)."""
+    command_hash.clear()
+
+
+# --- Spawn Backend ---
+# 'spawn' uses os.posix_spawn (vfork-style, no page-table copy of the interpreter);
+# 'fork' is the classic fork+exec fallback. Override with $CUSTOMSHELL_SPAWN.
+SPAWN_BACKENDS = ('spawn', 'fork')
+spawn_backend = os.environ.get('CUSTOMSHELL_SPAWN', 'spawn' if hasattr(os, 'posix_spawn') else 'fork')
+if spawn_backend not in SPAWN_BACKENDS:
+    spawn_backend = 'fork'
+
+# Python ignores SIGPIPE and the shell may catch others; children must start with defaults
+CHILD_DEFAULT_SIGNALS = {signal.SIGPIPE, signal.SIGINT, signal.SIGQUIT,
+                         signal.SIGTSTP, signal.SIGTTIN, signal.SIGTTOU, signal.SIGCHLD}
+
+# File actions use the os.posix_spawn tuple format for both backends:
+#   (os.POSIX_SPAWN_OPEN, fd, path, flags, mode)
+#   (os.POSIX_SPAWN_DUP2, fd, new_fd)
+#   (os.POSIX_SPAWN_CLOSE, fd)
+SPAWN_OPEN = getattr(os, 'POSIX_SPAWN_OPEN', 0)
+SPAWN_CLOSE = getattr(os, 'POSIX_SPAWN_CLOSE', 1)
+SPAWN_DUP2 = getattr(os, 'POSIX_SPAWN_DUP2', 2)
+
+
+def set_spawn_backend(name):
+    """Select the process launch backend, returning True if it is usable here."""
+    global spawn_backend
+    if name not in SPAWN_BACKENDS or (name == 'spawn' and not hasattr(os, 'posix_spawn')):
+        return False
+    spawn_backend = name
+    return True
+
+
+def _apply_file_actions(file_actions):
+    """Perform posix_spawn-style file actions by hand (fork backend, runs in the child)."""
+    for action in file_actions:
+        if action[0] == SPAWN_OPEN:
+            _, fd, path, flags, mode = action
+            opened = os.open(path, flags, mode)
+            if opened != fd:
+                os.dup2(opened, fd)
+                os.close(opened)
+            else:
+                os.set_inheritable(fd, True)
+        elif action[0] == SPAWN_DUP2:
+            os.dup2(action[1], action[2])
+        elif action[0] == SPAWN_CLOSE:
+            try:
+                os.close(action[1])
+            except OSError:
+                pass
+
+
+class LimitError(OSError):
+    """A child could not apply its job limits (e.g. a negative nice without privilege)."""
+
+
+def _fork_exec(path, argv, env, file_actions, setpgroup, limits=None):
+    """fork+exec fallback; exec failures in the child are reported back through a pipe."""
+    err_r, err_w = os.pipe()
+    # Keep the error pipe above the fds a redirection is likely to target
+    high_w = fcntl.fcntl(err_w, fcntl.F_DUPFD_CLOEXEC, 10)
+    os.close(err_w)
+
+    pid = os.fork()
+    if pid == 0:
+        applying = False
+        try:
+            os.close(err_r)
+            if setpgroup is not None:
+                os.setpgid(0, setpgroup)
+            for sig in CHILD_DEFAULT_SIGNALS:
+                signal.signal(sig, signal.SIG_DFL)
+            _apply_file_actions(file_actions)
+            if limits:
+                applying = True
+                limits.apply()
+                applying = False
+            os.execve(path, argv, env)
+        except OSError as e:
+            report = str(e.errno or 1)
+            if applying:
+                # Keep the limit's own message (which flag, why), not just the errno
+                report += f" limits {e.strerror or ''}"
+            os.write(high_w, report.encode())
+        finally:
+            os._exit(127)
+
+    os.close(high_w)
+    data = b''
+    while True:
+        chunk = os.read(err_r, 64)
+        if not chunk:
+            break
+        data += chunk
+    os.close(err_r)
+    if data:
+        # exec never happened; collect the child (unless the reaper got it) and raise like posix_spawn
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+        err, _, detail = data.decode().partition(' ')
+        err = int(err)
+        if detail:
+            raise LimitError(err, detail.partition(' ')[2] or os.strerror(err))
+        raise OSError(err, os.strerror(err))
+    return pid
+
+
+def spawn_process(path, argv, file_actions=(), setpgroup=None, env=None, limits=None):
+    """Start the executable at path with argv in a new process and return its pid.
+
+    limits (job_limits.JobLimits) are applied in the child before the exec, which
+    posix_spawn cannot do, so constrained commands always take the fork backend.
+    Raises OSError if the file actions, the limits or the exec itself fail.
+    """
+    if env is None:
+        env = os.environ
+    if limits:
+        return _fork_exec(path, argv, env, file_actions, setpgroup, limits)
+    if spawn_backend == 'spawn':
+        kwargs = {'setsigdef': CHILD_DEFAULT_SIGNALS}
+        if setpgroup is not None:
+            kwargs['setpgroup'] = setpgroup
+        return os.posix_spawn(path, argv, env, file_actions=list(file_actions), **kwargs)
+    return _fork_exec(path, argv, env, file_actions, setpgroup)
+
+
+def spawn_function(function, file_actions=(), setpgroup=None, limits=None):
+    """Run function() in a forked copy of the shell and return the child's pid.
+
+    Used for subshells and for builtins or compound commands inside pipelines. The child
+    applies file_actions and limits, exits with the function's return value and never
+    returns here.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            if setpgroup is not None:
+                os.setpgid(0, setpgroup)
+            for sig in CHILD_DEFAULT_SIGNALS:
+                signal.signal(sig, signal.SIG_DFL)
+            _apply_file_actions(file_actions)
+            if limits:
+                try:
+                    limits.apply()
+                except OSError as e:
+                    print_error(f"Cannot apply limits ({limits.describe()}): {e.strerror or e}")
+                    raise SystemExit(126)
+            # Status lines would end up in the pipe; the GUI's queue-backed streams go nowhere
+            set_decorations(False)
+            sys.stdout = open(1, 'w', closefd=False)
+            sys.stderr = open(2, 'w', closefd=False)
+            status = function()
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+        except KeyboardInterrupt:
+            status = 128 + signal.SIGINT
+        except BaseException as e:
+            print_error(str(e))
+        finally:
+            for stream in (sys.stdout, sys.stderr):
+                try:
+                    stream.flush()
+                except (OSError, ValueError):
+                    pass
+            os._exit((status or 0) & 0xFF)
+    if setpgroup is not None:
+        # Also set it from the parent so the group exists before anyone signals it
+        try:
+            os.setpgid(pid, setpgroup or pid)
+        except OSError:
+            pass
+    return pid
+
+
+def init_job_control(use_terminal=True):
+    """Enable job control; with a terminal, take its foreground process group so it can be handed out."""
+    global job_control, shell_terminal, shell_pgid, shell_tmodes
+    job_control = True
+    if not use_terminal or not os.isatty(0):
+        return
+    # Wait until we are the foreground job of the terminal we were started from
+    while os.tcgetpgrp(0) != os.getpgrp():
+        os.killpg(os.getpgrp(), signal.SIGTTIN)
+
+    # Ctrl-Z/Ctrl-\ are for jobs, and tcsetpgrp from the background raises SIGTTOU
+    for sig in (signal.SIGTSTP, signal.SIGTTIN, signal.SIGTTOU, signal.SIGQUIT):
+        signal.signal(sig, signal.SIG_IGN)
+    try:
+        os.setpgid(0, 0)
+    except PermissionError:
+        pass  # Already a session leader
+    shell_pgid = os.getpgrp()
+    os.tcsetpgrp(0, shell_pgid)
+    shell_tmodes = termios.tcgetattr(0)
+    shell_terminal = 0
+
+
+def give_terminal_to(pgid, tmodes=None):
+    """Make pgid the terminal's foreground process group (no-op without a terminal)."""
+    if shell_terminal is None:
+        return
+    try:
+        os.tcsetpgrp(shell_terminal, pgid)
+        if tmodes is not None:
+            termios.tcsetattr(shell_terminal, termios.TCSADRAIN, tmodes)
+    except (OSError, termios.error):
+        pass
+
+
+def _reclaim_terminal(job):
+    """Take the terminal back after a foreground job, remembering its modes if it stopped."""
+    if shell_terminal is None:
+        return
+    try:
+        os.tcsetpgrp(shell_terminal, shell_pgid)
+        if job['state'] == 'Stopped':
+            job['tmodes'] = termios.tcgetattr(shell_terminal)
+        termios.tcsetattr(shell_terminal, termios.TCSADRAIN, shell_tmodes)
+    except (OSError, termios.error):
+        pass
+
+
+def exit_status(status):
+    """Convert a waitpid status into a shell exit code (128+N for signal N)."""
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return 128 + os.WSTOPSIG(status)
+
+
+# --- Child Reaper ---
+def _reaper_loop():
+    """Reap every child the moment it changes state and record it in the job table."""
+    while True:
+        with job_lock:
+            generation = _spawn_generation
+        try:
+            pid, status, rusage = os.wait4(-1, os.WUNTRACED | os.WCONTINUED)
+        except ChildProcessError:
+            # No children right now: sleep until the next launch
+            with job_lock:
+                while _spawn_generation == generation:
+                    job_lock.wait()
+            continue
+        with job_lock:
+            _record_status(pid, status, rusage)
+            job_lock.notify_all()
+
+
+def _ensure_reaper():
+    global _reaper
+    if _reaper is None or not _reaper.is_alive():
+        _reaper = threading.Thread(target=_reaper_loop, name='reaper', daemon=True)
+        _reaper.start()
+
+
+def _reset_after_fork():
+    """A forked shell child starts with an empty job table and no reaper thread."""
+    global job_lock, _reaper, _spawn_generation, job_control, shell_terminal
+    job_lock = threading.Condition()
+    _reaper = None
+    _spawn_generation = 0
+    jobs.clear()
+    _pid_jobs.clear()
+    _job_order.clear()
+    _trackers.clear()
+    # A subshell runs its jobs in its own process group, without the terminal
+    job_control = False
+    shell_terminal = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class UsageTracker:
+    """Sums the resource usage of every child reaped while active (for 'time')."""
+
+    def __init__(self):
+        self.user = 0.0
+        self.sys = 0.0
+        self.maxrss = 0
+        self.nvcsw = 0
+        self.nivcsw = 0
+
+    def add(self, rusage):
+        self.user += rusage.ru_utime
+        self.sys += rusage.ru_stime
+        self.maxrss = max(self.maxrss, rusage.ru_maxrss)
+        self.nvcsw += rusage.ru_nvcsw
+        self.nivcsw += rusage.ru_nivcsw
+
+    def __enter__(self):
+        with job_lock:
+            _trackers.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        with job_lock:
+            _trackers.remove(self)
+
+
+def _record_status(pid, status, rusage=None):
+    """Apply one wait4 result to its job (call with job_lock held)."""
+    if rusage is not None and not (os.WIFSTOPPED(status) or os.WIFCONTINUED(status)):
+        for tracker in _trackers:
+            tracker.add(rusage)
+    job_id = _pid_jobs.get(pid)
+    if job_id is None:
+        return  # Not launched through the job table
+    job = jobs[job_id]
+    if os.WIFSTOPPED(status):
+        job['stopped'][pid] = os.WSTOPSIG(status)
+    elif os.WIFCONTINUED(status):
+        job['stopped'].pop(pid, None)
+    else:
+        job['procs'][pid] = status
+        job['rusage'][pid] = rusage
+        job['stopped'].pop(pid, None)
+        del _pid_jobs[pid]
+    _update_state(job)
+
+
+def _finish_accounting(job):
+    """Total a finished job's resource usage and add it to the per-command statistics."""
+    usages = [ru for ru in job['rusage'].values() if ru is not None]
+    usage = {
+        'wall': time.monotonic() - job['started'],
+        'user': sum(ru.ru_utime for ru in usages),
+        'sys': sum(ru.ru_stime for ru in usages),
+        'maxrss': max((ru.ru_maxrss for ru in usages), default=0),
+        'nvcsw': sum(ru.ru_nvcsw for ru in usages),
+        'nivcsw': sum(ru.ru_nivcsw for ru in usages),
+    }
+    job['usage'] = usage
+    resource_stats.record(' | '.join(job['names']), status=job_exit_codes(job)[-1], **usage)
+
+
+def _update_state(job):
+    live = [pid for pid, status in job['procs'].items() if status is None]
+    if not live:
+        if job['usage'] is None:
+            _finish_accounting(job)
+        job['state'] = 'Done'
+    elif all(pid in job['stopped'] for pid in live):
+        job['state'] = 'Stopped'
+    else:
+        job['state'] = 'Running'
+
+
+def _touch(job):
+    """Make job the current job (%+)."""
+    if job['id'] in _job_order:
+        _job_order.remove(job['id'])
+    _job_order.append(job['id'])
+
+
+def _remove_job(job):
+    jobs.pop(job['id'], None)
+    if job['id'] in _job_order:
+        _job_order.remove(job['id'])
+    for pid in job['pids']:
+        _pid_jobs.pop(pid, None)
+
+
+def add_job(pids, pgid, command, foreground, names=None, started=None, limits=None):
+    """Register freshly launched processes as one job.
+
+    Call with job_lock held from before the first spawn, so the reaper cannot
+    record an exit for a pid the table does not know yet. names labels the job
+    in the statistics; started is the time.monotonic() taken before spawning;
+    limits lists the job_limits.JobLimits (or None) of each process, shown by 'jobs'.
+    """
+    global _spawn_generation
+    job_id = max(jobs, default=0) + 1
+    job = {
+        'id': job_id, 'pgid': pgid, 'pids': list(pids),
+        'procs': {pid: None for pid in pids}, 'stopped': {},
+        'command': command, 'state': 'Running', 'foreground': foreground,
+        'reported': 'Running', 'tmodes': None,
+        'names': names or command.split()[:1], 'started': started or time.monotonic(),
+        'rusage': {}, 'usage': None, 'limits': limits if limits and any(limits) else None,
+    }
+    jobs[job_id] = job
+    for pid in pids:
+        _pid_jobs[pid] = job_id
+    if not foreground:
+        _touch(job)
+    _spawn_generation += 1
+    job_lock.notify_all()
+    _ensure_reaper()
+    return job
+
+
+def signal_job(job, sig):
+    """Send a signal to a job: its process group, or each live process without job control."""
+    if job['pgid']:
+        os.killpg(job['pgid'], sig)
+        return
+    for pid, status in list(job['procs'].items()):
+        if status is None:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+
+def job_exit_codes(job):
+    """Exit code of every process in the job, in launch order (None while still alive)."""
+    return [None if job['procs'][pid] is None else exit_status(job['procs'][pid]) for pid in job['pids']]
+
+
+def job_status_text(job):
+    """Human readable job state as shown by 'jobs' (Running, Stopped, Done, Exit 2, Killed...)."""
+    if job['state'] != 'Done':
+        return job['state']
+    status = job['procs'][job['pids'][-1]]
+    if os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        return {signal.SIGKILL: 'Killed', signal.SIGTERM: 'Terminated'}.get(sig, signal.Signals(sig).name)
+    code = os.WEXITSTATUS(status)
+    return 'Done' if code == 0 else f'Exit {code}'
+
+
+def _job_marker(job):
+    if _job_order and job['id'] == _job_order[-1]:
+        return '+'
+    if len(_job_order) > 1 and job['id'] == _job_order[-2]:
+        return '-'
+    return ' '
+
+
+def _limits_text(limits):
+    """One description when every process runs under the same limits, else one per stage."""
+    texts = [each.describe() if each else '-' for each in limits]
+    return texts[0] if len(set(texts)) == 1 else ' | '.join(texts)
+
+
+def format_job(job, long_format=False):
+    """Format one job the way 'jobs' prints it."""
+    pid = f" {job['pgid'] or job['pids'][0]}" if long_format else ''
+    limits = f"  [{_limits_text(job['limits'])}]" if job['limits'] else ''
+    return f"[{job['id']}]{_job_marker(job)}{pid} {job_status_text(job):<10} {job['command']}{limits}"
+
+
+def wait_for_job(job):
+    """Block until a job finishes or stops.
+
+    Returns the per-process exit codes, or None if the job stopped (Ctrl-Z).
+    A foreground job gets the terminal back to the shell afterwards and, once
+    finished, is dropped from the table.
+    """
+    interrupted = False
+    with job_lock:
+        while True:
+            if (job['state'] == 'Stopped' and job['foreground'] and shell_terminal is not None
+                    and set(job['stopped'].values()) <= {signal.SIGTTIN, signal.SIGTTOU}):
+                # It touched the terminal before tcsetpgrp handed it over; it owns it now
+                signal_job(job, signal.SIGCONT)
+                job['stopped'].clear()
+                job['state'] = 'Running'
+            if job['state'] != 'Running':
+                break
+            try:
+                job_lock.wait()
+            except KeyboardInterrupt:
+                if shell_terminal is not None:
+                    raise
+                if not job['pgid']:
+                    # Same process group as us: the job saw Ctrl-C too. Let it finish, then stop.
+                    interrupted = True
+                    continue
+                # No terminal to deliver Ctrl-C to the job's process group; forward it
+                try:
+                    signal_job(job, signal.SIGINT)
+                except ProcessLookupError:
+                    pass
+
+        if job['foreground']:
+            _reclaim_terminal(job)
+        if job['state'] == 'Stopped':
+            job['foreground'] = False
+            job['reported'] = 'Stopped'
+            _touch(job)
+            print(f"\n{format_job(job)}")
+            return None
+        codes = job_exit_codes(job)
+        _remove_job(job)
+    if interrupted:
+        raise KeyboardInterrupt
+    return codes
+
+
+def continue_job(job, foreground):
+    """Resume a stopped or background job (fg / bg)."""
+    with job_lock:
+        job['foreground'] = foreground
+        if foreground:
+            give_terminal_to(job['pgid'], job['tmodes'])
         else:
-            # Parent process: Handle job control
+            _touch(job)
+        if job['state'] == 'Stopped':
+            job['stopped'].clear()
+            job['state'] = 'Running'
+            job['reported'] = 'Running'
+            signal_job(job, signal.SIGCONT)
+
+
+def find_job(spec):
+    """Look up a job by %n, %+, %%, %-, %prefix or pid; returns None if there is no such job."""
+    with job_lock:
+        if not spec or spec in ('%', '%%', '%+'):
+            return jobs.get(_job_order[-1]) if _job_order else None
+        if spec == '%-':
+            return jobs.get(_job_order[-2]) if len(_job_order) > 1 else None
+        if spec.startswith('%'):
+            key = spec[1:]
+            if key.isdigit():
+                return jobs.get(int(key))
+            matches = [job for job in jobs.values() if job['command'].startswith(key)]
+            return matches[-1] if matches else None
+        if spec.isdigit():
+            job_id = _pid_jobs.get(int(spec))
+            if job_id is None:
+                job_id = next((j['id'] for j in jobs.values() if int(spec) in j['pids']), None)
+            return jobs.get(job_id)
+    return None
+
+
+def notify_jobs(report=True):
+    """Report background jobs that changed state since last shown and prune finished ones."""
+    with job_lock:
+        for job in sorted(jobs.values(), key=lambda j: j['id']):
+            if job['foreground'] or job['state'] == job['reported']:
+                continue
+            if report:
+                print(format_job(job))
+            job['reported'] = job['state']
+            if job['state'] == 'Done':
+                _remove_job(job)
+
+
+def prune_jobs():
+    """Drop finished jobs the user has already seen (e.g. in 'jobs' output)."""
+    notify_jobs(report=False)
+
+
+def run_command(command, args, background=False, limits=None, env=None):
+    """Run external command through the spawn backend with job control, returning the exit status.
+
+    limits (job_limits.JobLimits) constrain the process: applied between fork and exec.
+    env replaces os.environ for the child ('FOO=bar command').
+    """
+    full_args = [command] + args
+
+    path = resolve_command(command)
+    if path is None:
+        print_error(f"Command '{command}' not found. Check PATH.")
+        return 127
+
+    try:
+        # Exec the resolved path directly (no PATH walk), in its own process group
+        sys.stdout.flush()
+        started = time.monotonic()
+        with job_lock:
+            pid = spawn_process(path, full_args, setpgroup=0 if job_control else None, env=env, limits=limits)
+            job = add_job([pid], pid if job_control else None, ' '.join(full_args), not background,
+                          names=[command], started=started, limits=[limits])
             if not background:
-                # Foreground process: Wait for it to complete
-                _, status = os.waitpid(pid, 0)
-                if os.WIFEXITED(status):
-                    exit_code = os.WEXITSTATUS(status)
-                    if exit_code == 0:
-                        print_success(f"Command '{command}' completed.")
-                    else:
-                        print_error(f"Command '{command}' failed with exit code {exit_code}.")
-                    return exit_code
-                else:
-                    print_error(f"Command '{command}' terminated abnormally.")
-                    return -1
+                give_terminal_to(pid)
+
+        # Parent process: Handle job control
+        if not background:
+            # Foreground process: Wait for it to complete (or stop)
+            codes = wait_for_job(job)
+            if codes is None:
+                return 128 + signal.SIGTSTP
+            exit_code = codes[-1]
+            if exit_code == 0:
+                print_success(f"Command '{command}' completed.")
+            elif exit_code > 128:
+                print_failure(f"Command '{command}' terminated abnormally.")
             else:
-                # Background process: Add to jobs list and return immediately
-                jobs.append({'pid': pid, 'command': ' '.join(full_args), 'status': 'Running'})
-                print_info(f"Command '{command}' running in background (PID: {pid}).")
-                return 0  # Success
-                
+                print_failure(f"Command '{command}' failed with exit code {exit_code}.")
+            return exit_code
+        else:
+            # Background process: Already in the job table, return immediately
+            print_info(f"[{job['id']}] Command '{command}' running in background (PID: {pid}).")
+            return 0  # Success
+
     except FileNotFoundError:
         print_error(f"Command '{command}' not found. Check PATH.")
         return 127
-        
+
+    except LimitError as e:
+        print_error(f"Cannot apply limits ({limits.describe()}): {e.strerror}")
+        return 126
+
     except PermissionError:
         print_error("Permission denied for command.")
         return 126
-        
+
     except Exception as e:
         print_error(f"Execution error: {str(e)}")
         return 1
 
 
 def get_jobs():
-    """Return the list of background jobs."""
-    # Update job statuses before returning
-    
-    for job in jobs:
-        # Check if the process is still running
-        pid, status = os.waitpid(job['pid'], os.WNOHANG)
-        if pid != 0:
-            # Process has finished
-            job['status'] = 'Done'
-            
-    return jobs
+    """Return the background jobs ordered by job id (the reaper keeps their state current)."""
+    with job_lock:
+        return sorted((job for job in jobs.values() if not job['foreground']), key=lambda j: j['id'])
@@ -0,0 +1,131 @@
+import os
+from bisect import bisect_left
+from command_exec import path_dirs
+
+# --- Directory Listing Cache ---
+# directory -> (mtime_ns, sorted entry names, set of names that are directories)
+_dir_cache = {}
+
+# --- $PATH Executable Index ---
+_path_dir_cache = {}     # PATH directory -> (mtime_ns, executable names)
+_path_key = None         # (PATH dirs, their mtimes) the merged index was built from
+_path_names = []         # Sorted, de-duplicated executable names across $PATH
+
+# Extra command words merged into command completion (registered by the shell)
+_builtin_names = []
+_alias_sources = []
+
+
+def register_builtins(names):
+    """Make shell builtins completable as commands."""
+    _builtin_names[:] = sorted(set(names))
+
+
+def register_aliases(aliases):
+    """Make an alias dict completable as commands (the dict is read live on every lookup)."""
+    if not any(source is aliases for source in _alias_sources):
+        _alias_sources.append(aliases)
+
+
+def _mtime(directory):
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+
+def list_directory(directory):
+    """Return (sorted names, directory names) for a directory, rescanning only when its mtime changes."""
+    directory = directory or '.'
+    mtime = _mtime(directory)
+    cached = _dir_cache.get(directory)
+    if cached and cached[0] == mtime:
+        return cached[1], cached[2]
+
+    names, dirs = [], set()
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                names.append(entry.name)
+                try:
+                    # d_type from the directory read itself; only symlinks cost a stat
+                    if entry.is_dir():
+                        dirs.add(entry.name)
+                except OSError:
+                    pass
+    except OSError:
+        return [], set()
+    names.sort()
+    _dir_cache[directory] = (mtime, names, dirs)
+    return names, dirs
+
+
+def _prefix_range(names, prefix):
+    """Yield the entries of a sorted list that start with prefix (binary search, no full scan)."""
+    i = bisect_left(names, prefix)
+    while i < len(names) and names[i].startswith(prefix):
+        yield names[i]
+        i += 1
+
+
+def complete_path(text, cwd=None):
+    """Complete a file path; directories get a trailing '/'. Dotfiles only for a '.' prefix.
+
+    Relative paths are looked up under cwd (default: the process working directory).
+    """
+    head, prefix = os.path.split(text)
+    directory = os.path.expanduser(head) if head else '.'
+    if cwd is not None:
+        directory = os.path.join(cwd, directory)
+    names, dirs = list_directory(directory)
+    matches = []
+    for name in _prefix_range(names, prefix):
+        if name.startswith('.') and not prefix.startswith('.'):
+            continue
+        path = os.path.join(head, name) if head else name
+        matches.append(path + '/' if name in dirs else path)
+    return matches
+
+
+def _path_executables(directory, mtime):
+    cached = _path_dir_cache.get(directory)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    names = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_file() and os.access(entry.path, os.X_OK):
+                        names.append(entry.name)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    _path_dir_cache[directory] = (mtime, names)
+    return names
+
+
+def path_index():
+    """Sorted names of every executable on $PATH, rebuilt only when PATH or a PATH directory changes."""
+    global _path_key, _path_names
+    dirs = path_dirs()
+    key = (tuple(dirs), tuple(_mtime(d) for d in dirs))
+    if key != _path_key:
+        merged = set()
+        for directory, mtime in zip(*key):
+            merged.update(_path_executables(directory, mtime))
+        _path_names = sorted(merged)
+        _path_key = key
+    return _path_names
+
+
+def complete_command(text):
+    """Complete a command name from builtins, aliases and $PATH executables."""
+    if '/' in text:
+        return complete_path(text)
+    matches = set(_prefix_range(path_index(), text))
+    matches.update(_prefix_range(_builtin_names, text))
+    for aliases in _alias_sources:
+        matches.update(name for name in aliases if name.startswith(text))
+    return sorted(matches)
@@ -1,122 +1,1113 @@
 import os
 import sys
+import time
+import signal
 import shlex
-import glob
+import resource
+from contextlib import contextmanager, ExitStack
+from functools import partial
 from ui import get_colored_prompt, print_banner, print_error, print_success, print_info
-from usability_features import setup_readline, save_history, save_aliases, expand_alias, ALIASES_FILE, HISTORY_FILE
-from command_exec import run_command, get_jobs
-from piping_redirection import handle_pipe, handle_redirection
+from ui import set_prompt_state, prompt_cwd_changed, set_decorations
+from usability_features import setup_readline, load_history, refresh_history, save_history, save_aliases, expand_alias, iter_history, ALIASES_FILE, HISTORY_FILE
+from command_exec import run_command, get_jobs, command_hash, resolve_command, clear_hash, shell_options
+from command_exec import init_job_control, notify_jobs, prune_jobs, find_job, format_job, continue_job, wait_for_job
+from command_exec import signal_job, UsageTracker
+import command_exec
+from piping_redirection import run_pipeline, redirected, describe_redirect_error
+from shell_parser import parse, is_complete, unparse, word_text, ParseError, RESERVED_WORDS
+from shell_parser import Command, Pipeline, AndOr, Sequence, Subshell, Group, If, While, For, FunctionDef
+from completion_index import register_builtins
+import resource_stats
+from fast_builtins import FAST_BUILTINS, FAST_PATH_CHECKS
+from glob_engine import Globber, brace_expand, has_magic, needs_expansion, check_arg_max
+from word_expansion import ExpansionError, UnsetParameterError, has_substitution, word_units, expand_fields, expand_value
 
-def handle_builtin(command, args, aliases):
-    """Handle built-in commands and return True if handled."""
-    if command == 'exit':
-        print_info("Goodbye! Exiting CustomShell.")
-        sys.exit(0)
+# Exit status of the most recent command ($? in sh)
+last_status = 0
+# $$: the shell's pid, kept by subshells (the daemon sets it for each session it forks)
+shell_pid = os.getpid()
 
-    elif command == 'cd':
+# Shell functions (name -> body node), shell variables, and the positional
+# parameters of each active function call (innermost last)
+functions = {}
+shell_vars = {}
+positional_args = [[]]
+loop_depth = 0
+# False while running a script or -c: ${name:?} then exits the shell, as POSIX requires
+interactive = True
+
+
+class LoopControl(Exception):
+    """Raised by break/continue; unwinds to the enclosing loop (levels deep)."""
+    def __init__(self, kind, levels=1):
+        super().__init__(kind)
+        self.kind = kind
+        self.levels = levels
+
+
+class FunctionReturn(Exception):
+    """Raised by return; unwinds to the enclosing function call."""
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class CommandInterrupted(KeyboardInterrupt):
+    """A foreground command died of Ctrl-C; the rest of the command line is abandoned."""
+
+
+# --- Builtins ---
+# name -> handler(command, args, aliases) returning an exit status. Names in
+# disabled_builtins ('enable -n') fall through to the PATH lookup.
+BUILTINS = {}
+disabled_builtins = set()
+# Prefix builtins that constrain the command after them (job_limits)
+LIMIT_PREFIXES = frozenset({'nice', 'taskset', 'limit'})
+
+
+def builtin(*names):
+    """Register the decorated function as the handler for the given builtin names."""
+    def register(handler):
+        for name in names:
+            BUILTINS[name] = handler
+        return handler
+    return register
+
+
+@builtin('exit')
+def _builtin_exit(command, args, aliases):
+    print_info("Goodbye! Exiting CustomShell.")
+    try:
+        sys.exit(int(args[0]) & 0xFF if args else last_status)
+    except ValueError:
+        print_error(f"exit: {args[0]}: numeric argument required")
+        sys.exit(2)
+
+
+@builtin('cd')
+def _builtin_cd(command, args, aliases):
+    path = args[0] if args else os.path.expanduser("~")
+    if path == '-':
+        path = os.environ.get('OLDPWD')
+        if not path:
+            print_error("cd: OLDPWD not set")
+            return 1
+    try:
+        previous = os.getcwd()
+    except OSError:
+        previous = os.environ.get('PWD', '')
+    try:
+        os.chdir(path)
+    except FileNotFoundError:
+        print_error(f"Directory not found: {path}")
+        return 1
+    except NotADirectoryError:
+        print_error(f"Not a directory: {path}")
+        return 1
+    except PermissionError:
+        print_error(f"Permission denied: {path}")
+        return 1
+    # Same variables the GUI's Session.cd keeps, for $PWD/$OLDPWD and the commands we start
+    os.environ['OLDPWD'], os.environ['PWD'] = previous, os.getcwd()
+    if args[:1] == ['-']:
+        print(os.environ['PWD'])
+    prompt_cwd_changed()
+    return 0
+
+
+@builtin('jobs')
+def _builtin_jobs(command, args, aliases):
+    jobs = get_jobs()
+    if not jobs:
+        print_info("No background jobs.")
+    else:
+        for job in jobs:
+            print(format_job(job, long_format='-l' in args))
+    # Finished jobs have now been seen; drop them from the table
+    prune_jobs()
+    return 0
+
+
+@builtin('fg', 'bg')
+def _builtin_fg_bg(command, args, aliases):
+    job = find_job(args[0] if args else None)
+    if job is None:
+        print_error(f"{command}: {args[0] if args else 'current'}: no such job")
+        return 1
+    print(job['command'])
+    continue_job(job, foreground=(command == 'fg'))
+    if command == 'fg':
+        codes = wait_for_job(job)
+        return 128 + signal.SIGTSTP if codes is None else codes[-1]
+    return 0
+
+
+@builtin('wait')
+def _builtin_wait(command, args, aliases):
+    status = 0
+    targets = [find_job(spec) for spec in args] if args else get_jobs()
+    for spec, job in zip(args or [None] * len(targets), targets):
+        if job is None:
+            print_error(f"wait: {spec}: no such job")
+            status = 127
+            continue
+        codes = wait_for_job(job)
+        if codes is not None:
+            status = codes[-1]
+            if args:
+                print_info(f"[{job['id']}] exited with status {codes[-1]}")
+    return status
+
+
+@builtin('kill')
+def _builtin_kill(command, args, aliases):
+    sig = signal.SIGTERM
+    if args and args[0] == '-l':
+        print(' '.join(s.name[3:] for s in signal.Signals if not s.name.startswith('SIG_')))
+        return 0
+    if len(args) >= 2 and args[0] == '-s':
+        args = ['-' + args[1]] + args[2:]
+    if args and args[0].startswith('-') and len(args[0]) > 1:
+        name = args.pop(0)[1:].upper()
+        try:
+            sig = signal.Signals(int(name)) if name.isdigit() else signal.Signals[
+                name if name.startswith('SIG') else 'SIG' + name]
+        except (ValueError, KeyError):
+            print_error(f"kill: {name}: invalid signal specification")
+            return 1
+    if not args:
+        print_error("Usage: kill [-s sig | -sig] %job | pid ...")
+        return 2
+    status = 0
+    for target in args:
         try:
-            path = args[0] if args else os.path.expanduser("~")
-            os.chdir(path)
-        except FileNotFoundError:
-            print_error(f"Directory not found: {path}")
+            if target.startswith('%'):
+                job = find_job(target)
+                if job is None:
+                    print_error(f"kill: {target}: no such job")
+                    status = 1
+                    continue
+                signal_job(job, sig)
+                if job['state'] == 'Stopped' and sig not in (signal.SIGCONT, signal.SIGKILL):
+                    # A stopped job only sees the signal once it runs again
+                    signal_job(job, signal.SIGCONT)
+            else:
+                os.kill(int(target), sig)
+        except ValueError:
+            print_error(f"kill: {target}: arguments must be process or job IDs")
+            status = 1
+        except ProcessLookupError:
+            print_error(f"kill: {target}: no such process")
+            status = 1
         except PermissionError:
-            print_error(f"Permission denied: {path}")
-        except IndexError:
-            os.chdir(os.path.expanduser("~"))
-        return True
+            print_error(f"kill: {target}: permission denied")
+            status = 1
+    return status
+
+
+@builtin('alias')
+def _builtin_alias(command, args, aliases):
+    if not args:
+        if not aliases:
+            print_info("No aliases defined.")
+        for name, cmd in aliases.items():
+            print(f"{name}='{cmd}'")
+    elif '=' in args[0]:
+        name, cmd = args[0].split('=', 1)
+        aliases[name] = cmd.strip("'\"")
+        if not save_aliases(aliases):
+            return 1
+        print_success(f"Alias '{name}' set.")
+    else:
+        print_error("Usage: alias [name='command']")
+        return 2
+    return 0
+
+
+@builtin('unalias')
+def _builtin_unalias(command, args, aliases):
+    if len(args) != 1:
+        print_error("Usage: unalias [name]")
+        return 2
+    name = args[0]
+    if name not in aliases:
+        print_error(f"Alias not found: {name}")
+        return 1
+    del aliases[name]
+    if not save_aliases(aliases):
+        return 1
+    print_success(f"Alias '{name}' removed.")
+    return 0
 
-    elif command == 'jobs':
-        jobs = get_jobs()
-        if not jobs:
-            print_info("No background jobs.")
+
+@builtin('history')
+def _builtin_history(command, args, aliases):
+    try:
+        for i, line in enumerate(iter_history(), 1):
+            print(f"{i} {line}")
+    except FileNotFoundError:
+        print_info("No history yet.")
+    return 0
+
+
+@builtin('hash')
+def _builtin_hash(command, args, aliases):
+    if not args:
+        if not command_hash:
+            print_info("hash table empty")
         else:
-            for i, job in enumerate(jobs):
-                print(f"[{i+1}] {job['pid']} {job['status']} {job['command']}")
-        return True
+            print("hits\tcommand")
+            for name, entry in command_hash.items():
+                print(f"{entry['hits']:4}\t{entry['path']}")
+    elif args[0] == '-r':
+        clear_hash()
+    else:
+        status = 0
+        for name in args:
+            if resolve_command(name) is None:
+                print_error(f"hash: {name}: not found")
+                status = 1
+        return status
+    return 0
+
 
-    elif command == 'alias':
-        if not args:
-            if not aliases:
-                print_info("No aliases defined.")
-            for name, cmd in aliases.items():
-                print(f"{name}='{cmd}'")
-        elif '=' in args[0]:
-            name, cmd = args[0].split('=', 1)
-            aliases[name] = cmd.strip("'\"")
-            if save_aliases(aliases):
-                print_success(f"Alias '{name}' set.")
+@builtin('type')
+def _builtin_type(command, args, aliases):
+    if not args:
+        print_error("Usage: type name [name ...]")
+        return 2
+    status = 0
+    for name in args:
+        if name in aliases:
+            print(f"{name} is aliased to '{aliases[name]}'")
+        elif name in RESERVED_WORDS:
+            print(f"{name} is a shell keyword")
+        elif name in functions:
+            print(f"{name} is a function")
+        elif builtin_enabled(name):
+            print(f"{name} is a shell builtin")
+        elif name in command_hash:
+            print(f"{name} is hashed ({command_hash[name]['path']})")
         else:
-            print_error("Usage: alias [name='command']")
-        return True
+            path = resolve_command(name, remember=False)
+            if path:
+                print(f"{name} is {path}")
+            else:
+                print_error(f"type: {name}: not found")
+                status = 1
+    return status
+
+
+@builtin('spawnmode')
+def _builtin_spawnmode(command, args, aliases):
+    if not args:
+        print_info(f"Launch backend: {command_exec.spawn_backend}")
+    elif command_exec.set_spawn_backend(args[0]):
+        print_success(f"Launch backend set to '{args[0]}'.")
+    else:
+        print_error(f"Usage: spawnmode [{'|'.join(command_exec.SPAWN_BACKENDS)}]")
+        return 2
+    return 0
+
+
+@builtin('set')
+def _builtin_set(command, args, aliases):
+    if not args:
+        for name, enabled in shell_options.items():
+            print(f"set {'-' if enabled else '+'}o {name}")
+    elif len(args) == 2 and args[0] in ('-o', '+o') and args[1] in shell_options:
+        shell_options[args[1]] = args[0] == '-o'
+    else:
+        print_error(f"Usage: set [-o|+o] [{'|'.join(shell_options)}]")
+        return 2
+    return 0
+
+
+@builtin('export')
+def _builtin_export(command, args, aliases):
+    if not args or args == ['-p']:
+        for name, value in sorted(os.environ.items()):
+            print(f"export {name}={shlex.quote(value)}")
+        return 0
+    status = 0
+    for arg in args:
+        name, eq, value = arg.partition('=')
+        if not name.isidentifier():
+            print_error(f"export: '{arg}': not a valid identifier")
+            status = 1
+        elif eq:
+            shell_vars.pop(name, None)
+            os.environ[name] = value
+        elif name in shell_vars:
+            os.environ[name] = shell_vars.pop(name)
+    return status
+
+
+@builtin('enable')
+def _builtin_enable(command, args, aliases):
+    disable = bool(args) and args[0] == '-n'
+    names = args[1:] if disable else args
+    if not names:
+        for name in sorted(BUILTINS):
+            print(f"enable {'-n ' if name in disabled_builtins else ''}{name}")
+        return 0
+    status = 0
+    for name in names:
+        if name not in BUILTINS:
+            print_error(f"enable: {name}: not a shell builtin")
+            status = 1
+        elif disable:
+            disabled_builtins.add(name)
+        else:
+            disabled_builtins.discard(name)
+    return status
+
 
-    elif command == 'unalias':
+@builtin('break', 'continue')
+def _builtin_loop_control(command, args, aliases):
+    if not loop_depth:
+        print_error(f"{command}: only meaningful in a 'for', 'while', or 'until' loop")
+        return 0
+    try:
+        levels = int(args[0]) if args else 1
+    except ValueError:
+        levels = 0
+    if levels < 1:
+        print_error(f"{command}: {args[0]}: loop count out of range")
+        return 1
+    raise LoopControl(command, levels)
+
+
+@builtin('return')
+def _builtin_return(command, args, aliases):
+    if len(positional_args) == 1:
+        print_error("return: can only return from a function")
+        return 1
+    try:
+        status = int(args[0]) & 0xFF if args else last_status
+    except ValueError:
+        print_error(f"return: {args[0]}: numeric argument required")
+        status = 2
+    raise FunctionReturn(status)
+
+
+@builtin('stats')
+def _builtin_stats(command, args, aliases):
+    if args == ['-r']:
+        resource_stats.reset()
+        return 0
+    if args[:1] == ['-j']:
+        import json
+        text = json.dumps(resource_stats.snapshot(), indent=2, sort_keys=True)
         if len(args) == 1:
-            name = args[0]
-            if name in aliases:
-                del aliases[name]
-                if save_aliases(aliases):
-                    print_success(f"Alias '{name}' removed.")
+            print(text)
+            return 0
+        try:
+            with open(args[1], 'w') as f:
+                f.write(text + '\n')
+        except OSError as e:
+            print_error(f"stats: {args[1]}: {e.strerror}")
+            return 1
+        print_success(f"Statistics written to {args[1]}.")
+        return 0
+    if any(arg.startswith('-') for arg in args):
+        print_error("Usage: stats [-r | -j [file] | command ...]")
+        return 2
+    data = resource_stats.snapshot()
+    if args:
+        data = {name: entry for name, entry in data.items() if name in args}
+    if not data:
+        print_info("No commands recorded yet.")
+        return 0
+    for row in resource_stats.format_table(data):
+        print(row)
+    return 0
+
+
+@builtin('parallel')
+def _builtin_parallel(command, args, aliases):
+    from parallel_exec import run_parallel
+
+    def internal(argv):
+        if is_internal(argv):
+            return partial(_run_internal, argv[0], argv[1:], aliases)
+        return None
+    return run_parallel(args, internal)
+
+
+@builtin('cache')
+def _builtin_cache(command, args, aliases):
+    from command_cache import run_cached
+
+    def run(argv):
+        if is_internal(argv):
+            return _run_internal(argv[0], argv[1:], aliases)
+        if not _check_argv(argv):
+            return 126
+        return run_command(argv[0], argv[1:])
+    return run_cached(args, run)
+
+
+@builtin('nice', 'taskset', 'limit')
+def _builtin_limits(command, args, aliases):
+    # Usually peeled off by split_limits before the command runs; here when called
+    # without a command (show the current setting) or from parallel/cache
+    from job_limits import parse_prefixes, show_current
+    if not args:
+        show_current(command)
+        return 0
+    try:
+        limits, argv = parse_prefixes([command] + args, is_limit_prefix)
+    except ValueError as e:
+        print_error(str(e))
+        return 2
+    if not argv:
+        show_current(command)
+        return 0
+    return _run_limited(argv, limits, aliases)
+
+
+@builtin('ulimit')
+def _builtin_ulimit(command, args, aliases):
+    from job_limits import ulimit
+    return ulimit(args)
+
+
+@builtin('help')
+def _builtin_help(command, args, aliases):
+    print_banner()
+    print_info(f"Built-in commands: {', '.join(BUILTIN_COMMANDS)}")
+    return 0
+
+
+# In-process versions of trivial utilities (echo, test, printf, ...), so scripts
+# don't pay a fork+exec for each one
+BUILTINS.update(FAST_BUILTINS)
+
+BUILTIN_COMMANDS = list(BUILTINS)
+register_builtins(BUILTIN_COMMANDS)
+
+
+def builtin_enabled(name):
+    """True if name is a builtin that has not been turned off with 'enable -n'."""
+    return name in BUILTINS and name not in disabled_builtins
+
+
+def run_builtin(command, args, aliases):
+    """Run a builtin, record its latency for 'stats', and return its exit status."""
+    started = time.perf_counter()
+    status = BUILTINS[command](command, args, aliases)
+    status = 0 if status is None else status
+    resource_stats.record(command, time.perf_counter() - started, status=status)
+    return status
+
+
+# --- Executor ---
+# Every command line, script and GUI entry is parsed into an AST (shell_parser) and
+# run by execute_node. External commands go through run_command/run_pipeline; builtins,
+# functions and compound commands that must run in another process (pipeline stages,
+# subshells, background lists) are run in a forked copy of the shell.
+
+# Directory listings shared by every word of the command line being run
+_globber = Globber()
+# The GUI's logical working directory (gui_jobs.Session); relative globs match there, not in the process cwd
+logical_cwd = None
+# Characters that make expand_word do more than remove quotes
+_BARE_SPECIAL = frozenset('$`*?[{')
+_QUOTED_SPECIAL = frozenset('$`')
+
+
+class ShellScope:
+    """What word_expansion sees of the shell: variables, parameters and how to run $(...)."""
+    __slots__ = ('aliases', 'substitution_status')
+
+    def __init__(self, aliases=None):
+        self.aliases = aliases or {}
+        self.substitution_status = None   # Exit status of the last $(...) expanded, if any
+
+    def get(self, name):
+        if name == '?':
+            return str(last_status)
+        if name == '$':
+            return str(shell_pid)
+        if name == '#':
+            return str(len(positional_args[-1]))
+        if name == '0':
+            return 'customshell'
+        if name.isdigit():
+            params = positional_args[-1]
+            index = int(name) - 1
+            return params[index] if index < len(params) else None
+        return get_var(name)
+
+    def params(self):
+        return positional_args[-1]
+
+    def assign(self, name, value):
+        set_var(name, value)
+
+    def subshell(self, text):
+        return partial(execute_line, text, self.aliases)
+
+
+def get_var(name):
+    """A shell variable, else an environment variable; None if unset."""
+    value = shell_vars.get(name)
+    return os.environ.get(name) if value is None else value
+
+
+def set_var(name, value):
+    """Assign a variable; names already in the environment stay exported."""
+    if name in os.environ:
+        shell_vars.pop(name, None)
+        os.environ[name] = value
+    else:
+        shell_vars[name] = value
+
+
+def expand_word(word, scope=None):
+    """Brace-expand, substitute and field-split, then glob one word.
+
+    Only unquoted wildcards glob (bare text or unquoted expansion results); no match keeps the word.
+    """
+    for text, quote in word.parts:
+        if quote is None and not _BARE_SPECIAL.isdisjoint(text):
+            break
+        if quote == '"' and not _QUOTED_SPECIAL.isdisjoint(text):
+            break
+    else:
+        return [word_text(word)]  # Nothing to substitute, brace-expand or glob
+    substitutes = has_substitution(word.parts)
+    if not substitutes and not needs_expansion(word.parts):
+        return [word_text(word)]
+    results = []
+    for units in brace_expand(list(word_units(word.parts))):
+        fields = expand_fields(units, scope or ShellScope()) if substitutes else [
+            [(c, bool(quote)) for c, quote in units if c]]
+        for chars in fields:
+            text = ''.join(c for c, _ in chars)
+            if has_magic(chars):
+                matches = _globber.expand(chars, shell_options['dotglob'], shell_options['globstar'])
+                results.extend(matches or [text])
             else:
-                print_error(f"Alias not found: {name}")
+                results.append(text)
+    return results
+
+
+def expand_words(words, scope=None):
+    """Expand a sequence of words into an argv list."""
+    argv = []
+    for word in words:
+        argv.extend(expand_word(word, scope))
+    return argv
+
+
+def redirect_plan(redirects, scope=None):
+    """Turn parsed (fd, op, word) redirections into the (fd, op, target) plan piping_redirection uses."""
+    plan = []
+    for fd, op, target in redirects:
+        if has_substitution(target.parts):
+            fields = expand_fields(word_units(target.parts), scope or ShellScope())
+            if len(fields) != 1:
+                raise ExpansionError(f"{unparse(Command((target,), ()))}: ambiguous redirect")
+            plan.append((fd, op, ''.join(c for c, _ in fields[0])))
         else:
-            print_error("Usage: unalias [name]")
+            plan.append((fd, op, word_text(target)))
+    return plan
+
+
+def is_internal(argv):
+    """True if argv runs inside the shell (function or builtin) rather than being exec'd."""
+    command = argv[0]
+    if command in functions:
         return True
+    if not builtin_enabled(command):
+        return False
+    # Some fast builtins only cover the simple cases (e.g. cat of small regular files)
+    check = FAST_PATH_CHECKS.get(command)
+    return check is None or check(argv[1:])
+
+
+def call_function(name, args, aliases):
+    """Run a shell function with args as its positional parameters."""
+    positional_args.append(list(args))
+    try:
+        return execute_node(functions[name], aliases)
+    except FunctionReturn as ret:
+        return ret.status
+    finally:
+        positional_args.pop()
 
-    elif command == 'history':
+
+def _check_argv(argv, env=None):
+    """Report an argv (and environment) too large for exec; returns False if it must not be launched."""
+    try:
+        check_arg_max(argv, env)
+    except OSError as e:
+        print_error(f"{argv[0]}: {e.strerror}")
+        return False
+    return True
+
+
+def _run_internal(command, args, aliases, values=None):
+    if values:
+        with _exported(values):
+            return _run_internal(command, args, aliases)
+    if command in functions:
+        return call_function(command, args, aliases)
+    return run_builtin(command, args, aliases)
+
+
+def _with_redirects(redirects, run):
+    """Run run() with a compound command's or builtin's redirections applied in the shell."""
+    if not redirects:
+        return run()
+    plan = []
+    with ExitStack() as stack:
         try:
-            with open(HISTORY_FILE, 'r') as f:
-                for i, line in enumerate(f.readlines()):
-                    print(f"{i+1} {line.strip()}")
-        except FileNotFoundError:
-            print_info("No history yet.")
-        return True
+            plan = redirect_plan(redirects)
+            stack.enter_context(redirected(plan))
+        except ExpansionError:
+            raise
+        except OSError as e:
+            # Reported the way a program's failed redirection is
+            print_error(describe_redirect_error(e, plan) if e.errno else str(e))
+            return 1
+        except ValueError as e:
+            print_error(str(e))
+            return 1
+        return run()
+
+
+def is_limit_prefix(name):
+    """True if name is the nice/taskset/limit builtin rather than a function or program."""
+    return name in LIMIT_PREFIXES and name not in functions and builtin_enabled(name)
+
+
+def split_limits(argv):
+    """Peel leading nice/taskset/limit prefixes off argv.
+
+    Returns (job_limits.JobLimits, command argv), or (None, argv) when there are no
+    prefixes or no command after them. Raises ValueError for a malformed prefix.
+    """
+    if len(argv) < 2 or not is_limit_prefix(argv[0]):
+        return None, argv
+    from job_limits import parse_prefixes
+    limits, command = parse_prefixes(argv, is_limit_prefix)
+    if not command:
+        return None, argv
+    return limits, command
+
+
+def _run_limited(argv, limits, aliases, redirects=(), background=False, text=None, values=None):
+    """Run argv under limits: always in a child process, where they are applied before it starts."""
+    plan = redirect_plan(redirects)
+    if is_internal(argv):
+        stage = partial(_run_internal, argv[0], argv[1:], aliases, values)
+        return run_pipeline([stage], background, text or ' '.join(argv), [plan], names=[argv[0]],
+                            limits=[limits])
+    env = _child_env(values)
+    if not _check_argv(argv, env):
+        return 126
+    if not plan:
+        return run_command(argv[0], argv[1:], background, limits, env)
+    return run_pipeline([argv], background, text, [plan], limits=[limits], envs=[env])
+
+
+def _stage_name(node):
+    """Label for a forked-shell stage in the job statistics."""
+    if isinstance(node, Command) and node.words:
+        return word_text(node.words[0])
+    return type(node).__name__.lower()
+
+
+def _in_child(node, aliases, background=False, plan=None, name=None):
+    """Run node in a forked copy of the shell, as a (possibly background) job."""
+    return run_pipeline([partial(execute_node, node, aliases)], background, unparse(node), [plan or []],
+                        names=[name or _stage_name(node)])
+
+
+def _format_clock(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes)}m{seconds:.3f}s"
+
+
+def _time_pipeline(node, aliases):
+    """Run a 'time'-prefixed pipeline and report wall/CPU time, peak RSS and context switches on stderr."""
+    started = time.perf_counter()
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    status = 0
+    with UsageTracker() as children:
+        try:
+            if node.commands:
+                status = _exec_pipeline(node._replace(timed=None), aliases)
+        finally:
+            wall = time.perf_counter() - started
+            after = resource.getrusage(resource.RUSAGE_SELF)
+            # Shell-side work (builtins, expansion) counts too, as in bash
+            user = children.user + after.ru_utime - before.ru_utime
+            system = children.sys + after.ru_stime - before.ru_stime
+            if node.timed == 'posix':
+                report = f"real {wall:.2f}\nuser {user:.2f}\nsys {system:.2f}\n"
+            else:
+                report = (f"\nreal\t{_format_clock(wall)}\nuser\t{_format_clock(user)}\n"
+                          f"sys\t{_format_clock(system)}\nmaxrss\t{children.maxrss} KB\n"
+                          f"ctxsw\t{children.nvcsw} voluntary, {children.nivcsw} involuntary\n")
+            sys.stderr.write(report)
+            sys.stderr.flush()
+    return status
+
+
+def _assignment(word):
+    """'name=value' word -> (name, value parts), else None."""
+    text, quote = word.parts[0]
+    name, eq, value = text.partition('=')
+    if quote is not None or not eq or not name.isidentifier():
+        return None
+    return name, ((value, None),) + word.parts[1:]
+
+
+def split_assignments(words):
+    """Leading 'name=value' words -> ([(name, value parts), ...], the remaining words)."""
+    assignments = []
+    for word in words:
+        assignment = _assignment(word)
+        if assignment is None:
+            break
+        assignments.append(assignment)
+    return assignments, words[len(assignments):]
+
+
+def _child_env(values):
+    """The environment for a program run with prefix assignments, or None for os.environ."""
+    return {**os.environ, **values} if values else None
+
+
+@contextmanager
+def _exported(values):
+    """'FOO=bar builtin' or 'FOO=bar function': export the values only while it runs."""
+    saved = {name: (os.environ.get(name), shell_vars.pop(name, None)) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, (exported, local) in saved.items():
+            if exported is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = exported
+            if local is not None:
+                shell_vars[name] = local
+
+
+def _exec_assignments(assignments, redirects, scope):
+    """'name=value ...' with no command: set shell variables; the status is that of the last $(...)."""
+    def run():
+        for name, parts in assignments:
+            set_var(name, expand_value(parts, scope))
+        return scope.substitution_status or 0
+    return _with_redirects(redirects, run)
+
+
+def _exec_command(node, aliases, background=False):
+    scope = ShellScope(aliases)
+    assignments, words = split_assignments(node.words)
+    argv = expand_words(words, scope)
+    if not argv:
+        if assignments:
+            return _exec_assignments(assignments, node.redirects, scope)
+        # Only redirections ('> file') or words that expanded to nothing: open, create/truncate, and restore
+        return _with_redirects(node.redirects, lambda: scope.substitution_status or 0)
+    # 'FOO=bar command': the values go to the command's environment, not the shell's
+    values = {name: expand_value(parts, scope) for name, parts in assignments}
+    try:
+        limits, argv = split_limits(argv)
+    except ValueError as e:
+        print_error(str(e))
+        return 2
+    if limits:
+        return _run_limited(argv, limits, aliases, node.redirects, background, unparse(node), values)
+    command, args = argv[0], argv[1:]
+    if is_internal(argv):
+        if background:
+            return run_pipeline([partial(_run_internal, command, args, aliases, values)], True, unparse(node),
+                                [redirect_plan(node.redirects, scope)], names=[command])
+        return _with_redirects(node.redirects, lambda: _run_internal(command, args, aliases, values))
+    env = _child_env(values)
+    if not _check_argv(argv, env):
+        return 126
+    if not node.redirects:
+        return run_command(command, args, background, env=env)
+    return run_pipeline([argv], background, unparse(node), [redirect_plan(node.redirects, scope)], envs=[env])
+
+
+def _exec_pipeline(node, aliases, background=False):
+    if node.timed:
+        if not background:
+            return _time_pipeline(node, aliases)
+        node = node._replace(timed=None)
+        if not node.commands:
+            return 0
+    if len(node.commands) == 1:
+        command = node.commands[0]
+        if isinstance(command, Command):
+            status = _exec_command(command, aliases, background)
+        elif isinstance(command, Subshell):
+            status = _in_child(command.body, aliases, background, redirect_plan(command.redirects), 'subshell')
+        elif background and not isinstance(command, FunctionDef):
+            status = _in_child(command, aliases, background=True)
+        else:
+            status = execute_node(command, aliases)
+    else:
+        stages, plans, names, limits, envs = [], [], [], [], []
+        for command in node.commands:
+            if isinstance(command, Command):
+                scope = ShellScope(aliases)
+                assignments, words = split_assignments(command.words)
+                argv = expand_words(words, scope)
+                try:
+                    stage_limits, argv = split_limits(argv)
+                except ValueError as e:
+                    print_error(str(e))
+                    return 2
+                if argv:
+                    # Expanded once, here: $(...) and ${name:=word} must not run again in the child
+                    values = {name: expand_value(parts, scope) for name, parts in assignments}
+                    if is_internal(argv):
+                        stages.append(partial(_run_internal, argv[0], argv[1:], aliases, values))
+                    elif not _check_argv(argv, _child_env(values)):
+                        return 126
+                    else:
+                        stages.append(argv)
+                    plans.append(redirect_plan(command.redirects, scope))
+                    names.append(argv[0])
+                    limits.append(stage_limits)
+                    envs.append(_child_env(values))
+                    continue
+            stages.append(partial(execute_node, command, aliases))
+            plans.append([])
+            names.append(_stage_name(command))
+            limits.append(None)
+            envs.append(None)
+        status = run_pipeline(stages, background, unparse(node), plans, names, limits, envs)
+    if not background and status == 128 + signal.SIGINT:
+        global last_status
+        last_status = status
+        raise CommandInterrupted
+    if node.negate:
+        status = 0 if status else 1
+    return status
+
+
+def _exec_and_or(node, aliases):
+    status = execute_node(node.first, aliases)
+    for op, pipeline in node.rest:
+        if (op == '&&') == (status == 0):
+            status = execute_node(pipeline, aliases)
+    return status
+
+
+def _exec_sequence(node, aliases):
+    status = last_status
+    for item, background in node.items:
+        if not background:
+            status = execute_node(item, aliases)
+        elif isinstance(item, Pipeline):
+            status = _exec_pipeline(item, aliases, background=True)
+        else:
+            status = _in_child(item, aliases, background=True)
+    return status
+
+
+def _exec_subshell(node, aliases):
+    return _in_child(node.body, aliases, plan=redirect_plan(node.redirects), name='subshell')
+
+
+def _exec_group(node, aliases):
+    return _with_redirects(node.redirects, lambda: execute_node(node.body, aliases))
+
+
+def _exec_if(node, aliases):
+    def run():
+        for condition, body in node.clauses:
+            if execute_node(condition, aliases) == 0:
+                return execute_node(body, aliases)
+        if node.else_body is not None:
+            return execute_node(node.else_body, aliases)
+        return 0
+    return _with_redirects(node.redirects, run)
+
+
+def _run_loop(iterations, body, aliases):
+    """Run body once per step of iterations, honouring break/continue."""
+    global loop_depth
+    status = 0
+    loop_depth += 1
+    try:
+        for _ in iterations:
+            try:
+                status = execute_node(body, aliases)
+            except LoopControl as control:
+                if control.levels > 1:
+                    control.levels -= 1
+                    raise
+                if control.kind == 'break':
+                    break
+    finally:
+        loop_depth -= 1
+    return status
+
+
+def _exec_while(node, aliases):
+    def iterations():
+        while (execute_node(node.condition, aliases) == 0) != node.until:
+            yield
+    return _with_redirects(node.redirects, lambda: _run_loop(iterations(), node.body, aliases))
+
+
+def _exec_for(node, aliases):
+    def iterations():
+        values = positional_args[-1] if node.words is None else expand_words(node.words, ShellScope(aliases))
+        for value in values:
+            set_var(node.name, value)
+            yield
+    return _with_redirects(node.redirects, lambda: _run_loop(iterations(), node.body, aliases))
+
+
+def _exec_function_def(node, aliases):
+    functions[node.name] = node.body
+    return 0
+
+
+_EXECUTORS = {
+    Command: _exec_command,
+    Pipeline: _exec_pipeline,
+    AndOr: _exec_and_or,
+    Sequence: _exec_sequence,
+    Subshell: _exec_subshell,
+    Group: _exec_group,
+    If: _exec_if,
+    While: _exec_while,
+    For: _exec_for,
+    FunctionDef: _exec_function_def,
+}
 
-    elif command == 'help':
-        print_banner()
-        print_info("Built-in commands: exit, cd, jobs, alias, unalias, history, help")
-        return True
-        
-    return False
 
-def shell_loop(aliases):
+def execute_node(node, aliases):
+    """Run one AST node and return (and record) its exit status."""
+    global last_status
+    try:
+        last_status = _EXECUTORS[type(node)](node, aliases)
+    except ExpansionError as e:
+        print_error(str(e))
+        last_status = 1
+        if isinstance(e, UnsetParameterError) and not interactive:
+            sys.exit(last_status)
+    return last_status
+
+
+def execute_line(line, aliases):
+    """Alias-expand, parse and run one command line (or script chunk); returns its exit status."""
+    global last_status, _globber
+    _globber = Globber(logical_cwd)
+    inp = expand_alias(line, aliases) if aliases else line
+    try:
+        tree = parse(inp)
+    except ParseError as e:
+        print_error(str(e))
+        last_status = 2
+        return last_status
+    if not tree.items:
+        return last_status
+    return execute_node(tree, aliases)
+
+
+def session_script():
+    """Commands that give a fresh shell this one's variables, options and functions (GUI jobs)."""
+    lines = [f"{name}={shlex.quote(value)}" for name, value in shell_vars.items()]
+    lines.extend(f"set {'-' if enabled else '+'}o {name}" for name, enabled in shell_options.items())
+    if disabled_builtins:
+        lines.append(f"enable -n {' '.join(sorted(disabled_builtins))}")
+    lines.extend(unparse(FunctionDef(name, body)) for name, body in functions.items())
+    return '\n'.join(lines)
+
+
+def run_script(lines, aliases=None):
+    """Run commands without readline, history, banner or status decoration; returns the last status.
+
+    Used for 'main.py -c', script files and piped stdin. Lines are gathered until they
+    form a complete command, so if/while/for and functions may span several lines.
+    """
+    global interactive
+    set_decorations(False)
+    interactive = False
+    aliases = aliases if aliases is not None else {}
+    pending = ''
+    for line in lines:
+        if not pending and not line.strip():
+            continue
+        pending += line.rstrip('\n') + '\n'
+        if not is_complete(pending):
+            continue
+        try:
+            execute_line(pending, aliases)
+        except KeyboardInterrupt:
+            return 130
+        except Exception as e:
+            print_error(f"An unexpected error occurred: {e}")
+        pending = ''
+    if pending:
+        # Unterminated construct at end of input: let the parser report it.
+        # A backslash-newline on the last line has nothing to join and is dropped, as in sh.
+        if pending.endswith('\\\n') and is_complete(pending[:-2]):
+            pending = pending[:-2]
+        execute_line(pending, aliases)
+    return last_status
+
+
+def startup_phases(aliases, attached=False):
+    """The steps before an interactive session's first prompt, as (name, function) pairs.
+
+    An attached session (served by the daemon) has history loaded already and
+    no terminal of its own to do job control on.
+    """
+    phases = [('readline', partial(setup_readline, aliases))]
+    if not attached:
+        phases.append(('job control', init_job_control))
+    phases.append(('banner', print_banner))
+    phases.append(('history', refresh_history if attached else load_history))
+    return phases
+
+
+def shell_loop(aliases, attached=False):
     """Main interactive loop for the command-line shell."""
-    setup_readline()
-    print_banner()
+    for _, step in startup_phases(aliases, attached):
+        step()
 
     while True:
         try:
+            notify_jobs()
+            set_prompt_state(jobs=len(get_jobs()))
             raw_inp = input(get_colored_prompt()).strip()
             if not raw_inp:
                 continue
-
             save_history(raw_inp)
-            inp = expand_alias(raw_inp, aliases)
-            background = inp.endswith('&')
-            if background:
-                inp = inp[:-1].strip()
-
-            args = shlex.split(inp)
-            if not args:
-                continue
-
-            command = args[0]
-            expanded_args = []
-            if len(args) > 1:
-                for arg in args[1:]:
-                    if any(c in arg for c in '*?['):
-                        glob_matches = glob.glob(arg)
-                        if glob_matches:
-                            expanded_args.extend(glob_matches)
-                        else:
-                            expanded_args.append(arg)
-                    else:
-                        expanded_args.append(arg)
-            
-            if handle_builtin(command, expanded_args, aliases):
-                continue
+            # Keep reading while a quote, if/while/for or function body is still open
+            while not is_complete(raw_inp):
+                try:
+                    more = input('> ')
+                except EOFError:
+                    print()
+                    break  # execute_line reports the unexpected end of input
+                save_history(more)
+                raw_inp += '\n' + more
 
-            run_command(command, expanded_args, background)
+            started = time.monotonic()
+            status = execute_line(raw_inp, aliases)
+            set_prompt_state(status=status, duration=time.monotonic() - started)
 
+        except CommandInterrupted:
+            set_prompt_state(status=last_status)
         except KeyboardInterrupt:
             print() 
             print_info("Interrupted. Type 'exit' to quit.")
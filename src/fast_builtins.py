@@ -0,0 +1,567 @@
+import os
+import sys
+import stat
+from ui import print_error
+
+# In-process versions of trivial utilities. Each handler takes
+# (command, args, aliases) like the core_shell builtins, writes to sys.stdout
+# (which the executor points at the pipe or redirection target) and returns
+# an exit status.
+
+# cat runs in-process for regular files; when sys.stdout has no fd (the GUI) it
+# reads them into memory, so only up to this many bytes in total. Anything else
+# (stdin, devices, options) goes to the real cat
+CAT_MAX_BYTES = 1 << 20
+
+_ESCAPES = {'\\': '\\', 'a': '\a', 'b': '\b', 'e': '\x1b', 'E': '\x1b', 'f': '\f',
+            'n': '\n', 'r': '\r', 't': '\t', 'v': '\v', '"': '"', "'": "'"}
+# Compiled (and cached) by 're' on first use, so startup does not import it
+_PRINTF_SPEC = r'%([-+ #0]*)(\*|\d+)?(?:\.(\*|\d*))?([diouxXeEfFgGcsb%])'
+
+
+class _StopOutput(Exception):
+    """\\c in echo -e or printf: print the text so far and nothing further."""
+    def __init__(self, text):
+        super().__init__(text)
+        self.text = text
+
+
+def _write(text):
+    sys.stdout.write(text)
+
+
+def _write_bytes(data, stream=None):
+    stream = sys.stdout if stream is None else stream
+    buffer = getattr(stream, 'buffer', None)
+    if buffer is None:
+        # The GUI's output object only takes text
+        stream.write(data.decode(errors='replace'))
+    else:
+        stream.flush()
+        buffer.write(data)
+
+
+def _leading(text, start, allowed, limit):
+    """The longest run (at most limit chars) of allowed characters at text[start:]."""
+    end = start
+    while end < len(text) and end - start < limit and text[end] in allowed:
+        end += 1
+    return text[start:end]
+
+
+def expand_escapes(text, octal_needs_zero=True):
+    """Interpret backslash escapes as echo -e and printf do.
+
+    echo -e and %b spell octal as \\0NNN; a printf format uses \\NNN.
+    Raises _StopOutput carrying the text before a \\c.
+    """
+    out = []
+    i = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c != '\\' or i + 1 >= n:
+            out.append(c)
+            i += 1
+            continue
+        e = text[i + 1]
+        i += 2
+        if e in _ESCAPES:
+            out.append(_ESCAPES[e])
+        elif e == 'c':
+            raise _StopOutput(''.join(out))
+        elif e == 'x':
+            digits = _leading(text, i, '0123456789abcdefABCDEF', 2)
+            if digits:
+                out.append(chr(int(digits, 16)))
+                i += len(digits)
+            else:
+                out.append('\\x')
+        elif e == '0' and octal_needs_zero or e in '01234567' and not octal_needs_zero:
+            start = i if octal_needs_zero else i - 1
+            digits = _leading(text, start, '01234567', 3)
+            out.append(chr(int(digits or '0', 8) & 0xFF))
+            i = start + len(digits)
+        else:
+            out.append('\\' + e)
+    return ''.join(out)
+
+
+def builtin_echo(command, args, aliases=None):
+    newline = True
+    escapes = False
+    # Only words made purely of n/e/E flags are options, like bash
+    while args and len(args[0]) > 1 and args[0][0] == '-' and not args[0][1:].strip('neE'):
+        for flag in args[0][1:]:
+            if flag == 'n':
+                newline = False
+            else:
+                escapes = flag == 'e'
+        args = args[1:]
+    text = ' '.join(args)
+    if escapes:
+        try:
+            text = expand_escapes(text)
+        except _StopOutput as stop:
+            _write(stop.text)
+            return 0
+    _write(text + '\n' if newline else text)
+    return 0
+
+
+def builtin_pwd(command, args, aliases=None):
+    try:
+        cwd = os.getcwd()
+    except OSError as e:
+        print_error(f"pwd: {e.strerror}")
+        return 1
+    _write((os.path.realpath(cwd) if '-P' in args else cwd) + '\n')
+    return 0
+
+
+def builtin_true(command, args, aliases=None):
+    return 0
+
+
+def builtin_false(command, args, aliases=None):
+    return 1
+
+
+# --- test / [ ---
+_UNARY_TESTS = {
+    '-e': lambda p: os.path.exists(p),
+    '-f': lambda p: os.path.isfile(p),
+    '-d': lambda p: os.path.isdir(p),
+    '-L': lambda p: os.path.islink(p),
+    '-h': lambda p: os.path.islink(p),
+    '-r': lambda p: os.access(p, os.R_OK),
+    '-w': lambda p: os.access(p, os.W_OK),
+    '-x': lambda p: os.access(p, os.X_OK),
+    '-s': lambda p: _stat_test(p, lambda st: st.st_size > 0),
+    '-b': lambda p: _stat_test(p, lambda st: stat.S_ISBLK(st.st_mode)),
+    '-c': lambda p: _stat_test(p, lambda st: stat.S_ISCHR(st.st_mode)),
+    '-p': lambda p: _stat_test(p, lambda st: stat.S_ISFIFO(st.st_mode)),
+    '-S': lambda p: _stat_test(p, lambda st: stat.S_ISSOCK(st.st_mode)),
+    '-u': lambda p: _stat_test(p, lambda st: bool(st.st_mode & stat.S_ISUID)),
+    '-g': lambda p: _stat_test(p, lambda st: bool(st.st_mode & stat.S_ISGID)),
+    '-k': lambda p: _stat_test(p, lambda st: bool(st.st_mode & stat.S_ISVTX)),
+    '-O': lambda p: _stat_test(p, lambda st: st.st_uid == os.geteuid()),
+    '-G': lambda p: _stat_test(p, lambda st: st.st_gid == os.getegid()),
+    '-t': lambda fd: fd.isdigit() and os.isatty(int(fd)),
+    '-z': lambda s: s == '',
+    '-n': lambda s: s != '',
+}
+
+_STRING_TESTS = {
+    '=': lambda a, b: a == b,
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '>': lambda a, b: a > b,
+}
+
+_INTEGER_TESTS = {
+    '-eq': lambda a, b: a == b,
+    '-ne': lambda a, b: a != b,
+    '-lt': lambda a, b: a < b,
+    '-le': lambda a, b: a <= b,
+    '-gt': lambda a, b: a > b,
+    '-ge': lambda a, b: a >= b,
+}
+
+_FILE_TESTS = {
+    '-nt': lambda a, b: _mtime(a) > _mtime(b),
+    '-ot': lambda a, b: _mtime(a) < _mtime(b),
+    '-ef': lambda a, b: _same_file(a, b),
+}
+
+BINARY_TESTS = {**_STRING_TESTS, **_INTEGER_TESTS, **_FILE_TESTS}
+
+
+class TestError(ValueError):
+    """Malformed test expression (exit status 2)."""
+
+
+def _stat_test(path, predicate):
+    try:
+        return predicate(os.stat(path))
+    except OSError:
+        return False
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return -1
+
+
+def _same_file(a, b):
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def _integer(text):
+    try:
+        return int(text.strip())
+    except ValueError:
+        raise TestError(f"{text}: integer expression expected") from None
+
+
+def _binary(left, op, right):
+    if op in _INTEGER_TESTS:
+        return _INTEGER_TESTS[op](_integer(left), _integer(right))
+    return BINARY_TESTS[op](left, right)
+
+
+class _TestParser:
+    """POSIX test grammar: expr := and (-o and)*, and := not (-a not)*, not := ! not | primary."""
+
+    def __init__(self, args):
+        self.args = args
+        self.pos = 0
+
+    def remaining(self):
+        return len(self.args) - self.pos
+
+    def take(self):
+        if self.pos >= len(self.args):
+            raise TestError("argument expected")
+        token = self.args[self.pos]
+        self.pos += 1
+        return token
+
+    def parse(self):
+        result = self.parse_or()
+        if self.pos < len(self.args):
+            raise TestError(f"{self.args[self.pos]}: unexpected argument")
+        return result
+
+    def parse_or(self):
+        result = self.parse_and()
+        while self.remaining() > 0 and self.args[self.pos] == '-o':
+            self.pos += 1
+            right = self.parse_and()
+            result = result or right
+        return result
+
+    def parse_and(self):
+        result = self.parse_not()
+        while self.remaining() > 0 and self.args[self.pos] == '-a':
+            self.pos += 1
+            right = self.parse_not()
+            result = result and right
+        return result
+
+    def parse_not(self):
+        if self.remaining() > 1 and self.args[self.pos] == '!':
+            self.pos += 1
+            return not self.parse_not()
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.take()
+        if self.remaining() >= 2 and self.args[self.pos] in BINARY_TESTS:
+            op = self.take()
+            return _binary(token, op, self.take())
+        if token == '(' and self.remaining() >= 1:
+            result = self.parse_or()
+            if self.take() != ')':
+                raise TestError("')' expected")
+            return result
+        if token in _UNARY_TESTS and self.remaining() >= 1:
+            return _UNARY_TESTS[token](self.take())
+        return token != ''
+
+
+def evaluate_test(args):
+    """Evaluate a test expression; returns True/False or raises TestError."""
+    # POSIX fixes the meaning of short expressions by argument count
+    if not args:
+        return False
+    if len(args) == 1:
+        return args[0] != ''
+    if len(args) == 2:
+        if args[0] == '!':
+            return args[1] == ''
+        if args[0] in _UNARY_TESTS:
+            return _UNARY_TESTS[args[0]](args[1])
+        raise TestError(f"{args[0]}: unary operator expected")
+    if len(args) == 3:
+        if args[1] in BINARY_TESTS:
+            return _binary(*args)
+        if args[0] == '!':
+            return not evaluate_test(args[1:])
+        if args[0] == '(' and args[2] == ')':
+            return args[1] != ''
+    if len(args) == 4 and args[0] == '!':
+        return not evaluate_test(args[1:])
+    return _TestParser(args).parse()
+
+
+def builtin_test(command, args, aliases=None):
+    if command == '[':
+        if not args or args[-1] != ']':
+            print_error("[: missing ']'")
+            return 2
+        args = args[:-1]
+    try:
+        return 0 if evaluate_test(args) else 1
+    except TestError as e:
+        print_error(f"{command}: {e}")
+        return 2
+
+
+# --- printf ---
+def _printf_number(text, integer=True):
+    """Parse a printf numeric argument: decimal, 0x hex, 0 octal or 'c character constants."""
+    if text[:1] in ('"', "'") and len(text) > 1:
+        return ord(text[1])
+    try:
+        if integer:
+            digits = text.lstrip('+-')
+            # A leading 0 means octal (int(..., 0) rejects '010')
+            return int(text, 8) if len(digits) > 1 and digits[0] == '0' and digits.isdigit() else int(text, 0)
+        return float(text)
+    except ValueError:
+        raise ValueError(f"{text}: invalid number") from None
+
+
+def _format_once(fmt, args, errors):
+    """Render fmt once, consuming args; returns (text, number of args used)."""
+    out = []
+    used = 0
+    pos = 0
+
+    def next_arg():
+        nonlocal used
+        if used < len(args):
+            used += 1
+            return args[used - 1]
+        return None
+
+    def escaped(text, octal_needs_zero=False):
+        try:
+            return expand_escapes(text, octal_needs_zero)
+        except _StopOutput as stop:
+            raise _StopOutput(''.join(out) + stop.text) from None
+
+    import re
+    for match in re.finditer(_PRINTF_SPEC, fmt):
+        out.append(escaped(fmt[pos:match.start()]))
+        pos = match.end()
+        flags, width, precision, conv = match.groups()
+        if conv == '%':
+            out.append('%')
+            continue
+        if width == '*':
+            width = str(_printf_number(next_arg() or '0'))
+        if precision == '*':
+            precision = str(_printf_number(next_arg() or '0'))
+        spec = '%' + flags + (width or '') + ('.' + precision if precision is not None else '')
+        arg = next_arg()
+        try:
+            if conv in 'diouxX':
+                value = _printf_number(arg or '0')
+                out.append((spec + ('d' if conv in 'iu' else conv)) % value)
+            elif conv in 'eEfFgG':
+                out.append((spec + conv) % _printf_number(arg or '0', integer=False))
+            elif conv == 'c':
+                out.append((spec + 's') % (arg or '')[:1])
+            elif conv == 'b':
+                out.append((spec + 's') % escaped(arg or '', octal_needs_zero=True))
+            else:
+                out.append((spec + 's') % (arg or ''))
+        except ValueError as e:
+            errors.append(str(e))
+            out.append((spec + 'd') % 0 if conv in 'diouxX' else '0')
+    out.append(escaped(fmt[pos:]))
+    return ''.join(out), used
+
+
+def builtin_printf(command, args, aliases=None):
+    if not args:
+        print_error("printf: usage: printf format [arguments]")
+        return 2
+    fmt, args = args[0], args[1:]
+    errors = []
+    pieces = []
+    try:
+        # The format is reused until every argument has been consumed
+        while True:
+            text, used = _format_once(fmt, args, errors)
+            pieces.append(text)
+            args = args[used:]
+            if not args or not used:
+                break
+    except _StopOutput as stop:
+        pieces.append(stop.text)
+    for message in errors:
+        print_error(f"printf: {message}")
+    _write(''.join(pieces))
+    return 1 if errors else 0
+
+
+# --- cat, tee, pv ---
+# These move data fd to fd with splice/sendfile/copy_file_range (zero_copy), so
+# they need sys.stdout to be a real file descriptor. The GUI's own output object
+# is not one; there cat is limited to small files it reads into memory.
+
+def _output_fd():
+    """sys.stdout's file descriptor (after flushing it), or None if it has none."""
+    try:
+        fd = sys.stdout.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+    sys.stdout.flush()
+    return fd
+
+
+def cat_fast_path_applies(args):
+    """cat runs in-process only for plain regular files (small in total unless stdout is an fd)."""
+    if not args:
+        return False
+    limit = None if _output_fd() is not None else CAT_MAX_BYTES
+    total = 0
+    for path in args:
+        if path.startswith('-'):
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if not stat.S_ISREG(st.st_mode):
+            return False
+        total += st.st_size
+        if limit is not None and total > limit:
+            return False
+    return True
+
+
+def fd_output_applies(args):
+    return _output_fd() is not None
+
+
+def builtin_cat(command, args, aliases=None):
+    out = _output_fd()
+    if out is not None:
+        from zero_copy import copy_fd
+    status = 0
+    for path in args:
+        try:
+            with open(path, 'rb') as f:
+                if out is None:
+                    _write_bytes(f.read())
+                else:
+                    copy_fd(f.fileno(), out)
+        except OSError as e:
+            print_error(f"cat: {path}: {e.strerror}")
+            status = 1
+    return status
+
+
+def builtin_tee(command, args, aliases=None):
+    """tee [-a] [file ...]: copy stdin to stdout and each file."""
+    from zero_copy import tee
+    append = False
+    while args and args[0].startswith('-') and args[0] != '-':
+        if args[0] == '--':
+            args = args[1:]
+            break
+        if args[0] != '-a':
+            print_error(f"tee: {args[0]}: invalid option")
+            return 2
+        append = True
+        args = args[1:]
+    status = 0
+    targets = [_output_fd()]
+    try:
+        for path in args:
+            # Read access lets tee send the other copies from this file; splice
+            # refuses O_APPEND targets, so appending seeks to the end instead
+            flags = os.O_CREAT | (0 if append else os.O_TRUNC)
+            try:
+                try:
+                    fd = os.open(path, os.O_RDWR | flags, 0o666)
+                except PermissionError:
+                    fd = os.open(path, os.O_WRONLY | flags, 0o666)
+            except OSError as e:
+                print_error(f"tee: {path}: {e.strerror}")
+                status = 1
+                continue
+            targets.append(fd)
+            if append:
+                os.lseek(fd, 0, os.SEEK_END)
+        try:
+            tee(0, targets)
+        except OSError as e:
+            print_error(f"tee: {e.strerror}")
+            status = 1
+    finally:
+        for fd in targets[1:]:
+            os.close(fd)
+    return status
+
+
+def builtin_pv(command, args, aliases=None):
+    """pv [-q] [-i SECONDS] [-N NAME] [file ...]: copy input to stdout, showing bytes and rate on stderr."""
+    from zero_copy import copy_fd, Meter
+    quiet, interval, name = False, 1.0, None
+    while args and args[0].startswith('-') and args[0] != '-':
+        option, args = args[0], args[1:]
+        if option == '--':
+            break
+        if option == '-q':
+            quiet = True
+        elif option in ('-i', '-N') and args:
+            value, args = args[0], args[1:]
+            if option == '-N':
+                name = value
+                continue
+            try:
+                interval = float(value)
+            except ValueError:
+                print_error(f"pv: -i: invalid interval: {value}")
+                return 2
+        else:
+            print_error(f"pv: {option}: invalid option")
+            return 2
+    out = _output_fd()
+    meter = None if quiet else Meter(name, interval)
+    status = 0
+    for path in args or ['-']:
+        try:
+            if path == '-':
+                copy_fd(0, out, meter)
+                continue
+            with open(path, 'rb') as f:
+                copy_fd(f.fileno(), out, meter)
+        except OSError as e:
+            print_error(f"pv: {path}: {e.strerror}")
+            status = 1
+    if meter is not None:
+        meter.finish()
+    return status
+
+
+FAST_BUILTINS = {
+    'echo': builtin_echo,
+    'pwd': builtin_pwd,
+    'true': builtin_true,
+    'false': builtin_false,
+    'test': builtin_test,
+    '[': builtin_test,
+    'printf': builtin_printf,
+    'cat': builtin_cat,
+    'tee': builtin_tee,
+    'pv': builtin_pv,
+}
+
+# Builtins that only handle some argument lists; the rest run the external program
+FAST_PATH_CHECKS = {
+    'cat': cat_fast_path_applies,
+    'tee': fd_output_applies,
+    'pv': fd_output_applies,
+}
@@ -0,0 +1,289 @@
+import os
+import errno
+from functools import lru_cache
+
+# Pathname expansion works on "chars": a list of (char, quoted) pairs built from a
+# word's parts, so quoted wildcards and braces stay literal.
+
+GLOB_CHARS = '*?['
+
+try:
+    ARG_MAX = os.sysconf('SC_ARG_MAX')
+except (AttributeError, ValueError, OSError):
+    ARG_MAX = 131072
+# Linux also refuses any single argument or environment string longer than this
+MAX_ARG_STRLEN = 32 * 4096
+POINTER_SIZE = 8
+
+# 're' is imported where needed, so lines without braces or wildcards never load it
+_RANGE = r'^(-?\d+|[A-Za-z])\.\.(-?\d+|[A-Za-z])(?:\.\.(-?\d+))?$'
+
+
+class ArgumentListTooLong(OSError):
+    """The expanded argv (plus environment) would not fit through exec."""
+    def __init__(self, size, limit):
+        super().__init__(errno.E2BIG, f"Argument list too long ({size} bytes, limit {limit})")
+
+
+def word_chars(parts):
+    """(text, quote) word parts -> list of (char, quoted) pairs."""
+    return [(c, quote is not None) for text, quote in parts for c in text]
+
+
+def has_magic(chars):
+    """True if chars contain an unquoted wildcard."""
+    return any(c in GLOB_CHARS and not quoted for c, quoted in chars)
+
+
+def needs_expansion(parts):
+    """Cheap pre-check: could brace or pathname expansion change this word at all?"""
+    return any(quote is None and any(c in text for c in '*?[{') for text, quote in parts)
+
+
+# --- Brace expansion ---
+def _range_items(body):
+    """'1..5', 'a..e' or '1..10..2' -> list of strings, or None if body is not a range."""
+    import re
+    match = re.match(_RANGE, body)
+    if not match:
+        return None
+    start, end, step = match.groups()
+    step = abs(int(step)) if step else 1
+    if step == 0:
+        step = 1
+    if start.lstrip('-').isdigit() and end.lstrip('-').isdigit():
+        first, last = int(start), int(end)
+        # {01..10} pads every item to the wider endpoint
+        padded = any(len(s.lstrip('-')) > 1 and s.lstrip('-')[0] == '0' for s in (start, end))
+        width = max(len(start), len(end)) if padded else 0
+        values = range(first, last + 1, step) if first <= last else range(first, last - 1, -step)
+        return [str(v).zfill(width) if width else str(v) for v in values]
+    if start.isalpha() and end.isalpha() and len(start) == len(end) == 1:
+        first, last = ord(start), ord(end)
+        values = range(first, last + 1, step) if first <= last else range(first, last - 1, -step)
+        return [chr(v) for v in values]
+    return None
+
+
+def _find_brace(chars, start=0):
+    """Locate the first expandable unquoted {...}; returns (open, close, alternatives) or None."""
+    n = len(chars)
+    i = start
+    while i < n:
+        c, quoted = chars[i]
+        if c == '{' and not quoted and not (i > 0 and chars[i - 1] == ('$', False)):
+            depth = 0
+            commas = []
+            for j in range(i, n):
+                d, q = chars[j]
+                if q:
+                    continue
+                if d == '{':
+                    depth += 1
+                elif d == '}':
+                    depth -= 1
+                    if depth == 0:
+                        if commas:
+                            bounds = [i] + commas + [j]
+                            return i, j, [chars[a + 1:b] for a, b in zip(bounds, bounds[1:])]
+                        items = _range_items(''.join(ch for ch, _ in chars[i + 1:j]))
+                        if items is not None:
+                            return i, j, [[(ch, False) for ch in item] for item in items]
+                        break
+                elif d == ',' and depth == 1:
+                    commas.append(j)
+        i += 1
+    return None
+
+
+def brace_expand(chars):
+    """Expand unquoted {a,b} and {x..y} forms, left to right; returns a list of char lists."""
+    found = _find_brace(chars)
+    if found is None:
+        return [chars]
+    open_at, close_at, alternatives = found
+    prefix, suffix = chars[:open_at], chars[close_at + 1:]
+    results = []
+    for alternative in alternatives:
+        # The prefix has no expandable brace left, so only the rest needs another pass
+        for expanded in brace_expand(alternative + suffix):
+            results.append(prefix + expanded)
+    return results
+
+
+# --- Pattern matching ---
+@lru_cache(maxsize=512)
+def _compile(component):
+    """Compile one path component (tuple of (char, quoted)) into a regex matching a file name."""
+    import re
+    out = []
+    i = 0
+    n = len(component)
+    while i < n:
+        c, quoted = component[i]
+        if quoted:
+            out.append(re.escape(c))
+        elif c == '*':
+            if not out or out[-1] != '.*':
+                out.append('.*')
+        elif c == '?':
+            out.append('.')
+        elif c == '[':
+            j = i + 1
+            negate = j < n and component[j][0] in '!^' and not component[j][1]
+            if negate:
+                j += 1
+            body_start = j
+            if j < n and component[j][0] == ']':
+                j += 1  # A leading ']' is literal
+            while j < n and component[j][0] != ']':
+                j += 1
+            if j >= n:
+                out.append(re.escape('['))
+            else:
+                body = ''.join('\\' + ch if ch in '\\[]^' or (q and ch == '-') else ch
+                               for ch, q in component[body_start:j])
+                out.append('[' + ('^' if negate else '') + body + ']')
+                i = j
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile('(?s:' + ''.join(out) + r')\Z')
+
+
+def compile_pattern(chars):
+    """Regex for a whole-string shell pattern given as (char, quoted) pairs (used by ${var#pattern})."""
+    return _compile(tuple((c, bool(quoted)) for c, quoted in chars))
+
+
+def _split_components(chars):
+    """Split chars on '/' into components; returns (absolute, components, trailing_slash)."""
+    components = [[]]
+    for pair in chars:
+        if pair[0] == '/':
+            components.append([])
+        else:
+            components[-1].append(pair)
+    absolute = not components[0] and len(components) > 1
+    trailing_slash = len(components) > 1 and not components[-1]
+    return absolute, [tuple(c) for c in components if c], trailing_slash
+
+
+def _is_dir(entry, follow_symlinks=True):
+    try:
+        return entry.is_dir(follow_symlinks=follow_symlinks)
+    except OSError:
+        return False
+
+
+class Globber:
+    """Sorted pathname expansion over cached os.scandir listings.
+
+    One instance serves every word of a command line, so 'ls *.c *.h src/*.c'
+    lists each directory once. A cached listing is reused only while the
+    directory's inode and mtime are unchanged, so commands run earlier on the
+    same line (touch, rm, cd) are still seen.
+    """
+
+    def __init__(self, root=None):
+        self.root = root     # Directory relative patterns are matched in (None: the process cwd)
+        self._listings = {}  # directory -> ((dev, ino, mtime_ns), [(name, DirEntry)])
+
+    def _on_disk(self, path):
+        return path if self.root is None else os.path.join(self.root, path)
+
+    def listdir(self, directory):
+        """Sorted (name, os.DirEntry) pairs for a directory; empty if unreadable."""
+        try:
+            st = os.stat(self._on_disk(directory))
+        except OSError:
+            return ()
+        # Relative names change meaning after a cd, so the inode is part of the check
+        stamp = (st.st_dev, st.st_ino, st.st_mtime_ns)
+        cached = self._listings.get(directory)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        try:
+            # DirEntry answers is_dir() lazily (and caches it); only directories we descend need it
+            with os.scandir(self._on_disk(directory)) as it:
+                entries = [(entry.name, entry) for entry in it]
+        except OSError:
+            entries = []
+        entries.sort(key=lambda item: item[0])
+        self._listings[directory] = (stamp, entries)
+        return entries
+
+    def _subdirectories(self, path, dotglob):
+        """path plus every directory below it (no symlinks followed), each ending in '/'."""
+        found = [path]
+        for name, entry in self.listdir(path or '.'):
+            if (dotglob or name[0] != '.') and _is_dir(entry, follow_symlinks=False):
+                found.extend(self._subdirectories(f"{path}{name}/", dotglob))
+        return found
+
+    def expand(self, chars, dotglob=False, globstar=True):
+        """Return the sorted paths matching chars ([] if none)."""
+        absolute, components, trailing_slash = _split_components(chars)
+        paths = ['/' if absolute else '']
+        for index, component in enumerate(components):
+            last = index == len(components) - 1 and not trailing_slash
+            matched = []
+            if not has_magic(component):
+                literal = ''.join(c for c, _ in component)
+                for path in paths:
+                    if not last:
+                        matched.append(f"{path}{literal}/")
+                    elif os.path.lexists(self._on_disk(path + literal)):
+                        matched.append(path + literal)
+            elif globstar and component == (('*', False), ('*', False)):
+                # '**' matches any number of directories (and, last, everything below them)
+                for path in paths:
+                    for directory in self._subdirectories(path, dotglob):
+                        if not last:
+                            matched.append(directory)
+                            continue
+                        matched.extend(directory + name for name, _ in self.listdir(directory or '.')
+                                       if dotglob or not name.startswith('.'))
+            else:
+                regex = _compile(component)
+                dot_ok = dotglob or component[0][0] == '.'
+                for path in paths:
+                    for name, entry in self.listdir(path or '.'):
+                        if (dot_ok or name[0] != '.') and regex.match(name):
+                            if last:
+                                matched.append(path + name)
+                            elif _is_dir(entry):
+                                matched.append(f"{path}{name}/")
+            paths = matched
+            if not paths:
+                return []
+        if not components:
+            return []
+        return sorted(set(paths))
+
+
+def argv_size(argv, env=None):
+    """Bytes exec needs for argv and the environment (strings, NULs and pointers)."""
+    env = os.environ if env is None else env
+    size = sum(len(os.fsencode(arg)) + 1 + POINTER_SIZE for arg in argv)
+    size += sum(len(os.fsencode(k)) + len(os.fsencode(v)) + 2 + POINTER_SIZE for k, v in env.items())
+    return size + 2 * POINTER_SIZE
+
+
+def check_arg_max(argv, env=None):
+    """Raise ArgumentListTooLong if exec would fail with E2BIG for this argv and environment."""
+    env = os.environ if env is None else env
+    # Characters, not bytes: at most 4 bytes each in UTF-8 ('=' and NUL are the +2 per variable).
+    # os.environ keeps its encoded bytes in _data; summing those skips decoding every entry.
+    data = getattr(env, '_data', env)
+    chars = sum(map(len, argv)) + sum(map(len, data)) + sum(map(len, data.values())) + 2 * len(data)
+    if len(argv) + len(data) < 1024 and chars * 4 < MAX_ARG_STRLEN:
+        return  # Common case: far below any limit, skip encoding everything
+    strings = [os.fsencode(arg) for arg in argv]
+    strings.extend(os.fsencode(f"{k}={v}") for k, v in env.items())
+    longest = max(map(len, strings), default=0)
+    if longest >= MAX_ARG_STRLEN:
+        raise ArgumentListTooLong(longest, MAX_ARG_STRLEN)
+    size = argv_size(argv, env)
+    if size > ARG_MAX:
+        raise ArgumentListTooLong(size, ARG_MAX)
@@ -2,52 +2,160 @@ import tkinter as tk
 from tkinter import scrolledtext, END
 import os
 import sys
-import shlex
-import glob
-from queue import Queue
+import time
+from queue import Queue, Empty
 import threading
 
 # Import core logic and UI components
-from core_shell import handle_builtin
-from command_exec import run_command
-from usability_features import load_aliases, save_aliases, expand_alias, COMMANDS
-from ui import strip_ansi_codes, get_colored_prompt
+from core_shell import execute_line
+from usability_features import load_aliases
+from completion_index import complete_command, complete_path, register_aliases
+from ui import strip_ansi_codes, get_plain_prompt, set_prompt_state, print_failure, print_info
+from output_pump import OutputPump, open_channel
+from gui_jobs import Session, JobScheduler, HelperDaemon, runs_in_session
+
+# Lines of output kept in the window; older lines are dropped
+try:
+    SCROLLBACK_LINES = max(100, int(os.environ.get('CUSTOMSHELL_SCROLLBACK', 10000)))
+except ValueError:
+    SCROLLBACK_LINES = 10000
+# How child output reaches the window: 'pty' (programs see a terminal) or 'pipe'
+CAPTURE_MODE = os.environ.get('CUSTOMSHELL_GUI_CAPTURE', 'pty')
+# How often the Tk thread picks up job state changes reported by the worker threads
+JOB_EVENTS_MS = 50
 
 class GuiOutput:
-    """A file-like object to redirect stdout to the GUI text area."""
-    def __init__(self, text_widget):
+    """A file-like object that streams text into the GUI text area.
+
+    Writers (any thread) only queue text. On the Tk thread, process_queue drains
+    the queue in large chunks per tick, tags whole lines in one insert call,
+    keeps the scrollback capped, and adapts its tick interval: fast while
+    output is backlogged, slower when idle. Captured child output waits in
+    wait_for_room while more than HIGH_WATER characters are queued.
+    """
+    CHUNK_CHARS = 256 * 1024      # Max characters inserted per tick
+    TICK_BUDGET = 0.012           # Seconds of insert work per tick, so input stays responsive
+    BUSY_TICK_MS = 1              # Backlog left over: come back almost immediately
+    ACTIVE_TICK_MS = 16           # Output arrived this tick: about one frame
+    IDLE_TICK_MS = 100            # Longest wait when nothing is happening
+    HIGH_WATER = 1024 * 1024      # Queued characters at which captured output pauses
+    LOW_WATER = 256 * 1024        # ... and resumes
+    LINE_TAGS = (("[+]", "success"), ("[-]", "error"), ("[i]", "info"))
+
+    def __init__(self, text_widget, max_lines=SCROLLBACK_LINES):
         self.text_widget = text_widget
         self.queue = Queue()
-        self.text_widget.after(100, self.process_queue)
+        self.max_lines = max_lines
+        # Trim in batches, not on every insert
+        self.trim_slack = max(100, max_lines // 10)
+        self._line_tag = None      # Tag of the unfinished last line, if any
+        self._tick_ms = self.IDLE_TICK_MS
+        self._queued = 0           # Characters in the queue
+        self._room = threading.Condition()
+        self.text_widget.after(self._tick_ms, self.process_queue)
 
     def write(self, s):
-        # Strip ANSI codes and put the clean string into the queue
-        clean_s = strip_ansi_codes(s)
-        self.queue.put(clean_s)
+        # Strip ANSI codes and queue the clean text; tags are chosen per line on the Tk thread
+        if s:
+            self._put(strip_ansi_codes(s), None)
+
+    def write_tagged(self, s, tag):
+        """Queue text that is drawn with one fixed tag (prompt and command echo)."""
+        self._put(s, tag)
+
+    def _put(self, s, tag):
+        with self._room:
+            self._queued += len(s)
+        self.queue.put((s, tag))
+
+    def wait_for_room(self):
+        """Block while the queue is over the high-water mark (never call from the Tk thread)."""
+        with self._room:
+            if self._queued > self.HIGH_WATER:
+                self._room.wait_for(lambda: self._queued <= self.LOW_WATER)
+
+    def _tag_for(self, line):
+        for prefix, tag in self.LINE_TAGS:
+            if line.startswith(prefix):
+                return tag
+        return "output"
+
+    def _tagged_runs(self, items):
+        """Turn queued (text, tag) items into [text, tag, text, tag, ...] with one run per tag change."""
+        runs = []
+
+        def add(text, tag):
+            if runs and runs[-1] == tag:
+                runs[-2] += text
+            else:
+                runs.extend([text, tag])
+
+        for text, fixed_tag in items:
+            if fixed_tag is not None:
+                add(text, fixed_tag)
+                self._line_tag = None if text.endswith('\n') else fixed_tag
+                continue
+            for line in text.splitlines(keepends=True):
+                # A line continuing an earlier write keeps that write's tag
+                tag = self._line_tag or self._tag_for(line)
+                add(line, tag)
+                self._line_tag = None if line.endswith('\n') else tag
+        return runs
+
+    def _drain(self):
+        """Take queued items up to the per-tick character budget."""
+        items = []
+        size = 0
+        while size < self.CHUNK_CHARS:
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                break
+            items.append(item)
+            size += len(item[0])
+        if size:
+            with self._room:
+                self._queued -= size
+                if self._queued <= self.LOW_WATER:
+                    self._room.notify_all()
+        return items
+
+    def _trim(self):
+        lines = int(self.text_widget.index('end-1c').split('.')[0])
+        if lines > self.max_lines + self.trim_slack:
+            self.text_widget.delete('1.0', f'{lines - self.max_lines + 1}.0')
 
     def process_queue(self):
-        """Process the queue to update the GUI from the main thread."""
-        while not self.queue.empty():
-            s = self.queue.get_nowait()
-            self.text_widget.config(state=tk.NORMAL)
-            if s.startswith("[+]"):
-                tag = "success"
-            elif s.startswith("[-]"):
-                tag = "error"
-            elif s.startswith("[i]"):
-                tag = "info"
-            else:
-                tag = "output"
-            self.text_widget.insert(END, s, tag)
-            self.text_widget.config(state=tk.DISABLED)
-            self.text_widget.see(END)
-        self.text_widget.after(100, self.process_queue)
+        """Move queued output into the widget from the Tk thread, then schedule the next tick."""
+        deadline = time.monotonic() + self.TICK_BUDGET
+        wrote = False
+        widget = self.text_widget
+        # Only follow the output if the user has not scrolled back
+        at_bottom = widget.yview()[1] >= 0.999
+        while time.monotonic() < deadline:
+            items = self._drain()
+            if not items:
+                break
+            runs = self._tagged_runs(items)
+            if not wrote:
+                widget.config(state=tk.NORMAL)
+                wrote = True
+            widget.insert(END, *runs)
+        if wrote:
+            self._trim()
+            widget.config(state=tk.DISABLED)
+            if at_bottom:
+                widget.see(END)
+            self._tick_ms = self.BUSY_TICK_MS if not self.queue.empty() else self.ACTIVE_TICK_MS
+        else:
+            self._tick_ms = min(self.IDLE_TICK_MS, self._tick_ms * 2)
+        widget.after(self._tick_ms, self.process_queue)
 
     def flush(self):
         pass  # Required for file-like objects
 
 class CustomShellGUI:
-    def __init__(self, root):
+    def __init__(self, root, daemon=None):
         self.root = root
         self.root.title("CustomShell v1.0 - GUI")
         self.root.geometry("800x600")
@@ -63,6 +171,10 @@ class CustomShellGUI:
         }
 
         self.aliases = load_aliases()
+        register_aliases(self.aliases)
+        self.session = Session()  # The GUI process itself never changes directory
+        self.reported_jobs = set()
+        self.jobs_tick = None
         self.history = []
         self.current_history_index = 0
         self.last_completion_text = None
@@ -76,9 +188,35 @@ class CustomShellGUI:
         self.gui_output = GuiOutput(self.output_text)
         sys.stdout = self.gui_output
         sys.stderr = self.gui_output
+        self.capture_output()
+        # Workers only queue job changes; Tk is called from its own thread alone
+        self.job_events = Queue()
+        self.scheduler = JobScheduler(self.session, self.aliases, self.pump, self.job_events.put,
+                                      use_pty=CAPTURE_MODE != 'pipe', daemon=daemon)
+        self.root.after(JOB_EVENTS_MS, self.poll_job_events)
 
         self.print_banner_gui()
 
+    def capture_output(self):
+        """Point fds 1 and 2 at a capture channel so launched programs write into the window.
+
+        Python-level output already goes through GuiOutput; this catches what
+        child processes write to the descriptors they inherit.
+        """
+        self.pump = OutputPump(self.gui_output.write, self.gui_output.wait_for_room)
+        read_fd, write_fd = open_channel(use_pty=CAPTURE_MODE != 'pipe')
+        self.saved_fds = (os.dup(1), os.dup(2))
+        os.dup2(write_fd, 1)
+        os.dup2(write_fd, 2)
+        os.close(write_fd)
+        self.pump.add(read_fd)
+
+    def release_output(self):
+        for fd, saved in zip((1, 2), self.saved_fds):
+            os.dup2(saved, fd)
+            os.close(saved)
+        self.pump.close()
+
     def setup_ui(self):
         self.output_text = scrolledtext.ScrolledText(
             self.root, wrap=tk.WORD, bg='#212121', fg='white',
@@ -102,8 +240,21 @@ class CustomShellGUI:
         self.input_entry.bind('<Down>', self.history_down)
         self.input_entry.bind('<Tab>', self.handle_autocomplete)
         self.input_entry.bind('<Key>', self.reset_autocomplete)
+        self.input_entry.bind('<Control-c>', self.cancel_newest_job)
         self.input_entry.focus()
 
+        jobs_frame = tk.Frame(self.root, bg='#212121')
+        jobs_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        self.jobs_list = tk.Listbox(
+            jobs_frame, height=4, bg='#2a2a2a', fg='#E0E0E0', selectbackground='#2196F3',
+            font=('Consolas', 10), relief=tk.FLAT, activestyle='none'
+        )
+        self.jobs_list.pack(fill=tk.X, expand=True, side=tk.LEFT)
+        tk.Button(
+            jobs_frame, text="Cancel", command=self.cancel_selected_job,
+            bg='#333', fg='white', relief=tk.FLAT
+        ).pack(side=tk.LEFT, padx=(5, 0))
+
     def configure_tags(self):
         for tag, color in self.tag_colors.items():
             self.output_text.tag_config(tag, foreground=color)
@@ -116,16 +267,15 @@ Type 'help' to see a list of commands, or 'exit' to quit.
         print(banner)
 
     def update_prompt(self):
-        prompt_text = strip_ansi_codes(get_colored_prompt())
+        set_prompt_state(cwd=self.session.cwd)
+        prompt_text = get_plain_prompt()
         self.prompt_label.config(text=prompt_text, fg=self.tag_colors['prompt'])
         return prompt_text
     
     def echo_command(self, prompt, command):
-        self.output_text.config(state=tk.NORMAL)
-        self.output_text.insert(END, prompt, "prompt")
-        self.output_text.insert(END, command + '\n', "command")
-        self.output_text.config(state=tk.DISABLED)
-        self.output_text.see(END)
+        # Through the queue, so it lands after output that is still pending
+        self.gui_output.write_tagged(prompt, "prompt")
+        self.gui_output.write_tagged(command + '\n', "command")
 
     def process_command_gui(self, event=None):
         inp = self.input_entry.get().strip()
@@ -141,47 +291,89 @@ Type 'help' to see a list of commands, or 'exit' to quit.
         self.input_entry.delete(0, END)
         self.reset_autocomplete()
 
-        threading.Thread(target=self.execute_in_thread, args=(inp,), daemon=True).start()
+        if runs_in_session(inp, self.aliases):
+            self.run_in_session(inp)
+        else:
+            self.scheduler.submit(inp)
 
-    def execute_in_thread(self, inp):
+    def run_in_session(self, inp):
+        """Run cd, alias, set, export, assignments, function definitions... right here, so they affect later jobs."""
         try:
-            inp = expand_alias(inp, self.aliases)
-            background = inp.endswith('&')
-            if background:
-                inp = inp[:-1].strip()
-
-            args = shlex.split(inp)
-            if not args: return
-            
-            expanded_args = []
-            for arg in args[1:]:
-                if any(c in arg for c in '*?['):
-                    glob_matches = glob.glob(arg)
-                    if glob_matches:
-                        expanded_args.extend(glob_matches)
-                    else:
-                        expanded_args.append(arg)
-                else:
-                    expanded_args.append(arg)
-            
-            command = args[0]
-            args = expanded_args
-
-            if command == 'exit':
-                self.root.quit()
-                return
-            if command == 'cd':
-                handle_builtin(command, args, self.aliases)
-                self.root.after(0, self.update_prompt)
-                return
-
-            if handle_builtin(command, args, self.aliases):
-                pass
-            else:
-                run_command(command, args, background)
-
+            status = execute_line(inp, self.aliases)
+            self.session.update_env(os.environ)
+        except SystemExit:
+            self.root.quit()
+            return
         except Exception as e:
             print(f"[-] GUI Execution Error: {e}")
+            status = 1
+        set_prompt_state(status=status)
+        self.update_prompt()
+
+    def poll_job_events(self):
+        """Tk thread: redraw the job list if any worker reported a change since the last poll."""
+        changed = False
+        while True:
+            try:
+                self.job_events.get_nowait()
+            except Empty:
+                break
+            changed = True
+        if changed:
+            self.refresh_jobs()
+        self.root.after(JOB_EVENTS_MS, self.poll_job_events)
+
+    def refresh_jobs(self):
+        """Redraw the job list, report finished jobs, and keep ticking while any job is active."""
+        jobs = self.scheduler.listed()
+        selected = self.selected_job()
+        self.jobs_list.delete(0, END)
+        for index, job in enumerate(jobs):
+            self.jobs_list.insert(END, job.describe())
+            if job is selected:
+                self.jobs_list.selection_set(index)
+        self.jobs_list.see(END)
+
+        for job in jobs:
+            if job.active or job.id in self.reported_jobs:
+                continue
+            self.reported_jobs.add(job.id)
+            if job.state in ('Cancelled', 'Killed'):
+                print_info(f"[{job.id}] {job.state}: {job.line}")
+            elif job.status:
+                print_failure(f"[{job.id}] {job.line}: exit code {job.status}")
+            if job.status is not None:
+                set_prompt_state(status=job.status, duration=job.elapsed())
+        active = sum(job.active for job in jobs)
+        set_prompt_state(jobs=active)
+        self.update_prompt()
+
+        if active and self.jobs_tick is None:
+            self.jobs_tick = self.root.after(500, self._jobs_tick)
+
+    def _jobs_tick(self):
+        self.jobs_tick = None
+        self.refresh_jobs()
+
+    def selected_job(self):
+        selection = self.jobs_list.curselection()
+        jobs = self.scheduler.listed()
+        if selection and selection[0] < len(jobs):
+            return jobs[selection[0]]
+        return None
+
+    def cancel_selected_job(self):
+        job = self.selected_job() or self.scheduler.newest_active()
+        if job is not None:
+            self.scheduler.cancel(job)
+
+    def cancel_newest_job(self, event=None):
+        if self.input_entry.selection_present():
+            return None  # Let Ctrl-C copy the selection
+        job = self.scheduler.newest_active()
+        if job is not None:
+            self.scheduler.cancel(job)
+        return 'break'
 
     def reset_autocomplete(self, event=None):
         if event and event.keysym == 'Tab': return
@@ -196,9 +388,11 @@ Type 'help' to see a list of commands, or 'exit' to quit.
             self.last_completion_text = current_text
             
             if ' ' not in current_text:
-                self.completion_options = [cmd for cmd in COMMANDS if cmd.startswith(current_text)]
+                self.completion_options = complete_command(current_text)
             else:
-                self.completion_options = [p for p in glob.glob(current_text + '*')]
+                # Complete the last word only and keep the rest of the line
+                head, word = current_text.rsplit(' ', 1)
+                self.completion_options = [f"{head} {p}" for p in complete_path(word, self.session.cwd)]
 
         if self.completion_options:
             if self.completion_index >= len(self.completion_options):
@@ -233,10 +427,29 @@ Type 'help' to see a list of commands, or 'exit' to quit.
     def on_close(self):
         sys.stdout = sys.__stdout__
         sys.stderr = sys.__stderr__
+        self.release_output()
         self.root.destroy()
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = CustomShellGUI(root)
-    root.protocol("WM_DELETE_WINDOW", app.on_close)
-    root.mainloop()
+    # Jobs start in a shell daemon: 'gui.py --attach' uses the shared one ('main.py --daemon'),
+    # otherwise the GUI starts a private one now, before Tk and the job workers add threads
+    daemon = helper = None
+    if '--attach' in sys.argv[1:]:
+        from shell_client import socket_path
+        daemon = socket_path()
+    else:
+        try:
+            helper = HelperDaemon()
+        except OSError as e:
+            print(f"customshell: could not start the job daemon ({e.strerror or e}); "
+                  "each job will start its own shell", file=sys.stderr)
+    try:
+        root = tk.Tk()
+        if helper is not None:
+            daemon = helper.wait_ready()
+        app = CustomShellGUI(root, daemon)
+        root.protocol("WM_DELETE_WINDOW", app.on_close)
+        root.mainloop()
+    finally:
+        if helper is not None:
+            helper.stop()
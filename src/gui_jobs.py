@@ -0,0 +1,360 @@
+import os
+import sys
+import time
+import shlex
+import shutil
+import signal
+import tempfile
+import threading
+from queue import Queue
+from functools import partial
+
+import core_shell
+from core_shell import split_assignments, session_script, BUILTINS
+import command_exec
+from command_exec import spawn_process, add_job, wait_for_job, SPAWN_DUP2, SPAWN_OPEN
+from shell_parser import parse, word_text, ParseError, Command, Pipeline, AndOr, FunctionDef
+from usability_features import expand_alias
+from ui import print_error, prompt_cwd_changed
+from output_pump import open_channel
+import shell_client
+
+# The GUI runs each command line as a job in a shell process of its own, taken
+# by one of a fixed number of worker threads from a FIFO queue. The GUI process
+# has threads (Tk, the workers), so it never forks a copy of itself: a forked
+# child could block on a lock another thread held. Jobs go to a private shell
+# daemon (HelperDaemon), whose sessions are forked ahead of time from a
+# single-threaded process; 'main.py -c' per job is the fallback, and pays a
+# whole interpreter startup each time.
+# The session's working directory is logical: 'cd' only updates Session.cwd,
+# and each job gets a snapshot of it and of the environment, so the GUI
+# process never calls chdir while other jobs are starting. Variables, options
+# and functions defined in the GUI go to each job as commands run before it.
+
+try:
+    WORKERS = max(1, int(os.environ.get('CUSTOMSHELL_GUI_JOBS', 4)))
+except ValueError:
+    WORKERS = 4
+FINISHED_KEPT = 20          # Finished jobs still listed
+OUTPUT_GRACE = 0.5          # Seconds to wait for a finished job's last output before reporting it
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+DAEMON_START_TIMEOUT = 5.0  # Seconds to wait for the helper daemon's socket
+
+# Builtins that change (or only read) session state; a line made of nothing else
+# (or of variable assignments) runs in the GUI process, so its effect outlives the line
+SESSION_BUILTINS = frozenset({
+    'cd', 'exit', 'alias', 'unalias', 'set', 'enable', 'hash', 'spawnmode',
+    'history', 'stats', 'help', 'type', 'export',
+})
+
+
+class Session:
+    """Logical working directory and environment shared by the GUI's jobs.
+
+    Lines run in the GUI process see it too: relative globs match in Session.cwd
+    (core_shell.logical_cwd) and $PWD/$OLDPWD follow it.
+    """
+
+    def __init__(self):
+        self.cwd = os.getcwd()
+        self.env = dict(os.environ, PWD=self.cwd)
+        self.lock = threading.Lock()
+        core_shell.logical_cwd = self.cwd
+
+    def snapshot(self):
+        """(cwd, environment) for a job about to be queued."""
+        with self.lock:
+            return self.cwd, dict(self.env)
+
+    def update_env(self, environ):
+        """Take what a line run in the GUI process exported ('export', 'PATH=...') into the session."""
+        with self.lock:
+            for name, value in environ.items():
+                if name not in ('PWD', 'OLDPWD'):  # The session's own; the GUI process never moves
+                    self.env[name] = value
+
+    def cd(self, command, args, aliases):
+        """'cd' for the GUI process: validate the target and move the logical cwd only."""
+        path = args[0] if args else os.path.expanduser("~")
+        with self.lock:
+            if path == '-':
+                path = self.env.get('OLDPWD')
+                if not path:
+                    print_error("cd: OLDPWD not set")
+                    return 1
+            target = os.path.normpath(os.path.join(self.cwd, path))
+            if not os.path.exists(target):
+                print_error(f"Directory not found: {path}")
+                return 1
+            if not os.path.isdir(target):
+                print_error(f"Not a directory: {path}")
+                return 1
+            if not os.access(target, os.X_OK):
+                print_error(f"Permission denied: {path}")
+                return 1
+            self.env['OLDPWD'], self.env['PWD'] = self.cwd, target
+            os.environ['OLDPWD'], os.environ['PWD'] = self.cwd, target
+            self.cwd = core_shell.logical_cwd = target
+        if args[:1] == ['-']:
+            print(target)
+        prompt_cwd_changed()
+        return 0
+
+
+class HelperDaemon:
+    """A private 'main.py --daemon' for the GUI's jobs, started before the GUI has threads."""
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix='customshell-gui-')
+        self.path = os.path.join(self.directory, 'daemon.sock')
+        argv = [sys.executable, MAIN_SCRIPT, '--daemon']
+        devnull = os.open(os.devnull, os.O_RDWR)
+        try:
+            self.pid = spawn_process(sys.executable, argv, [(SPAWN_DUP2, devnull, fd) for fd in (0, 1, 2)],
+                                     env=dict(os.environ, CUSTOMSHELL_SOCKET=self.path))
+        except OSError:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            raise
+        finally:
+            os.close(devnull)
+
+    def wait_ready(self, timeout=DAEMON_START_TIMEOUT):
+        """Wait for the daemon to listen; returns the socket path, or None if it did not come up."""
+        deadline = time.monotonic() + timeout
+        while not os.path.exists(self.path):
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(0.01)
+        return self.path
+
+    def stop(self):
+        try:
+            os.kill(self.pid, signal.SIGTERM)  # Idle spares exit with it
+        except ProcessLookupError:
+            pass
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _simple_command(node):
+    """Unwrap a single-command and-or list or pipeline; returns the Command or FunctionDef, else None."""
+    if isinstance(node, AndOr) and not node.rest:
+        node = node.first
+    if isinstance(node, Pipeline) and len(node.commands) == 1 and not node.negate and not node.timed:
+        node = node.commands[0]
+    return node if isinstance(node, (Command, FunctionDef)) else None
+
+
+def _substitutes_commands(words):
+    """True if any word has $(...) or `...`, which needs a process of its own."""
+    return any(quote in (None, '"') and ('$(' in text or '`' in text)
+               for word in words for text, quote in word.parts)
+
+
+def runs_in_session(line, aliases):
+    """True if line only defines functions, assigns variables or runs SESSION_BUILTINS (without redirections).
+
+    A line with command substitution goes to a job instead: running it here would
+    fork the GUI process, so e.g. 'cd $(...)' only affects that job.
+    """
+    try:
+        tree = parse(expand_alias(line, aliases) if aliases else line)
+    except ParseError:
+        return True  # Let execute_line report it
+    for item, background in tree.items:
+        node = _simple_command(item)
+        if background or node is None:
+            return False
+        if isinstance(node, Command):
+            assignments, words = split_assignments(node.words)
+            if node.redirects or not (words or assignments) or _substitutes_commands(node.words):
+                return False
+            if words and (assignments or word_text(words[0]) not in SESSION_BUILTINS):
+                return False
+    return True
+
+
+class GuiJob:
+    """One submitted command line and where it is in its life."""
+    __slots__ = ('id', 'line', 'cwd', 'env', 'script', 'state', 'pid', 'status', 'queued', 'started',
+                 'finished', 'cancelled', 'signals_sent')
+
+    def __init__(self, job_id, line, cwd, env):
+        self.id = job_id
+        self.line = line
+        self.cwd = cwd
+        self.env = env
+        self.script = None         # What the job's shell runs (JobScheduler._script)
+        self.state = 'Queued'      # Queued, Running, Done, Exit N, Cancelled, Killed
+        self.pid = None
+        self.status = None
+        self.queued = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.cancelled = False
+        self.signals_sent = 0
+
+    @property
+    def active(self):
+        return self.state in ('Queued', 'Running')
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def describe(self):
+        """One line for the job list."""
+        return f"[{self.id}] {self.state:<10} {self.elapsed():6.1f}s  {self.line}"
+
+
+class JobScheduler:
+    """A bounded pool of workers running queued GUI jobs in shell processes of their own.
+
+    on_change(job) is called from worker threads whenever a job changes state,
+    so it must not touch Tk itself. Each job's output goes through its own
+    capture channel registered with pump. The GUI process's 'cd' is replaced by
+    session.cd; jobs run in a real shell and get the real one.
+    """
+
+    def __init__(self, session, aliases, pump, on_change, workers=WORKERS, use_pty=True, daemon=None):
+        self.session = session
+        self.daemon = daemon       # Socket path: start jobs in the shell daemon instead of forking the GUI
+        self.aliases = aliases
+        self.pump = pump
+        self.on_change = on_change
+        self.use_pty = use_pty
+        self.queue = Queue()
+        self.jobs = []             # Every listed job, oldest first
+        self.lock = threading.Lock()
+        self._next_id = 1
+        BUILTINS['cd'] = session.cd
+        self.workers = [threading.Thread(target=self._worker, name=f'gui-worker-{n}', daemon=True)
+                        for n in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, line):
+        """Queue line as a new job with a snapshot of the session; returns the GuiJob."""
+        cwd, env = self.session.snapshot()
+        with self.lock:
+            job = GuiJob(self._next_id, line, cwd, env)
+            # Now, on the submitting (Tk) thread, while the shell state cannot change under us
+            job.script = self._script(job)
+            self._next_id += 1
+            self.jobs.append(job)
+            finished = [j for j in self.jobs if not j.active]
+            for old in finished[:-FINISHED_KEPT]:
+                self.jobs.remove(old)
+        self.queue.put(job)
+        self.on_change(job)
+        return job
+
+    def listed(self):
+        with self.lock:
+            return list(self.jobs)
+
+    def newest_active(self):
+        with self.lock:
+            return next((job for job in reversed(self.jobs) if job.active), None)
+
+    def cancel(self, job):
+        """Drop a queued job; interrupt a running one (SIGINT first, SIGKILL if asked again)."""
+        with self.lock:
+            if job.state == 'Queued':
+                job.cancelled = True
+                job.state = 'Cancelled'
+            elif job.state == 'Running' and job.pid is None:
+                job.cancelled = True  # Still starting; _run interrupts it once the pid is known
+                job.signals_sent = 1
+            elif job.state == 'Running':
+                sig = signal.SIGINT if job.signals_sent == 0 else signal.SIGKILL
+                job.signals_sent += 1
+                try:
+                    os.killpg(job.pid, sig)
+                except ProcessLookupError:
+                    pass
+            else:
+                return
+        self.on_change(job)
+
+    def _script(self, job):
+        """What a fresh shell runs for the job: the session's state, then the alias-expanded line."""
+        lines = [f"cd {shlex.quote(job.cwd)} || exit 1"]
+        if 'OLDPWD' in job.env:
+            lines.append(f"OLDPWD={shlex.quote(job.env['OLDPWD'])}")
+        lines.append(session_script())
+        lines.append(expand_alias(job.line, self.aliases) if self.aliases else job.line)
+        return '\n'.join(lines)
+
+    def _start_local(self, job, write_fd):
+        """Start 'main.py -c' for the job; returns (pid, function waiting for the status)."""
+        argv = [sys.executable, MAIN_SCRIPT, '-c', job.script]
+        actions = [(SPAWN_DUP2, write_fd, 1), (SPAWN_DUP2, write_fd, 2),
+                   (SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0)]
+        with command_exec.job_lock:
+            pid = spawn_process(sys.executable, argv, actions, setpgroup=0, env=job.env)
+            entry = add_job([pid], pid, job.line, True, started=time.monotonic())
+
+        def finish():
+            codes = wait_for_job(entry)
+            return 128 + signal.SIGTSTP if codes is None else codes[-1]
+        return pid, finish
+
+    def _start_in_daemon(self, job, write_fd):
+        """Hand the job to a pre-forked daemon session (its own process group, like a local job)."""
+        request = {'mode': 'script', 'lines': job.script.splitlines(), 'cwd': job.cwd, 'env': job.env}
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        try:
+            sock, pid = shell_client.start(request, (devnull, write_fd, write_fd), self.daemon)
+        finally:
+            os.close(devnull)
+        return pid, partial(shell_client.finish, sock)
+
+    def _run(self, job):
+        read_fd, write_fd = open_channel(self.use_pty)
+        drained = threading.Event()
+        self.pump.add(read_fd, drained.set)
+        try:
+            if self.daemon is not None:
+                try:
+                    pid, finish = self._start_in_daemon(job, write_fd)
+                except OSError as e:
+                    print_error(f"Shell daemon unavailable ({e.strerror or e}); each job starts its own shell.")
+                    self.daemon = None
+            if self.daemon is None:
+                pid, finish = self._start_local(job, write_fd)
+        finally:
+            os.close(write_fd)
+        with self.lock:
+            job.pid = pid
+            if job.cancelled:
+                os.killpg(pid, signal.SIGINT)
+        self.on_change(job)
+        status = finish()
+        # Report after the output, unless a background process keeps the channel open
+        drained.wait(OUTPUT_GRACE)
+        return status
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            with self.lock:
+                if job.cancelled:
+                    continue
+                job.state = 'Running'
+                job.started = time.monotonic()
+            self.on_change(job)
+            try:
+                status = self._run(job)
+            except OSError as e:
+                print_error(f"Could not start job: {e}")
+                status = 126
+            with self.lock:
+                job.status = status
+                job.finished = time.monotonic()
+                if job.signals_sent and status > 128:
+                    job.state = 'Killed' if job.signals_sent > 1 else 'Cancelled'
+                else:
+                    job.state = 'Done' if status == 0 else f'Exit {status}'
+            core_shell.last_status = status
+            self.on_change(job)
@@ -0,0 +1,266 @@
+import os
+import errno
+import resource
+
+from ui import print_error
+
+# Per-job constraints applied in the child between fork and exec: CPU affinity
+# (taskset), scheduling priority (nice) and resource limits (limit, with the
+# flags and units of ulimit). The prefixes stack, e.g.
+#
+#   nice -n 5 taskset -c 0-1 limit -v 2000000 -t 60 make &
+#
+# and 'jobs' shows what each job runs under. 'ulimit' sets limits on the shell
+# itself, so every command it starts inherits them (session defaults).
+#
+# os has no ioprio_set; with no I/O priority of its own a process's I/O
+# priority follows its nice value, and 'nice --idle' (SCHED_IDLE) gives
+# ionice -c3 style "only when nothing else wants the CPU" behaviour.
+
+# flag -> (name in job listings, ulimit -a label, unit, resource, bytes or count per unit)
+RLIMITS = {
+    'c': ('core', 'core file size', 'kbytes', resource.RLIMIT_CORE, 1024),
+    'd': ('data', 'data seg size', 'kbytes', resource.RLIMIT_DATA, 1024),
+    'f': ('fsize', 'file size', 'kbytes', resource.RLIMIT_FSIZE, 1024),
+    'n': ('nofile', 'open files', '', resource.RLIMIT_NOFILE, 1),
+    's': ('stack', 'stack size', 'kbytes', resource.RLIMIT_STACK, 1024),
+    't': ('cpu', 'cpu time', 'seconds', resource.RLIMIT_CPU, 1),
+    'u': ('nproc', 'max user processes', '', resource.RLIMIT_NPROC, 1),
+    'v': ('as', 'virtual memory', 'kbytes', resource.RLIMIT_AS, 1024),
+}
+DEFAULT_NICE = 10           # Increment for 'nice command' without -n, as in coreutils
+
+
+class JobLimits:
+    """Constraints for one launched command; apply() runs in the child."""
+    __slots__ = ('cpus', 'nice', 'idle', 'rlimits')
+
+    def __init__(self):
+        self.cpus = None       # Set of CPU numbers
+        self.nice = 0          # Niceness increment
+        self.idle = False      # SCHED_IDLE
+        self.rlimits = {}      # flag -> (value in resource units or RLIM_INFINITY, 'S', 'H' or 'SH')
+
+    def __bool__(self):
+        return self.cpus is not None or bool(self.nice) or self.idle or bool(self.rlimits)
+
+    def apply(self):
+        """Constrain the calling process (a freshly forked child). Raises OSError if not allowed."""
+        for flag, (value, which) in self.rlimits.items():
+            kind = RLIMITS[flag][3]
+            soft, hard = resource.getrlimit(kind)
+            if 'H' in which:
+                hard = value
+                if which == 'H' and (soft == resource.RLIM_INFINITY or soft > value):
+                    soft = value
+            if 'S' in which:
+                soft = value
+            try:
+                resource.setrlimit(kind, (soft, hard))
+            except ValueError as e:
+                # setrlimit reports EPERM (raising a hard limit) and EINVAL as ValueError
+                code = errno.EPERM if 'raise' in str(e) else errno.EINVAL
+                raise OSError(code, f"-{flag}: {e}") from None
+        if self.cpus is not None:
+            os.sched_setaffinity(0, self.cpus)
+        if self.nice:
+            os.nice(self.nice)
+        if self.idle:
+            os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+
+    def describe(self):
+        """Short form for 'jobs', e.g. 'nice=+5 cpus=0-1 as=2000000K cpu=60s'."""
+        parts = []
+        if self.nice:
+            parts.append(f"nice={self.nice:+d}")
+        if self.idle:
+            parts.append("idle")
+        if self.cpus is not None:
+            parts.append(f"cpus={format_cpus(self.cpus)}")
+        for flag, (value, which) in self.rlimits.items():
+            name, _, unit, _, scale = RLIMITS[flag]
+            suffix = {'kbytes': 'K', 'seconds': 's'}.get(unit, '')
+            text = 'unlimited' if value == resource.RLIM_INFINITY else f"{value // scale}{suffix}"
+            parts.append(f"{name}={text}" + ('' if which == 'SH' else f"({which.lower()})"))
+        return ' '.join(parts)
+
+
+def parse_cpus(text):
+    """'0,2-3' -> {0, 2, 3}."""
+    cpus = set()
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        try:
+            start, end = int(first), int(last or first)
+        except ValueError:
+            raise ValueError(f"invalid CPU list: {text}") from None
+        if start < 0 or end < start:
+            raise ValueError(f"invalid CPU list: {text}")
+        cpus.update(range(start, end + 1))
+    return cpus
+
+
+def format_cpus(cpus):
+    """{0, 2, 3} -> '0,2-3'."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def parse_limit_value(flag, text):
+    if text == 'unlimited':
+        return resource.RLIM_INFINITY
+    try:
+        value = int(text)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise ValueError(f"-{flag}: invalid limit: {text}")
+    return value * RLIMITS[flag][4]
+
+
+def _parse_nice(args, limits):
+    increment = None
+    while args and args[0].startswith('-'):
+        option = args.pop(0)
+        if option == '--':
+            break
+        if option == '--idle':
+            limits.idle = True
+        elif option == '-n' and args:
+            increment = args.pop(0)
+        elif option[1:].lstrip('-').isdigit():
+            increment = option[1:]     # nice -5
+        else:
+            raise ValueError(f"nice: {option}: invalid option")
+    if increment is None:
+        limits.nice += 0 if limits.idle else DEFAULT_NICE
+    else:
+        try:
+            limits.nice += int(increment)
+        except ValueError:
+            raise ValueError(f"nice: {increment}: invalid adjustment") from None
+    return args
+
+
+def _parse_taskset(args, limits):
+    if len(args) < 2 or args[0] not in ('-c', '--cpu-list'):
+        raise ValueError("taskset: usage: taskset -c LIST command [args...]")
+    try:
+        limits.cpus = parse_cpus(args[1])
+    except ValueError as e:
+        raise ValueError(f"taskset: {e}") from None
+    return args[2:]
+
+
+def _parse_limit(args, limits):
+    which = 'SH'
+    while args and args[0].startswith('-') and len(args[0]) > 1:
+        option = args.pop(0)
+        if option == '--':
+            break
+        for i, flag in enumerate(option[1:]):
+            if flag in 'SH':
+                which = flag
+            elif flag in RLIMITS:
+                # The value is the rest of the word (-n64) or the next word
+                rest = option[i + 2:]
+                if not rest and not args:
+                    raise ValueError(f"limit: -{flag}: option requires an argument")
+                try:
+                    value = parse_limit_value(flag, rest or args.pop(0))
+                except ValueError as e:
+                    raise ValueError(f"limit: {e}") from None
+                limits.rlimits[flag] = (value, which)
+                break
+            else:
+                raise ValueError(f"limit: -{flag}: invalid option")
+    return args
+
+
+_PARSERS = {'nice': _parse_nice, 'taskset': _parse_taskset, 'limit': _parse_limit}
+
+
+def parse_prefixes(argv, enabled=lambda name: True):
+    """Peel leading nice/taskset/limit words (and their options) off argv.
+
+    Returns (JobLimits, remaining argv); raises ValueError for bad options.
+    enabled(name) says whether a prefix is the builtin (not disabled or shadowed).
+    """
+    limits = JobLimits()
+    argv = list(argv)
+    while argv and argv[0] in _PARSERS and enabled(argv[0]):
+        name = argv.pop(0)
+        argv = _PARSERS[name](argv, limits)
+    return limits, argv
+
+
+# --- Reporting, and the builtins used without a command ---
+
+def format_limit(value, scale):
+    return 'unlimited' if value == resource.RLIM_INFINITY else str(value // scale)
+
+
+def show_limits(flags=None, hard=False):
+    """Print the shell's limits like 'ulimit -a' (or just the given flags)."""
+    for flag in flags or RLIMITS:
+        _, label, unit, kind, scale = RLIMITS[flag]
+        value = resource.getrlimit(kind)[1 if hard else 0]
+        if flags is not None and len(flags) == 1:
+            print(format_limit(value, scale))
+        else:
+            heading = f"{label} ({unit}, -{flag})" if unit else f"{label} (-{flag})"
+            print(f"{heading:<32} {format_limit(value, scale)}")
+
+
+def show_current(name):
+    """What 'nice', 'taskset' or 'limit' print when given no command."""
+    if name == 'nice':
+        print(os.getpriority(os.PRIO_PROCESS, 0))
+    elif name == 'taskset':
+        print(f"current affinity list: {format_cpus(os.sched_getaffinity(0))}")
+    else:
+        show_limits()
+
+
+def ulimit(args):
+    """'ulimit [-S|-H] [-a] [-cdfnstuv [value]]': show or set the shell's own resource limits."""
+    which, flags, value = 'SH', [], None
+    for i, arg in enumerate(args):
+        if arg.startswith('-') and len(arg) > 1:
+            for flag in arg[1:]:
+                if flag in 'SH':
+                    which = flag
+                elif flag == 'a':
+                    flags = list(RLIMITS)
+                elif flag in RLIMITS:
+                    flags.append(flag)
+                else:
+                    print_error(f"ulimit: -{flag}: invalid option")
+                    print_error("usage: ulimit [-S|-H] [-a] [-cdfnstuv [limit]]")
+                    return 2
+        elif i == len(args) - 1:
+            value = arg
+        else:
+            print_error(f"ulimit: {arg}: too many arguments")
+            return 2
+    if not flags:
+        flags = ['f']
+    if value is None:
+        show_limits(flags, hard=which == 'H')
+        return 0
+    if len(flags) != 1:
+        print_error("ulimit: only one limit can be set at a time")
+        return 2
+    limits = JobLimits()
+    try:
+        limits.rlimits[flags[0]] = (parse_limit_value(flags[0], value), which)
+        limits.apply()
+    except (ValueError, OSError) as e:
+        print_error(f"ulimit: {e.strerror if isinstance(e, OSError) and e.strerror else e}")
+        return 1
+    return 0
@@ -1,23 +1,146 @@
+import time
+
+_started = time.perf_counter()  # Origin for --startup-profile
+
 import os
-from core_shell import shell_loop
-from usability_features import load_aliases
-from command_exec import jobs  # Import the jobs list
+import sys
+
+# --startup-profile fails (exit status 1) if the first prompt takes longer than
+# this, counted from when main.py starts running (interpreter startup excluded)
+STARTUP_TARGET_MS = 40
+
+# Shell modules in dependency order, so --startup-profile can time each import
+SHELL_MODULES = ('ui', 'resource_stats', 'command_exec', 'completion_index', 'usability_features',
+                 'shell_parser', 'glob_engine', 'fast_builtins', 'piping_redirection', 'core_shell')
+
+def _quick_args(argv):
+    """Parse the common command lines by hand; None if argparse is needed."""
+    from types import SimpleNamespace
+    args = SimpleNamespace(command=None, interactive=False, script=None, startup_profile=False,
+                           daemon=False, attach=False)
+    if argv[:1] == ['--attach']:
+        argv = argv[1:]
+        args.attach = True
+    if not argv:
+        return args
+    if argv == ['--daemon'] and not args.attach:
+        args.daemon = True
+        return args
+    if argv == ['-i']:
+        args.interactive = True
+    elif argv == ['--startup-profile']:
+        args.startup_profile = True
+    elif len(argv) == 2 and argv[0] == '-c':
+        args.command = argv[1]
+    elif len(argv) == 1 and not argv[0].startswith('-'):
+        args.script = argv[0]
+    else:
+        return None
+    return args
+
+def parse_args(argv):
+    # argparse (and the modules it imports) costs more than the rest of startup
+    args = _quick_args(argv)
+    if args is not None:
+        return args
+    import argparse
+    parser = argparse.ArgumentParser(prog='customshell', description="CustomShell command-line shell.")
+    parser.add_argument('-c', dest='command', metavar='COMMANDS',
+                        help="run COMMANDS (one per line) and exit with the last status")
+    parser.add_argument('-i', dest='interactive', action='store_true',
+                        help="force an interactive session even when stdin is not a terminal")
+    parser.add_argument('--startup-profile', action='store_true',
+                        help="time each import and startup step up to the first prompt, then exit")
+    parser.add_argument('--daemon', action='store_true',
+                        help="serve sessions to --attach clients over a Unix socket (until killed)")
+    parser.add_argument('--attach', action='store_true',
+                        help="run the session in the running daemon instead of starting a new shell")
+    parser.add_argument('script', nargs='?', help="script file to run non-interactively")
+    return parser.parse_args(argv)
+
+def startup_profile():
+    """Start an interactive session step by step, print the timings to stderr and exit.
+
+    Returns 0 if the first prompt was ready within STARTUP_TARGET_MS, 1 otherwise.
+    """
+    phases = []
+    mark = time.perf_counter()
+    phases.append(('main.py and arguments', mark - _started))
+
+    def timed(name, function):
+        nonlocal mark
+        result = function()
+        now = time.perf_counter()
+        phases.append((name, now - mark))
+        mark = now
+        return result
 
-def main():
+    for module in SHELL_MODULES:
+        timed(f"import {module}", lambda: __import__(module))
+    core_shell = sys.modules['core_shell']
+    aliases = timed('aliases', sys.modules['usability_features'].load_aliases)
+    for name, step in core_shell.startup_phases(aliases):
+        timed(name, step)
+    timed('render prompt', core_shell.get_colored_prompt)
+    to_prompt = mark - _started
+
+    # Aliases are read on first use, which is after the prompt
+    before = len(phases)
+    timed('aliases (first use)', lambda: len(aliases))
+
+    out = sys.stderr
+    print(f"\n{'phase':28} {'ms':>8} {'total ms':>9}", file=out)
+    total = 0.0
+    for index, (name, seconds) in enumerate(phases):
+        if index == before:
+            print("deferred until after the first prompt:", file=out)
+            total = 0.0
+        total += seconds
+        print(f"{name:28} {seconds * 1e3:8.2f} {total * 1e3:9.2f}", file=out)
+    verdict = 'OK' if to_prompt * 1e3 <= STARTUP_TARGET_MS else 'over target'
+    print(f"time to first prompt: {to_prompt * 1e3:.1f} ms (target {STARTUP_TARGET_MS} ms): {verdict}", file=out)
+    print("Interpreter startup is not included; 'python -X importtime main.py' shows it.", file=out)
+    return 0 if verdict == 'OK' else 1
+
+def main(argv=None):
     """Initialize and run the custom shell."""
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
     # Set up environment
     os.environ['SHELL'] = 'customshell'
 
-    # Load aliases
-    aliases = load_aliases()
+    if args.startup_profile:
+        return startup_profile()
+    if args.attach:
+        # Thin client: the daemon already has everything loaded
+        from shell_client import attach
+        return attach(args)
+    if args.daemon:
+        from shell_daemon import serve
+        return serve()
+
+    from core_shell import shell_loop, run_script
 
-    # Initialize the jobs list (if needed)
-    if not isinstance(jobs, list):
-        print("Error: Jobs list not properly initialized.", file=os.sys.stderr)
-        return
+    # Non-interactive modes: no readline, history, banner or decoration
+    if args.command is not None:
+        return run_script(args.command.splitlines())
+    if args.script:
+        try:
+            with open(args.script) as f:
+                return run_script(f)
+        except OSError as e:
+            print(f"customshell: {args.script}: {e.strerror}", file=sys.stderr)
+            return 127
+    if not args.interactive and not sys.stdin.isatty():
+        return run_script(sys.stdin)
+
+    # Aliases are read from disk on first use
+    from usability_features import load_aliases
+    aliases = load_aliases()
 
     # Run the shell
     shell_loop(aliases)
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
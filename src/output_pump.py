@@ -0,0 +1,157 @@
+import os
+import pty
+import fcntl
+import errno
+import codecs
+import struct
+import termios
+import threading
+import selectors
+
+# Streams the output of child processes (read from pipes or pty masters) into a
+# text sink such as the GUI's output queue. One thread selects over every open
+# channel; when the sink reports it is full, the thread stops reading, the
+# kernel buffers fill up and the writers block, so memory stays flat no matter
+# how much a command prints.
+
+READ_SIZE = 64 * 1024
+WINDOW_SIZE = (40, 120)   # rows, columns reported to programs writing to a pty
+
+
+def open_channel(use_pty=True):
+    """Create a capture channel; returns (read_fd, write_fd).
+
+    With use_pty the writer sees a terminal (line buffering, column output, no
+    '\\n' -> '\\r\\n' translation); otherwise, or if no pty is available, a pipe.
+    The read end is non-blocking and close-on-exec.
+    """
+    if use_pty:
+        try:
+            master, slave = pty.openpty()
+        except OSError:
+            master = None
+        if master is not None:
+            attrs = termios.tcgetattr(slave)
+            attrs[1] &= ~termios.ONLCR   # oflag: keep plain newlines
+            attrs[3] &= ~termios.ECHO    # lflag
+            termios.tcsetattr(slave, termios.TCSANOW, attrs)
+            fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack('HHHH', *WINDOW_SIZE, 0, 0))
+            os.set_inheritable(master, False)
+            os.set_blocking(master, False)
+            return master, slave
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    return read_fd, write_fd
+
+
+class _Channel:
+    """Decoding state for one fd: split UTF-8 sequences and carriage returns across reads."""
+    __slots__ = ('decoder', 'carry', 'on_close')
+
+    def __init__(self, on_close):
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.carry = ''
+        self.on_close = on_close
+
+    def decode(self, data, final=False):
+        text = self.carry + self.decoder.decode(data, final)
+        self.carry = ''
+        if text.endswith('\r') and not final:
+            # Might be the first half of '\r\n'
+            self.carry, text = '\r', text[:-1]
+        # Progress bars redraw with a bare '\r'; show each redraw as its own line
+        return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+class OutputPump:
+    """Reads every registered fd on one thread and passes the decoded text to write().
+
+    room(), if given, is called before each round of reads and should block
+    while the consumer is behind (backpressure).
+    """
+
+    def __init__(self, write, room=None):
+        self.write = write
+        self.room = room
+        self._selector = selectors.DefaultSelector()
+        self._pending = []          # (fd, _Channel) waiting to be registered by the pump thread
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='output-pump', daemon=True)
+        self._thread.start()
+
+    def add(self, fd, on_close=None):
+        """Start streaming fd; the pump owns it from now on and closes it at EOF.
+
+        on_close() is called on the pump thread once everything written to fd
+        has been passed on.
+        """
+        with self._lock:
+            self._pending.append((fd, _Channel(on_close)))
+        self._wake()
+
+    def close(self):
+        """Stop the pump thread and close every channel still open."""
+        self._closed = True
+        self._wake()
+        self._thread.join(timeout=1)
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'x')
+        except BlockingIOError:
+            pass  # Already woken
+
+    def _register_pending(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for fd, channel in pending:
+            self._selector.register(fd, selectors.EVENT_READ, channel)
+
+    def _finish(self, fd, channel):
+        self._selector.unregister(fd)
+        os.close(fd)
+        tail = channel.decode(b'', final=True)
+        if tail:
+            self.write(tail)
+        if channel.on_close is not None:
+            channel.on_close()
+
+    def _read(self, fd, channel):
+        try:
+            data = os.read(fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            if e.errno != errno.EIO:
+                raise
+            data = b''  # A pty master reports EIO once every slave is closed
+        if not data:
+            self._finish(fd, channel)
+            return
+        text = channel.decode(data)
+        if text:
+            self.write(text)
+
+    def _run(self):
+        while not self._closed:
+            if self.room is not None:
+                self.room()
+            for key, _ in self._selector.select():
+                if key.fd == self._wake_r:
+                    self._register_pending()
+                else:
+                    self._read(key.fd, key.data)
+        for key in list(self._selector.get_map().values()):
+            if key.fd != self._wake_r:
+                self._finish(key.fd, key.data)
+        self._selector.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
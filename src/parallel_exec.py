@@ -0,0 +1,336 @@
+import os
+import sys
+import math
+import time
+import signal
+import selectors
+import tempfile
+
+import command_exec
+from command_exec import resolve_command, spawn_process, spawn_function, add_job, wait_for_job, signal_job
+from command_exec import SPAWN_OPEN, SPAWN_DUP2
+from glob_engine import argv_size, check_arg_max, ARG_MAX, POINTER_SIZE
+from fast_builtins import _write_bytes
+from ui import print_error
+
+# The 'parallel' builtin: run one command over many arguments, several
+# processes at a time, like 'xargs -P' with GNU parallel's output grouping.
+#
+#   parallel [-j N] [-n MAX] [-k] [-u] [-0] [-t] [--halt never|soon|now] command [args...] [::: items...]
+#
+# Items come from ':::' (the shell has already globbed them) or from stdin, one
+# per line. They are packed into batches appended to the command, each batch
+# as large as ARG_MAX allows, or run one per process with '{}' in the args
+# replaced. Processes are launched with the shell's spawn code and collected
+# through the job table like any other job.
+
+USAGE = "parallel [-j N] [-n MAX] [-k] [-u] [-0] [-t] [--halt never|soon|now] command [args...] [::: items...]"
+ARG_MAX_HEADROOM = 4096     # Bytes left free below ARG_MAX, like xargs
+SPOOL_BYTES = 1 << 20       # Grouped output kept in memory per stream before spilling to a temp file
+READ_SIZE = 64 * 1024
+HALT_POLICIES = ('never', 'soon', 'now')
+FAILED_STATUS = 123         # Some invocation failed and --halt never kept going (xargs' status)
+
+
+class ParallelError(Exception):
+    """A bad option or argument; the message is printed as a usage error."""
+
+
+class Options:
+    __slots__ = ('jobs', 'max_items', 'keep_order', 'grouped', 'null', 'trace', 'halt', 'command', 'items')
+
+    def __init__(self):
+        self.jobs = os.cpu_count() or 1
+        self.max_items = None
+        self.keep_order = False
+        self.grouped = True
+        self.null = False
+        self.trace = False
+        self.halt = 'never'
+        self.command = []
+        self.items = None    # None: read them from stdin
+
+
+def _positive(option, value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise ParallelError(f"{option}: invalid number: {value}")
+    return number
+
+
+def parse_options(args):
+    options = Options()
+    i = 0
+    while i < len(args) and args[i].startswith('-') and args[i] != '-':
+        arg = args[i]
+        i += 1
+        if arg == '--':
+            break
+        value = None
+        if arg[:2] in ('-j', '-n') and len(arg) > 2:
+            arg, value = arg[:2], arg[2:]        # -j4
+        elif arg.startswith('--halt='):
+            arg, value = arg.split('=', 1)
+        if arg in ('-j', '-n', '--halt'):
+            if value is None:
+                if i >= len(args):
+                    raise ParallelError(f"{arg}: option requires an argument")
+                value = args[i]
+                i += 1
+            if arg == '-j':
+                options.jobs = _positive(arg, value)
+            elif arg == '-n':
+                options.max_items = _positive(arg, value)
+            elif value not in HALT_POLICIES:
+                raise ParallelError(f"--halt: expected one of {', '.join(HALT_POLICIES)}")
+            else:
+                options.halt = value
+        elif arg == '-k':
+            options.keep_order = True
+        elif arg == '-u':
+            options.grouped = False
+        elif arg == '-0':
+            options.null = True
+        elif arg == '-t':
+            options.trace = True
+        else:
+            raise ParallelError(f"{arg}: invalid option")
+    rest = args[i:]
+    if ':::' in rest:
+        split = rest.index(':::')
+        rest, options.items = rest[:split], rest[split + 1:]
+    if not rest:
+        raise ParallelError("no command given")
+    options.command = rest
+    return options
+
+
+def read_items(null=False):
+    """Items from stdin: one per line (or NUL-separated), blank lines skipped."""
+    sys.stdout.flush()
+    chunks = []
+    while True:
+        chunk = os.read(0, READ_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    data = b''.join(chunks)
+    items = data.split(b'\0') if null else data.splitlines()
+    return [os.fsdecode(item) for item in items if item]
+
+
+def make_batches(command, items, jobs, max_items=None):
+    """Split items into argv lists, each within ARG_MAX.
+
+    With '{}' in the command each item gets its own argv with the item
+    substituted. Otherwise items are appended: at most max_items per batch,
+    by default an even share per job so every slot has work.
+    """
+    if any('{}' in arg for arg in command):
+        return [[arg.replace('{}', item) for arg in command] for item in items]
+    if max_items is None:
+        max_items = max(1, math.ceil(len(items) / jobs))
+    limit = ARG_MAX - ARG_MAX_HEADROOM
+    base = argv_size(command)
+    batches = []
+    batch, size = [], base
+    for item in items:
+        item_size = len(os.fsencode(item)) + 1 + POINTER_SIZE
+        if batch and (len(batch) >= max_items or size + item_size > limit):
+            batches.append(command + batch)
+            batch, size = [], base
+        batch.append(item)
+        size += item_size
+    if batch or not items:
+        batches.append(command + batch)
+    return batches
+
+
+class _Run:
+    """One launched batch: its job table entry, capture pipes and spooled output."""
+    __slots__ = ('index', 'argv', 'entry', 'outputs', 'open_fds', 'status')
+
+    def __init__(self, index, argv):
+        self.index = index
+        self.argv = argv
+        self.entry = None
+        self.outputs = {}      # target fd (1 or 2) -> SpooledTemporaryFile
+        self.open_fds = set()  # capture pipe read ends not at EOF yet
+        self.status = None
+
+
+class Scheduler:
+    """Keeps up to options.jobs batches running and collects them in the chosen order."""
+
+    def __init__(self, options, batches, internal):
+        self.options = options
+        self.pending = list(enumerate(batches))
+        self.pending.reverse()         # pop() takes the next batch
+        self.internal = internal
+        self.running = []
+        self.finished = {}             # index -> _Run, waiting for its turn (-k)
+        self.next_output = 0
+        self.selector = selectors.DefaultSelector()
+        self.failure = None            # Status of the first failed batch
+        self.failures = 0
+        self.halted = False
+
+    def _launch(self, index, argv):
+        run = _Run(index, argv)
+        if self.options.trace:
+            print(' '.join(argv), file=sys.stderr)
+        actions = [(SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0)]
+        pipes = []
+        if self.options.grouped:
+            for target in (1, 2):
+                read_fd, write_fd = os.pipe()
+                pipes.append((read_fd, write_fd, target))
+                actions.append((SPAWN_DUP2, write_fd, target))
+        sys.stdout.flush()
+        sys.stderr.flush()
+        started = time.monotonic()
+        try:
+            function = self.internal(argv)
+            with command_exec.job_lock:
+                if function is not None:
+                    pid = spawn_function(function, actions)
+                else:
+                    check_arg_max(argv)
+                    pid = spawn_process(resolve_command(argv[0]), argv, actions)
+                run.entry = add_job([pid], None, ' '.join(argv), True, names=[argv[0]], started=started)
+        except OSError as e:
+            for read_fd, write_fd, _ in pipes:
+                os.close(read_fd)
+                os.close(write_fd)
+            print_error(f"parallel: {argv[0]}: {e.strerror}")
+            run.status = 126
+            return run
+        for read_fd, write_fd, target in pipes:
+            os.close(write_fd)
+            run.outputs[target] = tempfile.SpooledTemporaryFile(SPOOL_BYTES)
+            run.open_fds.add(read_fd)
+            self.selector.register(read_fd, selectors.EVENT_READ, (run, target))
+        self.running.append(run)
+        return run
+
+    def _read(self, key):
+        run, target = key.data
+        data = os.read(key.fd, READ_SIZE)
+        if data:
+            run.outputs[target].write(data)
+            return
+        self.selector.unregister(key.fd)
+        os.close(key.fd)
+        run.open_fds.discard(key.fd)
+
+    def _collect(self, run):
+        codes = wait_for_job(run.entry)
+        run.status = 128 + signal.SIGTSTP if codes is None else codes[-1]
+        self.running.remove(run)
+        self._finished(run)
+
+    def _finished(self, run):
+        if run.status:
+            self.failures += 1
+            if self.failure is None:
+                self.failure = run.status
+            if self.options.halt != 'never' and not self.halted:
+                self.halted = True
+                self.pending.clear()
+                if self.options.halt == 'now':
+                    for other in self.running:
+                        signal_job(other.entry, signal.SIGTERM)
+        self.finished[run.index] = run
+        self._emit()
+
+    def _emit(self):
+        """Write out finished batches: in input order with -k, else as they finish."""
+        while self.finished:
+            if self.options.keep_order:
+                run = self.finished.pop(self.next_output, None)
+                if run is None:
+                    return
+                self.next_output += 1
+            else:
+                run = self.finished.pop(next(iter(self.finished)))
+            for target, stream in ((1, sys.stdout), (2, sys.stderr)):
+                spool = run.outputs.get(target)
+                if spool is None:
+                    continue
+                spool.seek(0)
+                while True:
+                    data = spool.read(READ_SIZE)
+                    if not data:
+                        break
+                    _write_bytes(data, stream)
+                spool.close()
+                stream.flush()
+
+    def _skip(self, index):
+        """Keep -k ordering moving past a batch that was never started."""
+        run = _Run(index, None)
+        self.finished[index] = run
+        self._emit()
+
+    def _wait_for_exit(self):
+        """-u: block until some running batch has exited."""
+        with command_exec.job_lock:
+            while not any(run.entry['state'] != 'Running' for run in self.running):
+                command_exec.job_lock.wait()
+        for run in [run for run in self.running if run.entry['state'] != 'Running']:
+            self._collect(run)
+
+    def run(self):
+        try:
+            while self.pending or self.running:
+                while self.pending and len(self.running) < self.options.jobs:
+                    index, argv = self.pending.pop()
+                    run = self._launch(index, argv)
+                    if run.entry is None:
+                        self._finished(run)
+                if not self.running:
+                    continue
+                if not self.options.grouped:
+                    self._wait_for_exit()
+                    continue
+                for key, _ in self.selector.select():
+                    self._read(key)
+                for run in [run for run in self.running if not run.open_fds]:
+                    self._collect(run)
+        except KeyboardInterrupt:
+            for run in self.running:
+                signal_job(run.entry, signal.SIGINT)
+            for run in list(self.running):
+                wait_for_job(run.entry)
+            raise
+        finally:
+            self.selector.close()
+        if self.options.keep_order and self.halted:
+            # Batches dropped by --halt never ran; flush what is held behind them
+            for index in range(self.next_output, max(self.finished, default=-1) + 1):
+                if index not in self.finished:
+                    self._skip(index)
+        if self.failure is None:
+            return 0
+        return self.failure if self.options.halt != 'never' else FAILED_STATUS
+
+
+def run_parallel(args, internal=lambda argv: None):
+    """Entry point for the builtin; internal(argv) returns a function to fork for shell functions/builtins."""
+    try:
+        options = parse_options(args)
+    except ParallelError as e:
+        print_error(f"parallel: {e}")
+        print_error(f"usage: {USAGE}")
+        return 2
+    if internal(options.command) is None and resolve_command(options.command[0]) is None:
+        print_error(f"parallel: {options.command[0]}: command not found")
+        return 127
+    items = options.items if options.items is not None else read_items(options.null)
+    if not items:
+        return 0
+    batches = make_batches(options.command, items, options.jobs, options.max_items)
+    return Scheduler(options, batches, internal).run()
@@ -1,78 +1,239 @@
 import os
-from ui import print_error, print_success
+import sys
+import time
+import fcntl
+import signal
+from contextlib import contextmanager
+from ui import print_error, print_success, print_info, print_failure
 from command_exec import run_command  # Sub-commands dobara use karne ke liye
-
-
-def handle_pipe(cmds, background=False):
-    """System calls se piping handle karne ka function."""
-
-    # Check kar rahe ki sirf 2 commands ho (cmd1 | cmd2)
-    if len(cmds) != 2:
-        print_error("Sirf single pipe supported hai (e.g., cmd1 | cmd2).")
-        return
-
-    # Pipe create karte hain → read aur write end milta hai
-    read_fd, write_fd = os.pipe()
-
-    # Pehla child process fork karte hain → yeh first command run karega
-    pid1 = os.fork()
-    if pid1 == 0:  # Child 1
-        os.close(read_fd)         # Read wala end close; child 1 ko zarurat nahi
-        os.dup2(write_fd, 1)      # stdout ko pipe ke write end pe redirect karo
-        os.close(write_fd)        # Duplicate fd close kar do
-        os.execvp(cmds[0][0], cmds[0])  # Pehli command execute hogi
-
-    else:
-        # Doosra child process fork karte hain → yeh second command run karega
-        pid2 = os.fork()
-        if pid2 == 0:  # Child 2
-            os.close(write_fd)    # Write wala end close;child 2 ko nhi chahiye 
-            os.dup2(read_fd, 0)   # stdin ko pipe ke read end se connect karte hain
-            os.close(read_fd)     # Duplicate fd close
-            os.execvp(cmds[1][0], cmds[1])  # Second command run karo
-
-        else:
-            # Parent process dono ends close karega
-            os.close(read_fd)
-            os.close(write_fd)
-
-            # Agar background nahi hai toh wait karo dono processes ke liye
-            if not background:
-                os.waitpid(pid1, 0)
-                os.waitpid(pid2, 0)
-                print_success("Pipe successfully execute ho gaya.")
+from command_exec import resolve_command, spawn_process, spawn_function, SPAWN_OPEN, SPAWN_DUP2, SPAWN_CLOSE
+from command_exec import add_job, wait_for_job, shell_options, give_terminal_to, LimitError
+import command_exec
+from command_exec import _apply_file_actions
+
+
+# Har pipeline stage ka exit status (bash ke PIPESTATUS jaisa)
+pipe_status = []
+
+
+def redirect_actions(plan):
+    """Redirection plan ko ordered posix_spawn file actions me badalta hai (files child me khulti hain)."""
+    actions = []
+    write_flags = os.O_WRONLY | os.O_CREAT
+    for fd, op, target in plan:
+        if op in ('>&', '<&'):
+            if target == '-':
+                actions.append((SPAWN_CLOSE, fd))
+            elif target.isdigit():
+                actions.append((SPAWN_DUP2, int(target), fd))
+            elif op == '>&':
+                # '>&file' ka matlab '&>file'
+                actions.append((SPAWN_OPEN, 1, target, write_flags | os.O_TRUNC, 0o666))
+                actions.append((SPAWN_DUP2, 1, 2))
             else:
-                print_info("Pipe background me run ho raha hai.")
-
-
-
-def handle_redirection(cmd, redirect_type, file_path, background=False):
-    """Input/output redirection handle karne ka function."""
-
-    pid = os.fork()
-    if pid == 0:  # Child process
-
+                raise ValueError(f"{target}: ambiguous redirect")
+        elif op in ('>', '>|'):
+            if op == '>' and shell_options['noclobber'] and os.path.isfile(target):
+                raise FileExistsError(f"{target}: cannot overwrite existing file")
+            actions.append((SPAWN_OPEN, fd, target, write_flags | os.O_TRUNC, 0o666))
+        elif op == '>>':
+            actions.append((SPAWN_OPEN, fd, target, write_flags | os.O_APPEND, 0o666))
+        elif op == '<':
+            actions.append((SPAWN_OPEN, fd, target, os.O_RDONLY, 0))
+        elif op == '<>':
+            actions.append((SPAWN_OPEN, fd, target, os.O_RDWR | os.O_CREAT, 0o666))
+        elif op in ('&>', '&>>'):
+            mode = os.O_APPEND if op == '&>>' else os.O_TRUNC
+            actions.append((SPAWN_OPEN, 1, target, write_flags | mode, 0o666))
+            actions.append((SPAWN_DUP2, 1, 2))
+    return actions
+
+
+def describe_redirect_error(error, plan):
+    """Spawn fail hone pe batata hai ki kaunsi redirection file problem thi."""
+    for fd, op, target in plan:
+        if op in ('>&', '<&') and (target == '-' or target.isdigit()):
+            continue
+        if op == '<' and not os.path.exists(target):
+            return f"{target}: {error.strerror}"
+        parent = os.path.dirname(target) or '.'
+        if op != '<' and (not os.path.isdir(parent) or os.path.isdir(target)):
+            return f"{target}: {error.strerror}"
+        if not os.access(target if os.path.exists(target) else parent, os.R_OK if op == '<' else os.W_OK):
+            return f"{target}: {error.strerror}"
+    return error.strerror
+
+
+@contextmanager
+def redirected(plan):
+    """Builtins ke liye: redirections shell process me hi lagao aur baad me original fds wapas."""
+    actions = redirect_actions(plan)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    touched = sorted({a[1] if a[0] != SPAWN_DUP2 else a[2] for a in actions})
+    saved = {}
+    # Copies har target fd (aur 10) se upar, taaki '3>file' jaisa target saved copy ko overwrite na kare
+    lowest = max([10] + [fd + 1 for fd in touched])
+    for fd in touched:
         try:
-            # Output overwrite redirection: command > file
-            if redirect_type == '>':
-                # File open karo (overwrite mode)
-                fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
-                os.dup2(fd, 1)  # stdout ko file me redirect karo
+            saved[fd] = fcntl.fcntl(fd, fcntl.F_DUPFD_CLOEXEC, lowest)
+        except OSError:
+            saved[fd] = None  # Pehle se band tha
+    old_streams = sys.stdout, sys.stderr
+    try:
+        _apply_file_actions(actions)
+        # Builtins print() karte hain; GUI me sys.stdout fd 1 nahi hota, isliye streams bhi badlo
+        sys.stdout = open(1, 'w', closefd=False)
+        sys.stderr = open(2, 'w', closefd=False)
+        yield
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except OSError:
+                pass
+        sys.stdout, sys.stderr = old_streams
+        for fd, copy in saved.items():
+            if copy is None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+            else:
+                os.dup2(copy, fd)
+                os.close(copy)
+
+
+def run_pipeline(cmds, background=False, command_text=None, plans=None, names=None, limits=None, envs=None):
+    """Kitne bhi stages ki pipeline chalata hai aur pipeline ka exit status return karta hai.
+
+    Saare children ek process group me hote hain; har child me har unused pipe fd close hota hai
+    taaki EOF turant aage jaye. plans me har stage ka redirection plan hota hai, jo pipe ke
+    baad child me hi lagta hai. Stage-wise statuses pipe_status me milte hain.
+    Stage argv list ho toh program exec hota hai; callable ho (builtin, subshell, if/while...)
+    toh shell ki forked copy me chalta hai aur uska return value exit status banta hai.
+    names har stage ka naam hai (stats ke liye); na ho toh argv[0]. limits me har stage ke
+    job_limits.JobLimits (ya None) hote hain, jo child me exec se pehle lagte hain.
+    envs me har exec hone wale stage ka environment (ya None = os.environ), 'FOO=bar cmd' ke liye.
+    """
+    global pipe_status
+    plans = plans or [[] for _ in cmds]
+    limits = limits or [None] * len(cmds)
+    envs = envs or [None] * len(cmds)
+
+    paths = [None if callable(cmd) else resolve_command(cmd[0]) for cmd in cmds]
+    for cmd, path in zip(cmds, paths):
+        if path is None and not callable(cmd):
+            print_error(f"Command '{cmd[0]}' not found. Check PATH.")
+            pipe_status = [127] * len(cmds)
+            return 127
+
+    # Saari redirections pehle hi validate, taaki aadhi pipeline start na ho
+    try:
+        stage_redirects = [redirect_actions(plan) for plan in plans]
+    except (OSError, ValueError) as e:
+        print_error(str(e))
+        pipe_status = [1] * len(cmds)
+        return 1
+
+    # n stages ke liye n-1 pipes
+    pipes = [os.pipe() for _ in range(len(cmds) - 1)]
+    all_fds = [fd for pair in pipes for fd in pair]
+    sys.stdout.flush()
+    text = command_text or ' | '.join('(...)' if callable(cmd) else ' '.join(cmd) for cmd in cmds)
+
+    if names is None:
+        names = ['(shell)' if callable(cmd) else cmd[0] for cmd in cmds]
+    pids = []
+    pgid = 0
+    job = None
+    started = time.monotonic()
+    # job_lock spawn se lekar add_job tak pakde rakho, taaki reaper koi exit miss na kare
+    with command_exec.job_lock:
+        try:
+            for i, (cmd, path) in enumerate(zip(cmds, paths)):
+                actions = []
+                if i > 0:
+                    actions.append((SPAWN_DUP2, pipes[i - 1][0], 0))  # stdin ← pichla pipe
+                if i < len(cmds) - 1:
+                    actions.append((SPAWN_DUP2, pipes[i][1], 1))      # stdout → agla pipe
+                # Baaki saare pipe fds band, warna reader ko kabhi EOF nahi milega
+                actions.extend((SPAWN_CLOSE, fd) for fd in all_fds)
+                # Redirections pipe ke baad, likhe gaye order me (jaise '2>&1' stdout ke pipe ko follow kare)
+                actions.extend(stage_redirects[i])
+
+                group = pgid if command_exec.job_control else None
+                if callable(cmd):
+                    pid = spawn_function(cmd, actions, setpgroup=group, limits=limits[i])
+                else:
+                    pid = spawn_process(path, cmd, actions, setpgroup=group, env=envs[i], limits=limits[i])
+                if not pgid and command_exec.job_control:
+                    # Pehla child hi group leader hai
+                    pgid = pid
+                    if not background:
+                        give_terminal_to(pgid)
+                pids.append(pid)
+        except LimitError as e:
+            print_error(f"Cannot apply limits ({limits[len(pids)].describe()}): {e.strerror}")
+            for pid in pids:
+                os.kill(pid, signal.SIGTERM)
+        except OSError as e:
+            print_error(describe_redirect_error(e, plans[len(pids)]))
+            for pid in pids:
+                os.kill(pid, signal.SIGTERM)
+        finally:
+            # Parent ko koi pipe end nahi chahiye
+            for fd in all_fds:
                 os.close(fd)
+        if pids:
+            job = add_job(pids, pgid or None, text, not background, names=names, started=started,
+                          limits=limits)
+
+    if len(pids) < len(cmds):
+        if job:
+            if background:
+                job['foreground'] = True
+            wait_for_job(job)
+        give_terminal_to(os.getpgrp())
+        pipe_status = [1] * len(cmds)
+        return 1
+
+    if background:
+        print_info(f"[{job['id']}] Pipeline running in background (PGID: {pgid or os.getpgrp()}).")
+        pipe_status = [0] * len(cmds)
+        return 0
+
+    codes = wait_for_job(job)
+    if codes is None:
+        pipe_status = [128 + signal.SIGTSTP] * len(cmds)
+        return pipe_status[-1]
+
+    pipe_status = codes
+    if shell_options['pipefail']:
+        # Sabse aakhri non-zero status jeetta hai
+        result = next((code for code in reversed(pipe_status) if code), 0)
+    else:
+        result = pipe_status[-1]
 
-            # Input redirection: command < file
-            elif redirect_type == '<':
-                fd = os.open(file_path, os.O_RDONLY)  # File read-only open karo
-                os.dup2(fd, 0)  # stdin ko file se connect karo
-                os.close(fd)
+    if len(cmds) == 1:
+        name = text if callable(cmds[0]) else cmds[0][0]
+        if result == 0:
+            print_success(f"Command '{name}' completed.")
+        else:
+            print_failure(f"Command '{name}' failed with exit code {result}.")
+    elif result == 0:
+        print_success("Pipe successfully execute ho gaya.")
+    else:
+        print_failure(f"Pipeline failed with exit code {result} (stages: {' '.join(map(str, pipe_status))}).")
+    return result
 
-            # Output append redirection: command >> file
-            elif redirect_type == '>>':
-                fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
-                os.dup2(fd, 1)  # stdout ko append mode me file me redirect karo
-                os.close(fd)
 
-            # Ab actual command run kar do
-            os.execvp(cmd[0], cmd)
+def handle_pipe(cmds, background=False):
+    """System calls se piping handle karne ka function."""
+    return run_pipeline(cmds, background)
+
 
-        except FileNotFound
+def handle_redirection(cmd, redirect_type, file_path, background=False):
+    """Input/output redirection handle karne ka function (ek redirect wala shortcut)."""
+    fd = 0 if redirect_type[0] == '<' else 1
+    return run_pipeline([cmd], background, plans=[[(fd, redirect_type, file_path)]])
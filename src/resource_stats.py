@@ -0,0 +1,150 @@
+import math
+import threading
+from collections import OrderedDict
+
+# Rolling per-command latency and resource statistics.
+#
+# Latencies go into a fixed log-scale histogram (8 buckets per doubling, so a
+# percentile is within ~9% of the true value) covering 1 us to ~1.2 hours;
+# memory per command is constant no matter how many runs are recorded.
+# Only the most recently used MAX_TRACKED_COMMANDS names are kept.
+
+BUCKETS_PER_OCTAVE = 8
+MIN_SECONDS = 1e-6
+OCTAVES = 32
+BUCKET_COUNT = BUCKETS_PER_OCTAVE * OCTAVES + 1   # Last bucket catches everything longer
+MAX_TRACKED_COMMANDS = 256
+PERCENTILES = (50, 95, 99)
+
+
+def _bucket_index(seconds):
+    if seconds <= MIN_SECONDS:
+        return 0
+    index = int(math.log2(seconds / MIN_SECONDS) * BUCKETS_PER_OCTAVE) + 1
+    return min(index, BUCKET_COUNT - 1)
+
+
+def _bucket_upper(index):
+    """Upper bound (seconds) of a bucket."""
+    return MIN_SECONDS * 2 ** (index / BUCKETS_PER_OCTAVE)
+
+
+class LatencyHistogram:
+    """Bounded histogram of durations with percentile lookup."""
+    __slots__ = ('counts', 'count', 'total', 'minimum', 'maximum')
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = 0.0
+
+    def record(self, seconds):
+        self.counts[_bucket_index(seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.minimum = seconds if self.minimum is None else min(self.minimum, seconds)
+        self.maximum = max(self.maximum, seconds)
+
+    def percentile(self, p):
+        """Approximate p-th percentile in seconds (0 if empty)."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                # Never report beyond what was actually observed
+                return min(max(_bucket_upper(index), self.minimum), self.maximum)
+        return self.maximum
+
+
+class CommandStats:
+    """Latency histogram plus summed CPU time and peak memory for one command name."""
+    __slots__ = ('latency', 'user', 'sys', 'maxrss', 'nvcsw', 'nivcsw', 'failures')
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.user = 0.0
+        self.sys = 0.0
+        self.maxrss = 0
+        self.nvcsw = 0
+        self.nivcsw = 0
+        self.failures = 0
+
+    def as_dict(self):
+        latency = self.latency
+        result = {
+            'count': latency.count,
+            'failures': self.failures,
+            'wall_total': latency.total,
+            'wall_min': latency.minimum or 0.0,
+            'wall_max': latency.maximum,
+            'user': self.user,
+            'sys': self.sys,
+            'maxrss_kb': self.maxrss,
+            'voluntary_ctxsw': self.nvcsw,
+            'involuntary_ctxsw': self.nivcsw,
+        }
+        for p in PERCENTILES:
+            result[f'p{p}'] = latency.percentile(p)
+        return result
+
+
+_stats = OrderedDict()
+_stats_lock = threading.Lock()
+
+
+def record(name, wall, user=0.0, sys=0.0, maxrss=0, nvcsw=0, nivcsw=0, status=0):
+    """Add one finished command to the statistics."""
+    with _stats_lock:
+        entry = _stats.get(name)
+        if entry is None:
+            entry = _stats[name] = CommandStats()
+            if len(_stats) > MAX_TRACKED_COMMANDS:
+                _stats.popitem(last=False)
+        else:
+            _stats.move_to_end(name)
+        entry.latency.record(wall)
+        entry.user += user
+        entry.sys += sys
+        entry.maxrss = max(entry.maxrss, maxrss)
+        entry.nvcsw += nvcsw
+        entry.nivcsw += nivcsw
+        if status:
+            entry.failures += 1
+
+
+def snapshot():
+    """{command: stats dict} for every tracked command."""
+    with _stats_lock:
+        return {name: entry.as_dict() for name, entry in _stats.items()}
+
+
+def reset():
+    with _stats_lock:
+        _stats.clear()
+
+
+def format_seconds(seconds):
+    """Short human form: 850us, 12.3ms, 4.20s."""
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.0f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.1f}ms"
+    return f"{seconds:.2f}s"
+
+
+def format_table(data=None):
+    """Rows of text for the 'stats' builtin, busiest commands first."""
+    data = snapshot() if data is None else data
+    header = f"{'command':20} {'runs':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'user':>8} {'sys':>8} {'maxrss':>9} {'ctxsw':>7}"
+    rows = [header]
+    for name, s in sorted(data.items(), key=lambda item: -item[1]['wall_total']):
+        rows.append(f"{name[:20]:20} {s['count']:6} {format_seconds(s['p50']):>8} {format_seconds(s['p95']):>8} "
+                    f"{format_seconds(s['p99']):>8} {format_seconds(s['wall_max']):>8} "
+                    f"{format_seconds(s['user']):>8} {format_seconds(s['sys']):>8} "
+                    f"{s['maxrss_kb']:7}KB {s['voluntary_ctxsw'] + s['involuntary_ctxsw']:7}")
+    return rows
@@ -0,0 +1,147 @@
+import os
+import sys
+import struct
+import marshal
+# The C modules under socket and signal: their Python wrappers import enum and
+# selectors, which would double the client's import time
+import _socket
+import _signal
+
+# Thin front-end for the shell daemon (shell_daemon.py), and the message
+# format both sides use. Importing this module must stay cheap: 'main.py
+# --attach' loads nothing else, so a client starts in roughly the time of a
+# bare interpreter.
+#
+# A request is one message carrying the client's stdin, stdout and stderr as
+# SCM_RIGHTS file descriptors, so the session reads and writes the client's
+# terminal (or pipes) directly and no output is relayed. The daemon answers
+# {'pid': session pid} once the session has started and {'status': N} when it
+# is over. Messages are marshal'd dicts behind a 4-byte length.
+
+HEADER = struct.Struct('!I')
+MAX_FDS = 3
+FORWARDED_SIGNALS = (_signal.SIGINT, _signal.SIGQUIT, _signal.SIGTERM, _signal.SIGHUP)
+FD_SIZE = struct.calcsize('i')
+
+
+def socket_path():
+    """CUSTOMSHELL_SOCKET, else customshell.sock in $XDG_RUNTIME_DIR or a private directory under /tmp."""
+    path = os.environ.get('CUSTOMSHELL_SOCKET')
+    if path:
+        return path
+    base = os.environ.get('XDG_RUNTIME_DIR') or f'/tmp/customshell-{os.getuid()}'
+    return os.path.join(base, 'customshell.sock')
+
+
+def send_message(sock, message, fds=()):
+    """Send message on a Unix stream socket, passing fds along with its first byte."""
+    data = marshal.dumps(message)
+    data = HEADER.pack(len(data)) + data
+    if fds:
+        rights = struct.pack(f'{len(fds)}i', *fds)
+        data = data[sock.sendmsg([data], [(_socket.SOL_SOCKET, _socket.SCM_RIGHTS, rights)]):]
+    if data:
+        sock.sendall(data)
+
+
+def recv_fds(sock, size, maxfds):
+    """Like socket.recv_fds: returns (data, fds)."""
+    data, ancillary, _, _ = sock.recvmsg(size, _socket.CMSG_SPACE(maxfds * FD_SIZE))
+    fds = []
+    for level, kind, payload in ancillary:
+        if level == _socket.SOL_SOCKET and kind == _socket.SCM_RIGHTS:
+            count = len(payload) // FD_SIZE
+            fds.extend(struct.unpack(f'{count}i', payload[:count * FD_SIZE]))
+    return data, fds
+
+
+def _recv_exactly(sock, size, fds, maxfds):
+    chunks = []
+    while size:
+        if maxfds > len(fds):
+            data, new_fds = recv_fds(sock, size, maxfds - len(fds))
+            fds.extend(new_fds)
+        else:
+            data = sock.recv(size)
+        if not data:
+            return None
+        chunks.append(data)
+        size -= len(data)
+    return b''.join(chunks)
+
+
+def recv_message(sock, maxfds=0):
+    """Returns (message, fds); message is None if the peer closed the connection."""
+    fds = []
+    header = _recv_exactly(sock, HEADER.size, fds, maxfds)
+    if header is None:
+        return None, fds
+    data = _recv_exactly(sock, HEADER.unpack(header)[0], fds, maxfds)
+    return (None if data is None else marshal.loads(data)), fds
+
+
+def start(request, fds, path=None):
+    """Send request to the daemon with fds as the session's 0, 1 and 2; returns (connection, session pid).
+
+    Raises OSError if there is no daemon or it refused the request.
+    """
+    sock = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        sock.connect(path or socket_path())
+        send_message(sock, request, fds)
+        reply, _ = recv_message(sock)
+    except OSError:
+        sock.close()
+        raise
+    if reply is None or 'pid' not in reply:
+        sock.close()
+        raise ConnectionError((reply or {}).get('error', 'session did not start'))
+    return sock, reply['pid']
+
+
+def finish(sock):
+    """Wait for the session on sock to end; returns its exit status."""
+    try:
+        reply, _ = recv_message(sock)
+    finally:
+        sock.close()
+    # The session died without reporting (killed, or the daemon went away)
+    return 1 if reply is None else reply['status']
+
+
+def request_for(args):
+    """The request for main.py's parsed arguments (-c, a script, piped stdin or interactive)."""
+    if args.command is not None:
+        request = {'mode': 'script', 'lines': args.command.splitlines()}
+    elif args.script:
+        request = {'mode': 'file', 'path': os.path.abspath(args.script)}
+    elif args.interactive or sys.stdin.isatty():
+        request = {'mode': 'interactive'}
+    else:
+        request = {'mode': 'stdin'}
+    request['cwd'] = os.getcwd()
+    request['env'] = dict(os.environ)
+    return request
+
+
+def attach(args):
+    """Run main.py's request in a daemon session on this process's stdin/stdout/stderr."""
+    path = socket_path()
+    try:
+        sock, pid = start(request_for(args), (0, 1, 2), path)
+    except OSError as e:
+        print(f"customshell: cannot attach to {path}: {e.strerror or e} (start one with 'main.py --daemon')",
+              file=sys.stderr)
+        return 1
+    # The session is not in this terminal's foreground process group, so pass on what the terminal sends us
+    for sig in FORWARDED_SIGNALS:
+        _signal.signal(sig, lambda sig, frame: _forward(pid, sig))
+    _signal.signal(_signal.SIGTSTP, _signal.SIG_IGN)  # No job control in attached sessions
+    return finish(sock)
+
+
+def _forward(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except ProcessLookupError:
+        pass
@@ -0,0 +1,270 @@
+import os
+import sys
+import time
+import errno
+import socket
+import struct
+import signal
+from collections import deque
+
+import core_shell
+from core_shell import execute_line, run_script, shell_loop
+from usability_features import load_aliases, setup_readline, load_history, refresh_history
+from completion_index import complete_command
+from ui import set_decorations, prompt_cwd_changed
+from shell_client import socket_path, send_message, recv_message, recv_fds, MAX_FDS
+
+# 'main.py --daemon': one long-running shell that has already paid for imports,
+# aliases, history and the PATH completion index, serving sessions to thin
+# clients ('main.py --attach', 'gui.py --attach') over a Unix socket.
+#
+# The daemon keeps SPARES sessions forked ahead of time. A spare shares
+# nearly all of its memory with the daemon (copy-on-write), so it costs little
+# to keep around, and a client that connects is handed to one at once: the
+# fork is off the critical path. The spare takes the client's fds as 0/1/2 and
+# its cwd and environment, runs the request (-c lines, a script, stdin, an
+# interactive loop or one GUI job line) and reports the status. Jobs are per
+# session, and attached sessions have no job control: the session is not in
+# the client terminal's process session, so Ctrl-C reaches it through the
+# client, which forwards signals to the session's process group.
+
+try:
+    SPARES = max(1, int(os.environ.get('CUSTOMSHELL_DAEMON_SPARES', 2)))
+except ValueError:
+    SPARES = 2
+BACKLOG = 64
+REAP_INTERVAL = 1.0         # Seconds between checks for finished sessions when idle
+
+
+def log(message):
+    print(f"customshell daemon [{os.getpid()}]: {message}", file=sys.stderr, flush=True)
+
+
+def _peer_uid(conn):
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+
+def _take_fds(fds):
+    """Make fds the session's stdin, stdout and stderr."""
+    for target, fd in enumerate(fds):
+        if fd != target:
+            os.dup2(fd, target)
+            os.close(fd)
+    sys.stdin = open(0, 'r', closefd=False)
+    sys.stdout = open(1, 'w', closefd=False)
+    sys.stderr = open(2, 'w', closefd=False)
+
+
+def run_request(request, aliases):
+    """Run one client request in this (spare) process; returns the exit status."""
+    mode = request['mode']
+    if mode == 'interactive':
+        shell_loop(aliases, attached=True)
+        return core_shell.last_status
+    if mode == 'line':
+        # A GUI job: aliases apply, status lines are for the GUI to show
+        set_decorations(False)
+        return execute_line(request['line'], aliases)
+    if mode == 'script':
+        return run_script(request['lines'])
+    if mode == 'file':
+        try:
+            with open(request['path']) as f:
+                return run_script(f)
+        except OSError as e:
+            print(f"customshell: {request['path']}: {e.strerror}", file=sys.stderr)
+            return 127
+    return run_script(sys.stdin)
+
+
+def serve_session(conn, aliases):
+    """Body of a spare once it has a client: read the request, become the session, report the status."""
+    request, fds = recv_message(conn, MAX_FDS)
+    if request is None or len(fds) != MAX_FDS:
+        return 1
+    _take_fds(fds)
+    try:
+        os.chdir(request['cwd'])
+    except OSError:
+        pass
+    os.environ.clear()
+    os.environ.update(request['env'])
+    core_shell.shell_pid = os.getpid()
+    prompt_cwd_changed()
+    send_message(conn, {'pid': os.getpid()})
+    status = 1
+    try:
+        status = run_request(request, aliases)
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+    except KeyboardInterrupt:
+        status = 130
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+    try:
+        send_message(conn, {'status': status & 0xFF})
+    except OSError:
+        pass  # Client already gone
+    return status
+
+
+class Daemon:
+    def __init__(self, path=None, spares=SPARES):
+        self.path = path or socket_path()
+        self.spare_count = spares
+        self.spares = deque()      # (pid, socket to hand it a client)
+        self.listener = None
+        self.aliases = None
+        self.running = True
+
+    def warm(self):
+        """Load what every session would otherwise load for itself."""
+        self.aliases = load_aliases()
+        len(self.aliases)          # Read the alias file now, not in each session
+        setup_readline(self.aliases)
+        load_history()
+        complete_command('')       # Build the PATH index
+
+    def listen(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass
+        else:
+            raise OSError(errno.EADDRINUSE, f"a daemon is already listening on {self.path}")
+        finally:
+            probe.close()
+        try:
+            os.unlink(self.path)   # Left behind by a daemon that died
+        except FileNotFoundError:
+            pass
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            self.listener.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        self.listener.listen(BACKLOG)
+        self.listener.settimeout(REAP_INTERVAL)
+
+    def _fork_spare(self):
+        ours, theirs = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                ours.close()
+                self.listener.close()
+                for _, channel in self.spares:
+                    channel.close()
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                for sig in (signal.SIGTERM, signal.SIGHUP):
+                    signal.signal(sig, signal.SIG_DFL)
+                # Own process group (clients signal the session through it) and no
+                # controlling terminal, so reading a client's terminal never stops us
+                os.setsid()
+                status = self._spare(theirs)
+            except BaseException as e:
+                log(f"session failed: {e}")
+            finally:
+                os._exit(status & 0xFF)
+        theirs.close()
+        self.spares.append((pid, ours))
+
+    def _spare(self, channel):
+        """Wait for a client to be handed over, then serve it."""
+        try:
+            _, fds = recv_fds(channel, 1, 1)
+        except OSError:
+            return 0
+        channel.close()
+        if not fds:
+            return 0               # Daemon shutting down
+        refresh_history()          # Entries added since this spare was forked
+        conn = socket.socket(fileno=fds[0])
+        return serve_session(conn, self.aliases)
+
+    def _hand_off(self, conn):
+        try:
+            if _peer_uid(conn) != os.getuid():
+                send_message(conn, {'error': 'permission denied'})
+                return
+        except OSError:
+            return
+        while True:
+            if not self.spares:
+                self._fork_spare()
+            pid, channel = self.spares.popleft()
+            try:
+                channel.sendmsg([b'c'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, struct.pack('i', conn.fileno()))])
+                return
+            except OSError:
+                continue           # That spare is gone; try the next one
+            finally:
+                channel.close()
+
+    def _reap(self):
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+
+    def _stop(self, sig, frame):
+        self.running = False
+
+    def serve(self):
+        self.listen()
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+            signal.signal(sig, self._stop)
+        started = time.perf_counter()
+        while len(self.spares) < self.spare_count:
+            self._fork_spare()
+        log(f"listening on {self.path} with {self.spare_count} spare sessions "
+            f"(forked in {(time.perf_counter() - started) * 1e3:.1f} ms)")
+        try:
+            while self.running:
+                try:
+                    conn, _ = self.listener.accept()
+                except socket.timeout:
+                    self._reap()
+                    continue
+                except InterruptedError:
+                    continue
+                with conn:
+                    self._hand_off(conn)
+                while len(self.spares) < self.spare_count:
+                    self._fork_spare()
+                self._reap()
+        finally:
+            for _, channel in self.spares:
+                channel.close()    # Idle spares see EOF and exit
+            self.listener.close()
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            log("stopped")
+        return 0
+
+
+def serve(path=None):
+    """Entry point for 'main.py --daemon'."""
+    set_decorations(False)
+    daemon = Daemon(path)
+    daemon.warm()
+    try:
+        return daemon.serve()
+    except OSError as e:
+        log(str(e.strerror or e))
+        return 1
@@ -0,0 +1,560 @@
+from collections import namedtuple, OrderedDict
+
+# --- Tokens ---
+class Operator(str):
+    """Unquoted shell operator token; quoted text is never an Operator."""
+
+
+# A word keeps how each piece was quoted, so globbing and expansion can tell
+# `*.py` from `'*.py'`. parts is a tuple of (text, quote) with quote one of
+# None (bare), "'" (single quotes), '"' (double quotes) or '\\' (backslash-escaped).
+Word = namedtuple('Word', ['parts'])
+
+# Longest first so '>>' is never read as '>' '>'
+OPERATORS = ('&>>', '&>', '&&', '||', ';;', '>>', '>|', '>&', '<&', '<>', '<<',
+             '|', '&', ';', '>', '<', '(', ')', '\n')
+REDIRECT_OPERATORS = ('>>', '>|', '>&', '<&', '<>', '>', '<', '&>>', '&>')
+RESERVED_WORDS = {'if', 'then', 'elif', 'else', 'fi', 'while', 'until', 'for', 'in',
+                  'do', 'done', '{', '}', '!', 'function', 'time'}
+
+# --- AST ---
+Command = namedtuple('Command', ['words', 'redirects'])           # redirects: (fd, op, Word)
+Pipeline = namedtuple('Pipeline', ['commands', 'negate', 'timed'])  # timed: None, 'default' or 'posix'
+AndOr = namedtuple('AndOr', ['first', 'rest'])                     # rest: ((op, Pipeline), ...)
+Sequence = namedtuple('Sequence', ['items'])                       # items: ((node, background), ...)
+Subshell = namedtuple('Subshell', ['body', 'redirects'])
+Group = namedtuple('Group', ['body', 'redirects'])
+If = namedtuple('If', ['clauses', 'else_body', 'redirects'])       # clauses: ((cond, body), ...)
+While = namedtuple('While', ['condition', 'body', 'until', 'redirects'])
+For = namedtuple('For', ['name', 'words', 'body', 'redirects'])    # words None means "$@"
+FunctionDef = namedtuple('FunctionDef', ['name', 'body'])
+
+PARSE_CACHE_SIZE = 512
+
+
+class ParseError(ValueError):
+    """The command line is not valid shell syntax."""
+
+
+class IncompleteInput(ParseError):
+    """The command line ends inside a quote or construct; more lines are needed."""
+
+
+def word_text(word):
+    """The word's text with quoting removed."""
+    return ''.join(text for text, quote in word.parts)
+
+
+def is_bare(word):
+    """True if no part of the word was quoted (needed for reserved words and assignments)."""
+    return all(quote is None for text, quote in word.parts)
+
+
+def _add(parts, text, quote):
+    """Append text to a parts list, merging with the previous part of the same quoting."""
+    if parts and parts[-1][1] == quote:
+        parts[-1] = (parts[-1][0] + text, quote)
+    else:
+        parts.append((text, quote))
+
+
+def _scan_quoted(line, i):
+    """Return the index just past the '...', "..." or `...` string starting at line[i]."""
+    quote = line[i]
+    n = len(line)
+    if quote == "'":
+        end = line.find("'", i + 1)
+        i = n if end < 0 else end
+    else:
+        i += 1
+        while i < n and line[i] != quote:
+            if line[i] == '\\':
+                i += 2
+            elif quote == '"' and line[i] in '$`':
+                # "$(echo ")")" and "${x:-"}"}": the quotes nest inside the expansion
+                i = scan_expansion(line, i) or i + 1
+            else:
+                i += 1
+    if i >= n:
+        raise IncompleteInput(f"unexpected end of input: missing closing {quote!r}")
+    return i + 1
+
+
+def _scan_balanced(line, i, open_char, close_char):
+    """Return the index just past the close_char matching the open_char at line[i].
+
+    Quotes, backslash escapes and nested expansions are skipped as units, so a
+    ')' or '}' inside them does not end the expansion.
+    """
+    depth = 0
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c in '\'"`':
+            i = _scan_quoted(line, i)
+            continue
+        if c == '$' and line.startswith(('$(', '${'), i):
+            i = scan_expansion(line, i)
+            continue
+        if c == open_char:
+            depth += 1
+        elif c == close_char:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    raise IncompleteInput(f"unexpected end of input: missing closing '{close_char}'")
+
+
+def scan_expansion(line, i):
+    """If line[i] starts $(...), ${...} or `...`, return the index past it, else None.
+
+    Raises IncompleteInput when the expansion is not closed.
+    """
+    if line.startswith('$(', i):
+        return _scan_balanced(line, i + 1, '(', ')')
+    if line.startswith('${', i):
+        return _scan_balanced(line, i + 1, '{', '}')
+    if line[i] == '`':
+        return _scan_quoted(line, i)
+    return None
+
+
+def tokenize(line):
+    """Split source text into Word and Operator tokens, tracking the quoting of every part."""
+    tokens = []
+    parts = []
+    in_word = False     # A quoted empty string ('') is still a word
+    i = 0
+    n = len(line)
+
+    def finish():
+        nonlocal parts, in_word
+        if in_word:
+            tokens.append(Word(tuple(parts)))
+        parts, in_word = [], False
+
+    while i < n:
+        c = line[i]
+        if c in ' \t':
+            finish()
+            i += 1
+        elif c == '#' and not in_word:
+            # Comment to end of line
+            end = line.find('\n', i)
+            i = n if end < 0 else end
+        elif c == "'":
+            end = line.find("'", i + 1)
+            if end < 0:
+                raise IncompleteInput("unexpected end of input: missing closing \"'\"")
+            _add(parts, line[i + 1:end], "'")
+            in_word = True
+            i = end + 1
+        elif c == '"':
+            i += 1
+            _add(parts, '', '"')
+            while True:
+                if i >= n:
+                    raise IncompleteInput('unexpected end of input: missing closing \'"\'')
+                c = line[i]
+                if c == '"':
+                    i += 1
+                    break
+                if c == '\\' and i + 1 < n and line[i + 1] in '"\\$`\n':
+                    if line[i + 1] != '\n':
+                        _add(parts, line[i + 1], '\\')
+                    i += 2
+                    continue
+                end = scan_expansion(line, i) if c in '$`' else None
+                if end:
+                    _add(parts, line[i:end], '"')
+                    i = end
+                else:
+                    _add(parts, c, '"')
+                    i += 1
+            in_word = True
+        elif c == '\\':
+            if i + 1 >= n or (line[i + 1] == '\n' and i + 2 >= n):
+                # A continuation still needs its next line
+                raise IncompleteInput("unexpected end of input after '\\'")
+            if line[i + 1] != '\n':  # Backslash-newline is a line continuation
+                _add(parts, line[i + 1], '\\')
+                in_word = True
+            i += 2
+        elif c in '|&;<>()\n':
+            op = next(o for o in OPERATORS if line.startswith(o, i))
+            i += len(op)
+            if op == '<<':
+                raise ParseError("here-documents are not supported")
+            digits = in_word and all(q is None and t.isdigit() for t, q in parts)
+            if digits and op in REDIRECT_OPERATORS and op[0] in '<>':
+                # '2>' style: the fd number belongs to the operator
+                op = ''.join(t for t, q in parts) + op
+                parts, in_word = [], False
+            finish()
+            tokens.append(Operator(op))
+        else:
+            end = scan_expansion(line, i) if c in '$`' else None
+            if end:
+                _add(parts, line[i:end], None)
+                i = end
+            else:
+                _add(parts, c, None)
+                i += 1
+            in_word = True
+    finish()
+    return tokens
+
+
+def split_redirect_operator(token):
+    """Operator('2>&') -> (2, '>&'); None if the token is not a redirection."""
+    if not isinstance(token, Operator):
+        return None
+    op = token.lstrip('0123456789')
+    if op not in REDIRECT_OPERATORS:
+        return None
+    number = token[:len(token) - len(op)]
+    if number:
+        fd = int(number)
+    else:
+        fd = 0 if op[0] == '<' else 1
+    return fd, op
+
+
+# --- Parser ---
+class _Parser:
+    """Recursive-descent parser over the token list."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def advance(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def at_op(self, *ops):
+        token = self.peek()
+        return isinstance(token, Operator) and token in ops
+
+    def at_reserved(self, *words):
+        token = self.peek()
+        return isinstance(token, Word) and is_bare(token) and word_text(token) in words
+
+    def at_word_text(self, text):
+        token = self.peek()
+        return isinstance(token, Word) and word_text(token) == text
+
+    def at_end(self):
+        return self.pos >= len(self.tokens)
+
+    def skip_newlines(self):
+        while self.at_op('\n'):
+            self.pos += 1
+
+    def expect_reserved(self, word):
+        self.skip_newlines()
+        if self.at_end():
+            raise IncompleteInput(f"unexpected end of input: expected '{word}'")
+        if not self.at_reserved(word):
+            raise ParseError(f"syntax error near '{self._describe(self.peek())}': expected '{word}'")
+        self.pos += 1
+
+    def _describe(self, token):
+        if token is None:
+            return 'end of input'
+        if isinstance(token, Word):
+            return word_text(token)
+        return 'newline' if token == '\n' else token
+
+    def error(self):
+        token = self.peek()
+        if token is None:
+            raise IncompleteInput("unexpected end of input")
+        raise ParseError(f"syntax error near unexpected token '{self._describe(token)}'")
+
+    def parse_program(self):
+        body = self.parse_list(())
+        if not self.at_end():
+            self.error()
+        return body
+
+    def parse_list(self, stop_words, stop_paren=False):
+        """and-or lists separated by ';', '&' or newlines, up to a closing reserved word."""
+        items = []
+        self.skip_newlines()
+        while not self.at_end():
+            if self.at_reserved(*stop_words) or (stop_paren and self.at_op(')')):
+                break
+            node = self.parse_and_or()
+            background = False
+            if self.at_op('&'):
+                background = True
+                self.pos += 1
+            elif self.at_op(';', '\n'):
+                self.pos += 1
+            items.append((node, background))
+            self.skip_newlines()
+            if not self.at_end() and not (self.at_reserved(*stop_words) or (stop_paren and self.at_op(')'))):
+                prev = self.tokens[self.pos - 1]
+                if not (isinstance(prev, Operator) and prev in (';', '&', '\n')):
+                    self.error()
+        return Sequence(tuple(items))
+
+    def parse_body(self, stop_words, stop_paren=False):
+        body = self.parse_list(stop_words, stop_paren)
+        if not body.items:
+            self.error()
+        return body
+
+    def parse_and_or(self):
+        first = self.parse_pipeline()
+        rest = []
+        while self.at_op('&&', '||'):
+            op = self.advance()
+            self.skip_newlines()
+            rest.append((str(op), self.parse_pipeline()))
+        return AndOr(first, tuple(rest)) if rest else first
+
+    def parse_pipeline(self):
+        negate = False
+        timed = None
+        if self.at_reserved('time'):
+            self.pos += 1
+            timed = 'default'
+            if self.at_word_text('-p'):
+                self.pos += 1
+                timed = 'posix'
+            if self.at_end() or (isinstance(self.peek(), Operator) and self.peek() != '('):
+                # A bare 'time' reports on an empty pipeline, like bash
+                return Pipeline((), False, timed)
+        if self.at_reserved('!'):
+            negate = True
+            self.pos += 1
+        commands = [self.parse_command()]
+        while self.at_op('|'):
+            self.pos += 1
+            self.skip_newlines()
+            commands.append(self.parse_command())
+        return Pipeline(tuple(commands), negate, timed)
+
+    def parse_redirects(self):
+        redirects = []
+        while True:
+            redirect = split_redirect_operator(self.peek())
+            if redirect is None:
+                return tuple(redirects)
+            self.pos += 1
+            target = self.peek()
+            if not isinstance(target, Word):
+                self.error()
+            self.pos += 1
+            redirects.append((redirect[0], redirect[1], target))
+
+    def parse_command(self):
+        if self.at_end():
+            self.error()
+        if self.at_op('('):
+            self.pos += 1
+            body = self.parse_body((), stop_paren=True)
+            if not self.at_op(')'):
+                self.error()
+            self.pos += 1
+            return Subshell(body, self.parse_redirects())
+        if self.at_reserved('{'):
+            self.pos += 1
+            body = self.parse_body(('}',))
+            self.expect_reserved('}')
+            return Group(body, self.parse_redirects())
+        if self.at_reserved('then', 'elif', 'else', 'fi', 'do', 'done', '}'):
+            self.error()
+        if self.at_reserved('if'):
+            return self.parse_if()
+        if self.at_reserved('while', 'until'):
+            until = word_text(self.advance()) == 'until'
+            condition = self.parse_body(('do',))
+            self.expect_reserved('do')
+            body = self.parse_body(('done',))
+            self.expect_reserved('done')
+            return While(condition, body, until, self.parse_redirects())
+        if self.at_reserved('for'):
+            return self.parse_for()
+        if self.at_reserved('function'):
+            self.pos += 1
+            name = self.advance()
+            if not isinstance(name, Word):
+                self.error()
+            if self.at_op('('):
+                self.pos += 1
+                if not self.at_op(')'):
+                    self.error()
+                self.pos += 1
+            return self.parse_function_body(word_text(name))
+        following = self.tokens[self.pos + 1] if self.pos + 1 < len(self.tokens) else None
+        if isinstance(self.peek(), Word) and isinstance(following, Operator) and following == '(':
+            # name() compound-command
+            name = word_text(self.advance())
+            self.pos += 1
+            if not self.at_op(')'):
+                self.error()
+            self.pos += 1
+            return self.parse_function_body(name)
+        return self.parse_simple_command()
+
+    def parse_function_body(self, name):
+        self.skip_newlines()
+        if self.at_end():
+            raise IncompleteInput("unexpected end of input: expected function body")
+        body = self.parse_command()
+        if isinstance(body, Command):
+            raise ParseError(f"syntax error: function '{name}' body must be a compound command")
+        return FunctionDef(name, body)
+
+    def parse_if(self):
+        clauses = []
+        self.pos += 1  # 'if'
+        while True:
+            condition = self.parse_body(('then',))
+            self.expect_reserved('then')
+            body = self.parse_body(('elif', 'else', 'fi'))
+            clauses.append((condition, body))
+            if self.at_reserved('elif'):
+                self.pos += 1
+                continue
+            break
+        else_body = None
+        if self.at_reserved('else'):
+            self.pos += 1
+            else_body = self.parse_body(('fi',))
+        self.expect_reserved('fi')
+        return If(tuple(clauses), else_body, self.parse_redirects())
+
+    def parse_for(self):
+        self.pos += 1  # 'for'
+        name = self.advance()
+        if not isinstance(name, Word) or not is_bare(name):
+            self.error()
+        words = None
+        self.skip_newlines()
+        if self.at_reserved('in'):
+            self.pos += 1
+            words = []
+            while isinstance(self.peek(), Word):
+                words.append(self.advance())
+            words = tuple(words)
+        if self.at_op(';', '\n'):
+            self.pos += 1
+        self.expect_reserved('do')
+        body = self.parse_body(('done',))
+        self.expect_reserved('done')
+        return For(word_text(name), words, body, self.parse_redirects())
+
+    def parse_simple_command(self):
+        words = []
+        redirects = []
+        while not self.at_end():
+            token = self.peek()
+            redirect = split_redirect_operator(token)
+            if redirect is not None:
+                redirects.extend(self.parse_redirects())
+            elif isinstance(token, Word):
+                words.append(token)
+                self.pos += 1
+            else:
+                break
+        if not words and not redirects:
+            self.error()
+        return Command(tuple(words), tuple(redirects))
+
+
+_parse_cache = OrderedDict()
+
+
+def parse(source):
+    """Parse source text into an AST, reusing the cached tree for text seen before.
+
+    Raises IncompleteInput when more lines are needed and ParseError on bad syntax.
+    """
+    tree = _parse_cache.get(source)
+    if tree is not None:
+        _parse_cache.move_to_end(source)
+        return tree
+    tree = _Parser(tokenize(source)).parse_program()
+    _parse_cache[source] = tree
+    if len(_parse_cache) > PARSE_CACHE_SIZE:
+        _parse_cache.popitem(last=False)
+    return tree
+
+
+def is_complete(source):
+    """False if source ends inside a quote or construct and needs more lines (bad syntax counts as complete)."""
+    try:
+        parse(source)
+    except IncompleteInput:
+        return False
+    except ParseError:
+        return True
+    return True
+
+
+
+# --- Unparsing (for job listings) ---
+def _quote_word(word):
+    out = []
+    for text, quote in word.parts:
+        if quote == "'":
+            out.append(f"'{text}'")
+        elif quote == '"':
+            out.append(f'"{text}"')
+        elif quote == '\\':
+            out.append(''.join('\\' + c for c in text))
+        else:
+            out.append(text)
+    return ''.join(out)
+
+
+def _redirects_text(redirects):
+    pieces = []
+    for fd, op, target in redirects:
+        default_fd = 0 if op[0] == '<' else 1
+        prefix = '' if fd == default_fd or op[0] == '&' else str(fd)
+        pieces.append(f" {prefix}{op}{_quote_word(target)}")
+    return ''.join(pieces)
+
+
+def unparse(node):
+    """Turn an AST back into (normalised) source text."""
+    if isinstance(node, Command):
+        return (' '.join(_quote_word(w) for w in node.words) + _redirects_text(node.redirects)).strip()
+    if isinstance(node, Pipeline):
+        prefix = {'default': 'time ', 'posix': 'time -p '}.get(node.timed, '')
+        return (prefix + ('! ' if node.negate else '') + ' | '.join(unparse(c) for c in node.commands)).rstrip()
+    if isinstance(node, AndOr):
+        return unparse(node.first) + ''.join(f" {op} {unparse(p)}" for op, p in node.rest)
+    if isinstance(node, Sequence):
+        return '; '.join(unparse(n) + (' &' if bg else '') for n, bg in node.items).replace('&;', '&')
+    if isinstance(node, Subshell):
+        return f"({unparse(node.body)}){_redirects_text(node.redirects)}"
+    if isinstance(node, Group):
+        return f"{{ {unparse(node.body)}; }}{_redirects_text(node.redirects)}"
+    if isinstance(node, If):
+        text = 'if ' + '; elif '.join(f"{unparse(c)}; then {unparse(b)}" for c, b in node.clauses)
+        if node.else_body:
+            text += f"; else {unparse(node.else_body)}"
+        return text + '; fi' + _redirects_text(node.redirects)
+    if isinstance(node, While):
+        keyword = 'until' if node.until else 'while'
+        return f"{keyword} {unparse(node.condition)}; do {unparse(node.body)}; done{_redirects_text(node.redirects)}"
+    if isinstance(node, For):
+        words = '' if node.words is None else ' in ' + ' '.join(_quote_word(w) for w in node.words)
+        return f"for {node.name}{words}; do {unparse(node.body)}; done{_redirects_text(node.redirects)}"
+    if isinstance(node, FunctionDef):
+        return f"{node.name}() {unparse(node.body)}"
+    return ''
@@ -1,8 +1,11 @@
 import os
-import re
+import sys
+import threading
+from queue import SimpleQueue
 
-# Regex to find and remove ANSI escape codes
-ANSI_ESCAPE_REGEX = re.compile(r'\x1b\[[0-?]*[ -/]*[@-~]')
+# Regex to find and remove ANSI escape codes ('re' is imported on first use;
+# only the GUI strips codes, and the CLI starts faster without it)
+ANSI_ESCAPE_PATTERN = r'\x1b\[[0-?]*[ -/]*[@-~]'
 
 # --- ANSI Color Codes ---
 class Colors:
@@ -35,30 +38,217 @@ class Colors:
     SUCCESS = BRIGHT_GREEN
     ERROR = BRIGHT_RED
 
+# Interactive sessions decorate output with [+]/[i] status lines; batch runs
+# (-c, scripts, piped stdin) keep only real errors, written plainly to stderr.
+_decorate = True
+
+
+def set_decorations(enabled):
+    """Turn status decoration on (interactive) or off (batch mode); returns the previous setting."""
+    global _decorate
+    previous, _decorate = _decorate, enabled
+    return previous
+
+
+# --- Prompt Engine ---
+# The prompt is a list of segments. Each segment returns (color, text) pieces, so the
+# colored CLI prompt and the plain GUI prompt are rendered from the same data.
+VCS_TIME_BUDGET = 0.02       # Seconds the prompt may wait for a fresh VCS lookup
+SLOW_COMMAND_SECONDS = 2.0   # Commands slower than this show their duration
+
+_prompt_state = {'status': 0, 'duration': None, 'jobs': 0, 'cwd': None}
+_user_host = None            # Computed once: user and host never change
+_cwd_display = None          # Recomputed only after prompt_cwd_changed()
+_home = None
+_vcs_cache = {}              # directory -> branch name ('' when not in a repository)
+_vcs_pending = {}            # directory -> threading.Event of the lookup in flight
+_vcs_lock = threading.Lock()
+_vcs_requests = SimpleQueue()  # (directory, Event) for the one lookup thread
+_vcs_worker = None
+
+
+def set_prompt_state(status=None, duration=None, jobs=None, cwd=None):
+    """Record what the next prompt should show about the last command and background jobs.
+
+    cwd replaces the process working directory in the prompt (the GUI keeps a
+    logical directory per session instead of calling chdir).
+    """
+    global _cwd_display
+    if status is not None:
+        _prompt_state['status'] = status
+        _prompt_state['duration'] = duration
+    if jobs is not None:
+        _prompt_state['jobs'] = jobs
+    if cwd is not None:
+        _prompt_state['cwd'] = cwd
+        _cwd_display = None
+
+
+def prompt_cwd_changed():
+    """Call after a directory change so the cwd segment is recomputed."""
+    global _cwd_display
+    _cwd_display = None
+
+
+def _segment_user_host():
+    global _user_host
+    if _user_host is None:
+        user = os.environ.get('USER', 'user')
+        hostname = os.uname().nodename if hasattr(os, 'uname') else 'host'
+        _user_host = f"{user}@{hostname}"
+    return [(Colors.PROMPT_USER, _user_host), (None, ':')]
+
+
+def _current_dir():
+    if _prompt_state['cwd'] is not None:
+        return _prompt_state['cwd']
+    try:
+        return os.getcwd()
+    except OSError:
+        return os.environ.get('PWD', '?')
+
+
+def _segment_cwd():
+    global _cwd_display, _home
+    if _cwd_display is None:
+        if _home is None:
+            _home = os.path.expanduser('~')
+        cwd = _current_dir()
+        # Shorten path for readability (e.g., /home/user -> ~)
+        if cwd.startswith(_home):
+            cwd = '~' + cwd[len(_home):]
+        # Truncate long paths
+        if len(cwd) > 25:
+            cwd = "..." + cwd[-22:]
+        _cwd_display = cwd
+    return [(Colors.PROMPT_DIR, _cwd_display)]
+
+
+def _read_branch(directory):
+    """Find the enclosing git repository and return its branch (or short commit) name."""
+    path = directory
+    while True:
+        git = os.path.join(path, '.git')
+        if os.path.isfile(git):
+            # Worktrees/submodules: '.git' is a file pointing at the real git dir
+            with open(git) as f:
+                line = f.readline().strip()
+            if line.startswith('gitdir:'):
+                git = os.path.join(path, line[len('gitdir:'):].strip())
+        if os.path.isdir(git):
+            try:
+                with open(os.path.join(git, 'HEAD')) as f:
+                    head = f.readline().strip()
+            except OSError:
+                return ''
+            if head.startswith('ref: '):
+                return head[len('ref: '):].rsplit('refs/heads/', 1)[-1]
+            return head[:7]
+        parent = os.path.dirname(path)
+        if parent == path:
+            return ''
+        path = parent
+
+
+def _vcs_lookup(directory, done):
+    try:
+        branch = _read_branch(directory)
+    except (OSError, ValueError):
+        branch = ''  # Unreadable or undecodable .git/HEAD: no segment
+    with _vcs_lock:
+        _vcs_cache[directory] = branch
+        _vcs_pending.pop(directory, None)
+    done.set()
+
+
+def _vcs_worker_loop():
+    while True:
+        directory, done = _vcs_requests.get()
+        try:
+            _vcs_lookup(directory, done)
+        except Exception:
+            # Whatever went wrong, the worker must survive and nobody may wait on this lookup again
+            with _vcs_lock:
+                _vcs_cache.setdefault(directory, '')
+                _vcs_pending.pop(directory, None)
+            done.set()
+
+
+def _reset_vcs_after_fork():
+    """A forked child has no lookup thread, and the parent's may have held the lock."""
+    global _vcs_lock, _vcs_requests, _vcs_worker
+    _vcs_lock = threading.Lock()
+    _vcs_requests = SimpleQueue()
+    _vcs_worker = None
+    _vcs_pending.clear()
+
+
+os.register_at_fork(after_in_child=_reset_vcs_after_fork)
+
+
+def _segment_vcs():
+    global _vcs_worker
+    directory = _current_dir()
+    with _vcs_lock:
+        done = _vcs_pending.get(directory)
+        if done is None:
+            # Refresh every prompt (branch may change under us), on one long-lived thread
+            done = threading.Event()
+            _vcs_pending[directory] = done
+            if _vcs_worker is None:
+                _vcs_worker = threading.Thread(target=_vcs_worker_loop, name='vcs-prompt', daemon=True)
+                _vcs_worker.start()
+            _vcs_requests.put((directory, done))
+        cached = _vcs_cache.get(directory)
+    if cached is None:
+        # First visit: wait a little, but never block the prompt on a slow filesystem
+        done.wait(VCS_TIME_BUDGET)
+        with _vcs_lock:
+            cached = _vcs_cache.get(directory)
+    return [(Colors.MAGENTA, f" ({cached})")] if cached else []
+
+
+def _segment_duration():
+    duration = _prompt_state['duration']
+    if duration is None or duration < SLOW_COMMAND_SECONDS:
+        return []
+    return [(Colors.YELLOW, f" {duration:.1f}s")]
+
+
+def _segment_jobs():
+    count = _prompt_state['jobs']
+    return [(Colors.CYAN, f" [{count} job{'s' if count != 1 else ''}]")] if count else []
+
+
+def _segment_status():
+    status = _prompt_state['status']
+    return [(Colors.ERROR, f" [{status}]")] if status else []
+
+
+def _segment_symbol():
+    return [(Colors.PROMPT_SYMBOL, "$ ")]
+
+
+PROMPT_SEGMENTS = [_segment_user_host, _segment_cwd, _segment_vcs, _segment_duration,
+                   _segment_jobs, _segment_status, _segment_symbol]
+
+
+def _render_prompt():
+    pieces = []
+    for segment in PROMPT_SEGMENTS:
+        pieces.extend(segment())
+    return pieces
+
+
 # --- UI Functions ---
 def get_colored_prompt():
     """Return a beautifully colored shell prompt."""
-    # Get user, host, and current directory
-    user = os.environ.get('USER', 'user')
-    hostname = os.uname().nodename if hasattr(os, 'uname') else 'host'
-    cwd = os.getcwd()
-
-    # Shorten path for readability (e.g., /home/user -> ~)
-    home = os.path.expanduser('~')
-    if cwd.startswith(home):
-        cwd = '~' + cwd[len(home):]
-    
-    # Truncate long paths
-    if len(cwd) > 25:
-        cwd = "..." + cwd[-22:]
-
-    # Construct the prompt with colors
-    prompt = (
-        f"{Colors.PROMPT_USER}{user}@{hostname}{Colors.RESET}:"
-        f"{Colors.PROMPT_DIR}{cwd}{Colors.RESET}"
-        f"{Colors.PROMPT_SYMBOL}$ {Colors.RESET}"
-    )
-    return prompt
+    return ''.join(f"{color}{text}{Colors.RESET}" if color else text for color, text in _render_prompt())
+
+
+def get_plain_prompt():
+    """Return the shell prompt without color codes (for the GUI)."""
+    return ''.join(text for color, text in _render_prompt())
 
 def print_banner():
     """Print a beautiful startup banner."""
@@ -76,17 +266,27 @@ Type {Colors.YELLOW}'help'{Colors.RESET} for a list of commands or {Colors.YELLO
 
 def print_success(message):
     """Print a success message in green."""
-    print(f"{Colors.SUCCESS}[+] {message}{Colors.RESET}")
+    if _decorate:
+        print(f"{Colors.SUCCESS}[+] {message}{Colors.RESET}")
 
 def print_error(message):
     """Print an error message in red."""
-    print(f"{Colors.ERROR}[-] {message}{Colors.RESET}")
+    if _decorate:
+        print(f"{Colors.ERROR}[-] {message}{Colors.RESET}")
+    else:
+        print(f"customshell: {message}", file=sys.stderr)
+
+def print_failure(message):
+    """Print a command's non-zero exit in red (interactive only; batch callers check the status)."""
+    if _decorate:
+        print(f"{Colors.ERROR}[-] {message}{Colors.RESET}")
 
 def print_info(message):
     """Print an informational message in yellow."""
-    print(f"{Colors.INFO}[i] {message}{Colors.RESET}")
+    if _decorate:
+        print(f"{Colors.INFO}[i] {message}{Colors.RESET}")
 
 def strip_ansi_codes(text):
     """Remove ANSI escape codes from a string."""
-    # The regex needs to handle the literal \033 that comes from the string
-    return re.sub(r'\033\[[0-?]*[ -/]*[@-~]', '', text)
+    import re
+    return re.sub(ANSI_ESCAPE_PATTERN, '', text)
@@ -1,102 +1,479 @@
 import os
-import glob  #helps in auto-completion
-from ui import print_error, print_success
+import fcntl
+from collections import deque
+from collections.abc import MutableMapping
+from ui import print_error
+from completion_index import complete_command, complete_path, register_aliases
 
-# Check if readline is available, if not, create dummy functions
-try:
-    import readline
-    READLINE_AVAILABLE = True
-except ImportError:
-    READLINE_AVAILABLE = False
+# readline is imported by setup_readline, so batch runs (-c, scripts) never pay
+# for it; READLINE_AVAILABLE is True once it has been loaded
+readline = None
+READLINE_AVAILABLE = False
 
 # --- Command History ---
 HISTORY_FILE = os.path.expanduser("~/.customshell_history")
+HISTORY_LENGTH = 1000        # Entries kept by compaction (and in readline's memory)
+HISTORY_COMPACT_EVERY = 64   # Appends between checks whether the log needs compacting
+
+# How much of the shared history log this session has already seen
+_history_inode = None
+_history_offset = 0
+_history_appends = 0
 
 # --- Alias Management ---
 ALIASES_FILE = os.path.expanduser("~/.customshell_aliases")
+ALIAS_MEMO_SIZE = 512        # Expanded lines remembered per alias set
 
-def setup_readline():
-    """Enable history and autocompletion for the CLI."""
-    if READLINE_AVAILABLE:
-        if not os.path.exists(HISTORY_FILE):
-            open(HISTORY_FILE, 'w').close()
+def setup_readline(aliases=None):
+    """Load readline and enable autocompletion for the CLI (load_history reads the history)."""
+    global readline, READLINE_AVAILABLE
+    if aliases is not None:
+        register_aliases(aliases)
+    try:
+        import readline
+    except ImportError:
+        return
+    READLINE_AVAILABLE = True
+    readline.set_completer(completer)
+    # Complete whole words (paths included), not fragments between '/' or '-'
+    readline.set_completer_delims(' \t\n;|&<>')
+    readline.parse_and_bind("tab: complete")
+
+
+def load_history():
+    """Read the history log into readline and remember how much of it we have seen.
+
+    Must run before the first input(): readline fixes its history position
+    when it starts reading a line, so entries loaded from a hook are not
+    reachable until the next prompt.
+    """
+    global _history_inode, _history_offset
+    if not READLINE_AVAILABLE:
+        return
+    if not os.path.exists(HISTORY_FILE):
+        open(HISTORY_FILE, 'w').close()
+    readline.read_history_file(HISTORY_FILE)
+    readline.set_history_length(HISTORY_LENGTH)
+    st = os.stat(HISTORY_FILE)
+    _history_inode, _history_offset = st.st_ino, st.st_size
+
+
+def refresh_history():
+    """Bring readline's history up to date with the log, e.g. in a session forked long after load_history."""
+    global _history_inode, _history_offset
+    if not READLINE_AVAILABLE or _history_inode is None:
+        load_history()
+        return
+    fd = _open_history_locked()
+    try:
+        st = os.fstat(fd)
+        if st.st_ino == _history_inode and st.st_size >= _history_offset:
+            _merge_history(fd)
+            return
+        # Compacted since we read it: start over from the new file
+        readline.clear_history()
         readline.read_history_file(HISTORY_FILE)
-        readline.set_history_length(1000)
-        readline.set_completer(completer)
-        readline.parse_and_bind("tab: complete")
+        _history_inode, _history_offset = st.st_ino, st.st_size
+    finally:
+        os.close(fd)
+
+
+def _open_history_locked():
+    """Open the history log for appending with an exclusive lock, following compaction renames."""
+    while True:
+        fd = os.open(HISTORY_FILE, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.stat(HISTORY_FILE).st_ino == os.fstat(fd).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        # Another shell swapped in a compacted file while we waited; use the new one
+        os.close(fd)
+
+
+def _merge_history(fd):
+    """Pull entries other sessions appended since we last looked (lock must be held)."""
+    global _history_inode, _history_offset
+    st = os.fstat(fd)
+    if st.st_ino != _history_inode or st.st_size < _history_offset:
+        # Compacted by another session: our offset means nothing in the new file
+        _history_inode, _history_offset = st.st_ino, st.st_size
+        return
+    if st.st_size > _history_offset:
+        new = os.pread(fd, st.st_size - _history_offset, _history_offset)
+        _history_offset = st.st_size
+        if READLINE_AVAILABLE:
+            for line in new.decode(errors='replace').splitlines():
+                if line:
+                    readline.add_history(line)
+
 
 def save_history(command):
-    """Append a command to the history file."""
+    """Append a command to the history log with one O_APPEND write."""
+    global _history_offset, _history_appends
+    fd = _open_history_locked()
+    try:
+        _merge_history(fd)
+        os.write(fd, (command + '\n').encode())
+        _history_offset = os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)  # Also releases the lock
+
     if READLINE_AVAILABLE:
         readline.add_history(command)
-        readline.write_history_file(HISTORY_FILE)
-    else:
-        # Fallback for non-readline environments
-        with open(HISTORY_FILE, 'a') as f:
-            f.write(command + '\n')
 
+    _history_appends += 1
+    if _history_appends >= HISTORY_COMPACT_EVERY:
+        _history_appends = 0
+        compact_history()
 
-def load_aliases():
-    """Load aliases from the alias file into a dictionary."""
-    aliases = {}
-    if os.path.exists(ALIASES_FILE):
+
+def compact_history(keep=None):
+    """Trim the history log to its newest `keep` entries via write-and-rename."""
+    global _history_inode, _history_offset
+    keep = keep or HISTORY_LENGTH
+    fd = _open_history_locked()
+    try:
+        _merge_history(fd)
+        with open(os.dup(fd), 'rb') as f:
+            f.seek(0)
+            tail = deque(f, maxlen=keep + 1)
+        if len(tail) <= keep:
+            return  # Not over the limit yet
+        tail.popleft()
+
+        tmp_path = f"{HISTORY_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as tmp:
+            tmp.writelines(tail)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.chmod(tmp_path, 0o600)
+        # Writers blocked on our lock notice the inode change and reopen the new file
+        os.replace(tmp_path, HISTORY_FILE)
+        st = os.stat(HISTORY_FILE)
+        _history_inode, _history_offset = st.st_ino, st.st_size
+    finally:
+        os.close(fd)
+
+    if READLINE_AVAILABLE:
+        # readline's in-memory list is not bounded by set_history_length
+        while readline.get_current_history_length() > keep:
+            readline.remove_history_item(0)
+
+
+def iter_history():
+    """Yield history entries oldest first, streaming the log instead of loading it."""
+    with open(HISTORY_FILE, 'r', errors='replace') as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+
+def _open_aliases_locked():
+    """Open the alias file with an exclusive lock, following renames by other shells."""
+    while True:
+        fd = os.open(ALIASES_FILE, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
         try:
-            with open(ALIASES_FILE, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#') and '=' in line:
-                        key, value = line.split('=', 1)
-                        aliases[key.strip()] = value.strip().strip("'\"")
-        except Exception as e:
-            print_error(f"Failed to load aliases: {e}")
+            if os.stat(ALIASES_FILE).st_ino == os.fstat(fd).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+def _parse_alias_value(value):
+    """Undo the quoting written by _format_alias (older files used plain '...' or "...")."""
+    if value[:1] in ('"', "'"):
+        import shlex
+        try:
+            parts = shlex.split(value)
+        except ValueError:
+            parts = []
+        if len(parts) == 1:
+            return parts[0]
+    return value.strip("'\"")
+
+
+def _parse_aliases(text):
+    aliases = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#') and '=' in line:
+            key, value = line.split('=', 1)
+            aliases[key.strip()] = _parse_alias_value(value.strip())
     return aliases
 
 
+def _format_alias(name, command):
+    return f"{name}='" + command.replace("'", "'\\''") + "'\n"
+
+
+def _write_aliases(aliases):
+    """Replace the alias file atomically (write, fsync, rename); returns the new file's stat."""
+    tmp_path = f"{ALIASES_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as tmp:
+        tmp.writelines(_format_alias(name, command) for name, command in aliases.items())
+        tmp.flush()
+        os.fsync(tmp.fileno())
+    os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, ALIASES_FILE)
+    return os.stat(ALIASES_FILE)
+
+
+def _stamp(st):
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class AliasStore(MutableMapping):
+    """The alias table, kept in sync with the alias file and with other shells.
+
+    Every read first stats the file and reloads only if its inode, mtime or
+    size changed. Assignments and deletions stay pending until save(), which
+    merges them into the file's current contents under a lock and swaps the
+    file in with a rename, so concurrent shells never lose each other's
+    aliases. Expanded lines are memoized until the alias set changes.
+    """
+
+    def __init__(self):
+        self._aliases = {}
+        self._stamp = False         # Stamp of the file we loaded; False: not loaded yet
+        self._pending = {}          # name -> command, or None for a removal, not yet saved
+        self._memo = {}             # line -> expanded line, for the current alias set
+
+    def _refresh(self):
+        try:
+            stamp = _stamp(os.stat(ALIASES_FILE))
+        except FileNotFoundError:
+            stamp = None
+        except OSError:
+            return
+        if stamp == self._stamp:
+            return
+        aliases = {}
+        if stamp is not None:
+            try:
+                with open(ALIASES_FILE, 'r') as f:
+                    aliases = _parse_aliases(f.read())
+            except Exception as e:
+                print_error(f"Failed to load aliases: {e}")
+        self._set_contents(aliases, stamp)
+
+    def _set_contents(self, aliases, stamp):
+        for name, command in self._pending.items():
+            if command is None:
+                aliases.pop(name, None)
+            else:
+                aliases[name] = command
+        self._aliases = aliases
+        self._stamp = stamp
+        self._memo = {}
+
+    def __getitem__(self, name):
+        self._refresh()
+        return self._aliases[name]
+
+    def __setitem__(self, name, command):
+        self._refresh()
+        self._pending[name] = command
+        self._aliases[name] = command
+        self._memo = {}
+
+    def __delitem__(self, name):
+        self._refresh()
+        del self._aliases[name]
+        self._pending[name] = None
+        self._memo = {}
+
+    def __iter__(self):
+        self._refresh()
+        return iter(list(self._aliases))
+
+    def __len__(self):
+        self._refresh()
+        return len(self._aliases)
+
+    def __contains__(self, name):
+        self._refresh()
+        return name in self._aliases
+
+    def save(self):
+        """Merge pending changes into the alias file and replace it atomically."""
+        if not self._pending:
+            return
+        fd = _open_aliases_locked()
+        try:
+            with open(os.dup(fd), 'r') as f:
+                aliases = _parse_aliases(f.read())
+            self._set_contents(aliases, None)
+            self._stamp = _stamp(_write_aliases(aliases))
+            self._pending.clear()
+        finally:
+            os.close(fd)  # Also releases the lock
+
+    def expand(self, command_line):
+        """expand_alias for this store, memoized per alias set."""
+        self._refresh()
+        memo = self._memo
+        expanded = memo.get(command_line)
+        if expanded is None:
+            expanded = _expand_aliases(command_line, self._aliases) if self._aliases else command_line
+            if len(memo) >= ALIAS_MEMO_SIZE:
+                memo.clear()
+            memo[command_line] = expanded
+        return expanded
+
+
+def load_aliases():
+    """Return the alias store; the file is read on first use and whenever it changes."""
+    return AliasStore()
+
+
 def save_aliases(aliases):
-    """Save the entire aliases dictionary to the file, overwriting it."""
+    """Persist aliases: an AliasStore merges its changes, a plain dict replaces the file."""
     try:
-        with open(ALIASES_FILE, 'w') as f:
-            for name, command in aliases.items():
-                f.write(f"{name}='{command}'\n")
+        if isinstance(aliases, AliasStore):
+            aliases.save()
+        else:
+            _write_aliases(aliases)
         return True
     except Exception as e:
         print_error(f"Failed to save aliases: {e}")
         return False
 
 
-def expand_alias(command_line, aliases):
-    """Expand the first part of a command if it's an alias."""
-    parts = command_line.split(maxsplit=1)
-    if not parts:
-        return ""
-    cmd = parts[0]
-    if cmd in aliases:
-        expanded_cmd = aliases[cmd]
-        if len(parts) > 1:
-            return f"{expanded_cmd} {parts[1]}"
+# Characters that end an unquoted word, and those after which a new command starts
+_WORD_BREAKS = ' \t\n;&|()<>'
+_COMMAND_BREAKS = ';&|(\n'
+# Reserved words after which the next word is again in command position
+_COMMAND_PREFIXES = frozenset({'if', 'then', 'else', 'elif', 'while', 'until', 'do', '{', '!', 'time'})
+
+
+def _skip_balanced(line, i, opening, closing):
+    """Index just past the bracket matching line[i] (an opening), honoring quotes."""
+    depth = 0
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c in '\'"`':
+            i = _skip_quoted(line, i)
+            continue
+        if c == opening:
+            depth += 1
+        elif c == closing:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return n
+
+
+def _skip_quoted(line, i):
+    """Index just past the quoted string starting at line[i]."""
+    quote = line[i]
+    n = len(line)
+    i += 1
+    while i < n and line[i] != quote:
+        if line[i] == '\\' and quote != "'":
+            i += 1
+        i += 1
+    return i + 1
+
+
+def _word_end(line, i):
+    n = len(line)
+    while i < n and line[i] not in _WORD_BREAKS:
+        c = line[i]
+        if c == '\\':
+            i += 2
+        elif c in '\'"`':
+            i = _skip_quoted(line, i)
+        elif c == '$' and line[i + 1:i + 2] in ('(', '{'):
+            bracket = line[i + 1]
+            i = _skip_balanced(line, i + 1, bracket, ')' if bracket == '(' else '}')
         else:
-            return expanded_cmd
-    return command_line
+            i += 1
+    return min(i, n)
+
+
+def _expand_aliases(line, aliases, active=frozenset()):
+    """Replace aliases in command position, re-expanding their text.
+
+    An alias is not expanded again inside its own expansion (active), which
+    ends both 'ls=ls -F' style self references and longer cycles. An
+    expansion ending in a blank makes the next word eligible too.
+    """
+    out = []
+    i, n = 0, len(line)
+    command_position = True
+    check_next = False     # Previous alias ended in a blank
+    skip_word = False      # Next word is a redirection target
+    while i < n:
+        c = line[i]
+        if c in ' \t':
+            out.append(c)
+            i += 1
+            continue
+        if c in _COMMAND_BREAKS:
+            out.append(c)
+            i += 1
+            command_position, check_next, skip_word = True, False, False
+            continue
+        if c in '<>)':
+            out.append(c)
+            i += 1
+            skip_word = c != ')'
+            continue
+        if c == '#':
+            out.append(line[i:])
+            break
+        end = max(_word_end(line, i), i + 1)
+        word = line[i:end]
+        i = end
+        if skip_word:
+            out.append(word)
+            skip_word = False
+            continue
+        if ((command_position or check_next) and word in aliases and word not in active
+                and not any(q in word for q in '\'"\\$`')):
+            command = aliases[word]
+            out.append(_expand_aliases(command, aliases, active | {word}))
+            check_next = command.endswith((' ', '\t'))
+            command_position = False
+            continue
+        out.append(word)
+        command_position = command_position and word in _COMMAND_PREFIXES
+        check_next = False
+    return ''.join(out)
+
+
+def expand_alias(command_line, aliases):
+    """Expand aliases in command position (recursively, see _expand_aliases)."""
+    if isinstance(aliases, AliasStore):
+        return aliases.expand(command_line)
+    return _expand_aliases(command_line, aliases) if aliases else command_line
 
 
 # --- Autocompletion Logic (for readline) ---
-COMMANDS = [
-    'help', 'cd', 'exit', 'history', 'alias', 'pwd', 'jobs',
-    'ls', 'cat', 'grep', 'echo', 'touch', 'mkdir', 'mv', 'rm', 'cp'
-]
+# Matches for the word being completed; readline asks for them one `state` at a time
+_completion_matches = []
 
 def completer(text, state):
     """Autocompletion function for commands and file paths."""
-    line = readline.get_line_buffer()
-    begin = readline.get_begidx()
-    
-    if begin == 0:
-        options = [cmd for cmd in COMMANDS if cmd.startswith(text)]
-    else:
-        options = glob.glob(text + '*')
-        options = [o + '/' if os.path.isdir(o) else o for o in options]
+    global _completion_matches
+    if state == 0:
+        # Compute the candidate list once per Tab press, then serve it by index
+        begin = readline.get_begidx()
+        line = readline.get_line_buffer()[:begin]
+        if not line.strip() or line.rstrip()[-1] in '|;&':
+            _completion_matches = complete_command(text)
+        else:
+            _completion_matches = complete_path(text)
 
-    if state < len(options):
-        return options[state]
+    if state < len(_completion_matches):
+        return _completion_matches[state]
     else:
         return None
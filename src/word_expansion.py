@@ -0,0 +1,412 @@
+import os
+import time
+import signal
+from functools import lru_cache
+
+import command_exec
+from command_exec import spawn_function, add_job, wait_for_job, SPAWN_DUP2, SPAWN_CLOSE
+from glob_engine import compile_pattern
+from zero_copy import grow_pipe
+from shell_parser import scan_expansion
+
+# Parameter expansion ($name, ${name}, ${name:-word} and the other POSIX
+# operators, $?, $$, $#, $@, $*, $0-$9), command substitution ($(...) and
+# `...`) and field splitting on $IFS.
+#
+# A word is first turned into "units": one (char, quote) pair per literal
+# character, quote being the word part's quoting (None when bare), and one
+# (source text, SUBST or QUOTED_SUBST) pair per expansion. Both markers are
+# truthy, so brace expansion (glob_engine.brace_expand) treats an expansion as
+# a quoted, indivisible piece and '{a,$x}' still expands while '$(echo {1,2})'
+# is left to the inner shell. expand_fields then substitutes and splits the
+# units into fields of (char, quoted) pairs ready for globbing, where only
+# unquoted expansion results and bare literals can match wildcards.
+#
+# What the expansion needs from the shell comes from a scope object with
+# get(name) -> str or None, params() -> list, assign(name, value) and
+# subshell(text) -> function that runs text in a forked shell (core_shell).
+#
+# $(...) runs in a forked copy of the shell with stdout on a pipe. The output
+# is read incrementally into one buffer capped at CAPTURE_MAX_BYTES; past the
+# cap the pipe is closed (the writer dies of SIGPIPE) and the command fails.
+
+SUBST = '$'                 # Unit kinds for expansions outside and inside double quotes
+QUOTED_SUBST = '"$'
+DEFAULT_IFS = ' \t\n'
+SPECIAL_PARAMS = '?$#@*0'
+ALL_PARAMS = ('$@', '${@}', '$*', '${*}')
+# ${name<op>word} operators, longest first so ':-' is not read as ':'
+OPERATORS = (':-', ':=', ':?', ':+', '##', '%%', '-', '=', '?', '+', '#', '%')
+CAPTURE_CHUNK = 256 * 1024
+try:
+    CAPTURE_MAX_BYTES = int(os.environ.get('CUSTOMSHELL_SUBST_MAX', 16 << 20))
+except ValueError:
+    CAPTURE_MAX_BYTES = 16 << 20
+
+
+class ExpansionError(ValueError):
+    """A word could not be expanded (bad substitution, ${name:?}, oversized output); the command is not run."""
+
+
+class UnsetParameterError(ExpansionError):
+    """${name:?word} of an unset or null parameter; a non-interactive shell exits on it."""
+
+
+def has_substitution(parts):
+    """Cheap pre-check: could parameter or command substitution change this word?"""
+    return any(quote in (None, '"') and ('$' in text or '`' in text) for text, quote in parts)
+
+
+def _is_name(text):
+    return bool(text) and (text[0].isalpha() or text[0] == '_') and all(c.isalnum() or c == '_' for c in text)
+
+
+def _dollar_end(text, i):
+    """If text[i] starts an expansion, return the index just past it, else None."""
+    c = text[i]
+    if c == '`' or text.startswith(('$(', '${'), i):
+        return scan_expansion(text, i)
+    if c != '$' or i + 1 >= len(text):
+        return None
+    nxt = text[i + 1]
+    if nxt in SPECIAL_PARAMS or nxt.isdigit():
+        return i + 2
+    if nxt.isalpha() or nxt == '_':
+        end = i + 2
+        while end < len(text) and (text[end].isalnum() or text[end] == '_'):
+            end += 1
+        return end
+    return None
+
+
+@lru_cache(maxsize=1024)
+def word_units(parts):
+    """(text, quote) word parts -> tuple of units for brace expansion and expand_fields."""
+    units = []
+    for text, quote in parts:
+        if not text:
+            units.append(('', quote or "'"))  # '' and "" still make a word
+        elif quote not in (None, '"'):
+            units.extend((c, quote) for c in text)
+        else:
+            i = 0
+            while i < len(text):
+                end = _dollar_end(text, i)
+                if end:
+                    units.append((text[i:end], QUOTED_SUBST if quote else SUBST))
+                    i = end
+                else:
+                    units.append((text[i], quote))
+                    i += 1
+    return tuple(units)
+
+
+def _operand_parts(text, quoted):
+    """Parts of the word after a ${name<op>...} operator, quotes and escapes resolved."""
+    parts = []
+    inner = '"' if quoted else None
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if c == '\\' and i + 1 < n and (not quoted or text[i + 1] in '$`"\\'):
+            parts.append((text[i + 1], '\\'))
+            i += 2
+        elif c == "'" and not quoted:
+            end = text.find("'", i + 1)
+            end = n if end < 0 else end
+            parts.append((text[i + 1:end], "'"))
+            i = end + 1
+        elif c == '"':
+            inner = None if inner else '"'
+            if inner:
+                parts.append(('', '"'))
+            i += 1
+        else:
+            end = _dollar_end(text, i) or i + 1
+            parts.append((text[i:end], inner))
+            i = end
+    return tuple(parts)
+
+
+@lru_cache(maxsize=512)
+def _operand_units(word, quoted):
+    return word_units(_operand_parts(word, quoted))
+
+
+# --- Substitution ---
+
+def _value(name, scope):
+    """A parameter's value, or None if unset."""
+    if name in ('@', '*'):
+        params = scope.params()
+        return ' '.join(params) if params else None
+    return scope.get(name)
+
+
+def _operand(word, scope, quoted):
+    """Expand an operator's word to (char, quoted) pairs; no field splitting yet."""
+    chars = []
+    for text, kind in _operand_units(word, quoted):
+        if kind in (SUBST, QUOTED_SUBST):
+            value = substitute(text, scope, kind == QUOTED_SUBST)
+            if isinstance(value, str):
+                inner = quoted or kind == QUOTED_SUBST
+                chars.extend((c, inner) for c in value)
+            else:
+                chars.extend(value)
+        else:
+            chars.extend((c, bool(kind)) for c in text)
+    return chars
+
+
+def _strip(value, op, pattern):
+    """${name#pattern} and friends: remove the shortest/longest matching prefix/suffix."""
+    regex = compile_pattern(pattern)
+    n = len(value)
+    if op[0] == '#':
+        cuts = range(n, -1, -1) if op == '##' else range(n + 1)
+        for i in cuts:
+            if regex.match(value[:i]):
+                return value[i:]
+    else:
+        cuts = range(n + 1) if op == '%%' else range(n, -1, -1)
+        for i in cuts:
+            if regex.match(value[i:]):
+                return value[:i]
+    return value
+
+
+@lru_cache(maxsize=512)
+def _parse_parameter(body):
+    """${body} -> (is ${#name}, name, operator or None, operator's word); raises ExpansionError."""
+    if body.startswith('#') and len(body) > 1:
+        name = body[1:]
+        if not (_is_name(name) or name.isdigit() or (len(name) == 1 and name in SPECIAL_PARAMS)):
+            raise ExpansionError(f"${{{body}}}: bad substitution")
+        return True, name, None, ''
+    if body and body[0] in SPECIAL_PARAMS:
+        name = body[:1]
+    else:
+        end = 0
+        while end < len(body) and (body[end].isalnum() or body[end] == '_'):
+            end += 1
+        name = body[:end]
+        if not (_is_name(name) or name.isdigit()):
+            raise ExpansionError(f"${{{body}}}: bad substitution")
+    rest = body[len(name):]
+    if not rest:
+        return False, name, None, ''
+    op = next((op for op in OPERATORS if rest.startswith(op)), None)
+    if op is None:
+        raise ExpansionError(f"${{{body}}}: bad substitution")
+    return False, name, op, rest[len(op):]
+
+
+def _parameter(body, scope, quoted):
+    """Expand ${body}: a string, or (char, quoted) pairs when the value comes from an operator's word."""
+    length, name, op, word = _parse_parameter(body)
+    if length:
+        if name in ('@', '*'):
+            return str(len(scope.params()))
+        return str(len(_value(name, scope) or ''))
+    if op is None:
+        return _value(name, scope) or ''
+    value = _value(name, scope)
+    is_set = value is not None and (op[0] != ':' or value != '')
+    kind = op.lstrip(':')
+    if kind == '-':
+        return value if is_set else _operand(word, scope, quoted)
+    if kind == '+':
+        return _operand(word, scope, quoted) if is_set else ''
+    if kind == '=':
+        if is_set:
+            return value
+        if not _is_name(name):
+            raise ExpansionError(f"${name}: cannot assign in this way")
+        value = ''.join(c for c, _ in _operand(word, scope, True))
+        scope.assign(name, value)
+        return value
+    if kind == '?':
+        if is_set:
+            return value
+        message = ''.join(c for c, _ in _operand(word, scope, True))
+        raise UnsetParameterError(f"{name}: {message or 'parameter null or not set'}")
+    return _strip(value or '', op, _operand(word, scope, quoted))
+
+
+def _unescape_backquoted(body):
+    """Inside `...` a backslash only quotes $, ` and another backslash."""
+    out = []
+    i = 0
+    while i < len(body):
+        if body[i] == '\\' and i + 1 < len(body) and body[i + 1] in '$`\\':
+            i += 1
+        out.append(body[i])
+        i += 1
+    return ''.join(out)
+
+
+def substitute(text, scope, quoted=False):
+    """Expand one SUBST unit's source text to a string or (char, quoted) pairs (see _parameter)."""
+    if text.startswith('$(('):
+        raise ExpansionError(f"{text}: arithmetic expansion is not supported")
+    if text.startswith('$('):
+        return command_output(text[2:-1], scope)
+    if text.startswith('`'):
+        return command_output(_unescape_backquoted(text[1:-1]), scope)
+    if text.startswith('${'):
+        return _parameter(text[2:-1], scope, quoted)
+    return _parameter(text[1:], scope, quoted)
+
+
+# --- Command substitution ---
+
+def capture(function, label='$(...)'):
+    """Run function() in a forked shell with stdout on a pipe; returns (output bytes, exit status).
+
+    Reads the pipe as the child writes it and raises ExpansionError once more
+    than CAPTURE_MAX_BYTES arrive.
+    """
+    read_fd, write_fd = os.pipe()
+    grow_pipe(read_fd)  # Fewer wakeups for large outputs
+    actions = [(SPAWN_DUP2, write_fd, 1), (SPAWN_CLOSE, read_fd), (SPAWN_CLOSE, write_fd)]
+    started = time.monotonic()
+    try:
+        with command_exec.job_lock:
+            pid = spawn_function(function, actions)
+            job = add_job([pid], None, label, True, names=['$(...)'], started=started)
+    except OSError:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
+
+    output = bytearray()
+    overflow = False
+    try:
+        while True:
+            chunk = os.read(read_fd, CAPTURE_CHUNK)
+            if not chunk:
+                break
+            if len(output) + len(chunk) > CAPTURE_MAX_BYTES:
+                overflow = True
+                break
+            output += chunk
+    finally:
+        # Anything still writing gets SIGPIPE instead of filling memory
+        os.close(read_fd)
+        codes = wait_for_job(job)
+    if overflow:
+        raise ExpansionError(f"{label}: output exceeds {CAPTURE_MAX_BYTES} bytes "
+                             f"(raise CUSTOMSHELL_SUBST_MAX to allow more)")
+    return bytes(output), 128 + signal.SIGTSTP if codes is None else codes[-1]
+
+
+def command_output(text, scope):
+    """$(text): the command's stdout without trailing newlines; its status goes to scope.substitution_status."""
+    output, status = capture(scope.subshell(text), f"$({text})")
+    scope.substitution_status = status
+    # argv strings cannot hold NUL bytes (bash drops them too)
+    return output.replace(b'\0', b'').decode('utf-8', 'surrogateescape').rstrip('\n')
+
+
+# --- Field splitting ---
+
+class _Fields:
+    """Collects the fields of one word while expansions are split on $IFS."""
+
+    def __init__(self, ifs):
+        self.ifs = ifs
+        self.whitespace = ''.join(c for c in ifs if c in ' \t\n')
+        self.fields = []
+        self.current = []
+        self.keep = False      # The current field stays even if empty ("" or '' seen)
+        self.pending = False   # IFS whitespace seen: the next character starts a new field
+
+    def add(self, chars):
+        if self.pending:
+            self.end()
+        self.current.extend(chars)
+
+    def keep_empty(self):
+        if self.pending:
+            self.end()
+        self.keep = True
+
+    def end(self, force=False):
+        if self.current or self.keep or force:
+            self.fields.append(self.current)
+        self.current = []
+        self.keep = self.pending = False
+
+    def split(self, chars):
+        """Add an unquoted expansion's (char, quoted) pairs, starting new fields at IFS characters."""
+        for c, quoted in chars:
+            if quoted or c not in self.ifs:
+                self.add([(c, quoted)])
+            elif c in self.whitespace:
+                if self.current or self.keep:
+                    self.pending = True
+            else:
+                # A non-whitespace separator always ends a field, even an empty one
+                self.end(force=True)
+
+    def separate(self):
+        """Boundary between the words of an unquoted $@ or $*."""
+        if self.current or self.keep:
+            self.pending = True
+
+
+def expand_fields(units, scope):
+    """Substitute and field-split units (see word_units); returns a list of (char, quoted) lists."""
+    ifs = scope.get('IFS')
+    fields = _Fields(DEFAULT_IFS if ifs is None else ifs)
+    for text, kind in units:
+        if kind not in (SUBST, QUOTED_SUBST):
+            if text:
+                fields.add([(text, bool(kind))])
+            else:
+                fields.keep_empty()
+            continue
+        quoted = kind == QUOTED_SUBST
+        if text in ALL_PARAMS:
+            params = scope.params()
+            if not quoted:
+                for i, param in enumerate(params):
+                    if i:
+                        fields.separate()
+                    fields.split([(c, False) for c in param])
+                continue
+            if '@' in text:
+                # "$@": one field per parameter, the first and last joined to the word around them
+                for i, param in enumerate(params):
+                    if i:
+                        fields.end(force=True)
+                    fields.keep_empty()
+                    fields.add([(c, True) for c in param])
+                continue
+            value = (' ' if ifs is None else ifs[:1]).join(params)
+        else:
+            value = substitute(text, scope, quoted)
+        if isinstance(value, str):
+            value = [(c, quoted) for c in value]
+        elif quoted:
+            value = [(c, True) for c, _ in value]
+        if quoted:
+            fields.keep_empty()
+            fields.add(value)
+        else:
+            fields.split(value)
+    fields.end()
+    return fields.fields
+
+
+def expand_value(parts, scope):
+    """Expand word parts without field splitting or globbing (assignments, redirection targets)."""
+    result = []
+    for text, kind in word_units(parts):
+        if kind in (SUBST, QUOTED_SUBST):
+            value = substitute(text, scope, True)
+            text = value if isinstance(value, str) else ''.join(c for c, _ in value)
+        result.append(text)
+    return ''.join(result)
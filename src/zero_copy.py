@@ -0,0 +1,212 @@
+import os
+import sys
+import stat
+import time
+import errno
+import fcntl
+
+# Moving bytes between file descriptors without passing them through Python:
+# splice() when either end is a pipe, copy_file_range() between regular files
+# and sendfile() from a regular file to anything else. Each Transfer starts
+# with the cheapest call its two fds allow and drops to the next one when the
+# kernel refuses (an O_APPEND target, a filesystem or device without support),
+# ending with plain read()/write() so any pair of fds still works.
+
+CHUNK = 1 << 20             # Bytes asked for per call
+PIPE_SIZE = 1 << 20         # Pipes we move data through are grown to this (F_SETPIPE_SZ)
+
+# Errors that mean "this call does not work for these fds", not a real I/O failure
+_UNSUPPORTED = frozenset({errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.EOPNOTSUPP, errno.EBADF})
+
+
+def fd_kind(fd):
+    """'pipe', 'file' (regular) or 'other' (tty, socket, device...)."""
+    mode = os.fstat(fd).st_mode
+    if stat.S_ISFIFO(mode):
+        return 'pipe'
+    return 'file' if stat.S_ISREG(mode) else 'other'
+
+
+def grow_pipe(fd):
+    """Raise a pipe's capacity so each splice moves more; silently keeps the default if not allowed."""
+    setpipe = getattr(fcntl, 'F_SETPIPE_SZ', None)
+    if setpipe is None:
+        return
+    try:
+        fcntl.fcntl(fd, setpipe, PIPE_SIZE)
+    except OSError:
+        pass
+
+
+def _splice(src, dst, size):
+    return os.splice(src, dst, size, flags=os.SPLICE_F_MOVE)
+
+
+def _copy_file_range(src, dst, size):
+    return os.copy_file_range(src, dst, size)
+
+
+def _sendfile(src, dst, size):
+    return os.sendfile(dst, src, None, size)
+
+
+def _read_write(src, dst, size):
+    data = os.read(src, size)
+    view = memoryview(data)
+    while view:
+        view = view[os.write(dst, view):]
+    return len(data)
+
+
+class Transfer:
+    """Moves data from src to dst, one kernel call per step().
+
+    Both fds keep their file positions up to date, as with read()/write().
+    """
+
+    def __init__(self, src, dst):
+        self.src = src
+        self.dst = dst
+        kinds = fd_kind(src), fd_kind(dst)
+        self.methods = []
+        if 'pipe' in kinds and hasattr(os, 'splice'):
+            for fd, kind in zip((src, dst), kinds):
+                if kind == 'pipe':
+                    grow_pipe(fd)
+            self.methods.append(_splice)
+        if kinds[0] == 'file':
+            if kinds[1] == 'file' and hasattr(os, 'copy_file_range'):
+                self.methods.append(_copy_file_range)
+            self.methods.append(_sendfile)
+        self.methods.append(_read_write)
+
+    @property
+    def method(self):
+        """Name of the call currently in use, for reports."""
+        return self.methods[0].__name__.lstrip('_')
+
+    def step(self, size=CHUNK):
+        """Move up to size bytes; returns how many, 0 at end of input."""
+        while True:
+            try:
+                return self.methods[0](self.src, self.dst, size)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED or len(self.methods) == 1:
+                    raise
+                self.methods.pop(0)
+
+
+def copy_fd(src, dst, progress=None):
+    """Copy everything from src to dst; returns the byte count. progress(n) is called after each step."""
+    transfer = Transfer(src, dst)
+    total = 0
+    while True:
+        n = transfer.step()
+        if not n:
+            return total
+        total += n
+        if progress is not None:
+            progress(n)
+
+
+def send_range(src, offset, count, dst):
+    """Copy count bytes of regular file src starting at offset to dst, leaving src's position alone."""
+    end = offset + count
+    while offset < end:
+        try:
+            n = os.sendfile(dst, src, offset, end - offset)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            break
+        if not n:
+            return
+        offset += n
+    while offset < end:
+        data = os.pread(src, min(CHUNK, end - offset), offset)
+        if not data:
+            return
+        view = memoryview(data)
+        while view:
+            view = view[os.write(dst, view):]
+        offset += len(data)
+
+
+def tee(src, targets):
+    """Copy src to every fd in targets.
+
+    The data goes once into the first target that is a regular file opened for
+    reading too (the anchor), by splice or copy_file_range, and is sent on to the
+    others from the anchor's page cache with sendfile. With no such target there
+    is nothing to send from, so a single target gets a Transfer and several get
+    a read()/write() loop.
+    """
+    anchor = next((fd for fd in targets if fd_kind(fd) == 'file' and _readable(fd)), None)
+    if anchor is None:
+        if len(targets) == 1:
+            return copy_fd(src, targets[0])
+        total = 0
+        while True:
+            data = os.read(src, CHUNK)
+            if not data:
+                return total
+            for fd in targets:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+            total += len(data)
+    others = [fd for fd in targets if fd != anchor]
+    transfer = Transfer(src, anchor)
+    total = 0
+    while True:
+        offset = os.lseek(anchor, 0, os.SEEK_CUR)
+        n = transfer.step()
+        if not n:
+            return total
+        for fd in others:
+            send_range(anchor, offset, n, fd)
+        total += n
+
+
+def _readable(fd):
+    return fcntl.fcntl(fd, fcntl.F_GETFL) & os.O_ACCMODE == os.O_RDWR
+
+
+def format_bytes(count):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if count < 1024:
+            return f"{count:.0f} {unit}" if unit == 'B' else f"{count:.2f} {unit}"
+        count /= 1024
+    return f"{count:.2f} TiB"
+
+
+class Meter:
+    """Byte count and rate of one stream, redrawn on stderr at most every interval seconds."""
+
+    def __init__(self, name=None, interval=1.0, stream=None):
+        self.label = f"{name}: " if name else ''
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.total = 0
+        self.started = time.monotonic()
+        self._last_time = self.started
+        self._last_total = 0
+
+    def __call__(self, n):
+        self.total += n
+        now = time.monotonic()
+        if now - self._last_time >= self.interval:
+            rate = (self.total - self._last_total) / (now - self._last_time)
+            self._draw(now, rate, '')
+            self._last_time, self._last_total = now, self.total
+
+    def _draw(self, now, rate, end):
+        elapsed = int(now - self.started)
+        self.stream.write(f"\r{self.label}{format_bytes(self.total):>12} {elapsed // 3600}:{elapsed // 60 % 60:02d}:"
+                          f"{elapsed % 60:02d} [{format_bytes(rate)}/s]{end}")
+        self.stream.flush()
+
+    def finish(self):
+        """Final line with the average rate."""
+        now = time.monotonic()
+        self._draw(now, self.total / max(now - self.started, 1e-9), '\n')
@@ -0,0 +1,25 @@
+import os
+import sys
+import subprocess
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'main.py')
+
+
+def run_shell(script, tmp_path):
+    return subprocess.run([sys.executable, MAIN, '-c', script], capture_output=True, text=True,
+                          cwd=tmp_path, env=dict(os.environ, HOME=str(tmp_path)), timeout=30)
+
+
+def test_high_fd_redirect_does_not_clobber_saved_stdout(tmp_path):
+    # The shell's saved stdout must not be the fd a later redirection ('3>file') targets
+    for fd in (3, 4, 10, 11):
+        result = run_shell(f"echo hi > out {fd}>other; echo after", tmp_path)
+        assert result.stdout == 'after\n', fd
+        assert (tmp_path / 'out').read_text() == 'hi\n'
+        assert (tmp_path / 'other').read_text() == ''
+
+
+def test_group_redirect_restores_stdout(tmp_path):
+    result = run_shell("{ echo g; } 3>other >out; echo after", tmp_path)
+    assert result.stdout == 'after\n'
+    assert (tmp_path / 'out').read_text() == 'g\n'